@@ -1,47 +1,237 @@
-from fastapi import APIRouter, BackgroundTasks, HTTPException
-from typing import List, Optional
+import os
+import hmac
+import json
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Query, Header, Response
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+from typing import Dict, List, Literal, Optional
 from pydantic import BaseModel
-from .core.loader import get_all_lectures
-from .services.task_manager import create_optimization_task, get_task_status
+from .core.loader import (get_all_lectures, search_lectures, reload_lectures_in_background, get_reload_state,
+                          catalog_sources, list_catalogs)
+from .utils.time_utils import parse_clock_to_minutes
+from .services.task_manager import create_optimization_task, get_task_status, request_cancel
 from .services.quantum_optimizer import optimize_timetable
+from .services.batch_optimizer import run_batch
+from .services.cohort_optimizer import optimize_cohort
+from .services.samplers import available_samplers
+from .services.portfolio import available_engines
+from .services.pareto import OBJECTIVE_WEIGHTS
+from .services.cost_model import get_state as get_cost_model_state
+from .services.tuning import load_tuned_defaults
+from .services.embedding_cache import get_stats as get_embedding_cache_stats
+from .services.metrics import profile_path, profile_summary
+from .services.session_manager import SESSION_OPS, create_session, apply_session_ops, delete_session
 
 router = APIRouter()
 
+# Penalty / annealing defaults of the autotuned profile, if one was written (services/tuning.py)
+TUNED_DEFAULTS = load_tuned_defaults()
+
 class OptimizationRequest(BaseModel):
     selected_lecture_ids: List[str]
     target_credits: Optional[float] = 21.0
+    # Semester / campus catalog to optimize over, e.g. "default:yangsan" (GET /catalogs; default: "default")
+    catalog_id: Optional[str] = None
     
     # Annealing configs
     use_quantum_annealing: Optional[bool] = False
     dwave_token: Optional[str] = None
+    # Structured sampler of the quantum path (see services/samplers.py): "dwave" or "mock_qpu"
+    qpu_sampler: Optional[str] = "dwave"
+    dwave_solver: Optional[str] = None
+    qpu_timeout: Optional[float] = 30.0
+    # Reuse minor embeddings of identical (same labels and edges) interaction graphs (services/embedding_cache.py).
+    # Every request draws a fresh random pool, so the hit rate is near zero unless stable_qpu_pool is set
+    embedding_cache: Optional[bool] = True
+    # QPU: derive the candidate pool from the request instead of drawing a new one, so repeated
+    # requests reuse their cached embedding (they then always get the same pool)
+    stable_qpu_pool: Optional[bool] = False
+    # Local stand-in QPU (qpu_sampler="mock_qpu")
+    mock_qpu_latency: Optional[float] = 0.5
+    mock_qpu_failure_rate: Optional[float] = 0.0
     max_candidates: Optional[int] = 300
+    # Seed of the random candidate subset (reproducible pools)
+    pool_seed: Optional[int] = None
     total_reads: Optional[int] = 100
     batch_size: Optional[int] = 100
+    # Best unique samples kept across sampling batches (memory does not grow with total_reads)
+    keep_samples: Optional[int] = 100
+    # Simulated Annealing schedule (default: neal's): sweeps per read, [hot, cold] multipliers of
+    # neal's default beta range and the schedule shape
+    num_sweeps: Optional[int] = TUNED_DEFAULTS.get("num_sweeps")
+    beta_range_scale: Optional[List[float]] = TUNED_DEFAULTS.get("beta_range_scale")
+    beta_schedule_type: Optional[Literal["geometric", "linear"]] = TUNED_DEFAULTS.get("beta_schedule_type")
+    # Let the cost model choose max_candidates / total_reads / batch_size for this end-to-end
+    # latency (Simulated Annealing only; the choice is returned in result.auto_parameters)
+    latency_budget_ms: Optional[float] = None
+    # Run the task under cProfile; download via /optimize/{task_id}/profile
+    profile: Optional[bool] = False
+
+    # Portfolio mode: race several engines (services/portfolio.py) under one time budget
+    portfolio: Optional[bool] = False
+    portfolio_engines: Optional[List[str]] = None  # default: all applicable
+    portfolio_time_budget: Optional[float] = 10.0
+
+    # Pareto mode: return the trade-off front between breakdown objectives (services/pareto.py)
+    pareto: Optional[bool] = False
+    pareto_objectives: Optional[List[str]] = None  # default: credit, free day and tension penalties
+
+    # How the credit target enters the model: "dense" (all pairs) or "cqm" (soft constraint for the
+    # Leap hybrid CQM solver, same optima with ~3.4x fewer objective interactions; dense without one)
+    credit_encoding: Optional[Literal["dense", "cqm"]] = "dense"
+
+    # Course choice: take exactly one lecture of each group (lecture ids and/or 교과목번호)
+    course_groups: Optional[List[List[str]]] = None
     
     # BQM Weights
-    w_hard_overlap: Optional[float] = 10000.0
+    w_hard_overlap: Optional[float] = TUNED_DEFAULTS.get("w_hard_overlap", 10000.0)
     w_target_credit: Optional[float] = 100.0
-    w_mandatory: Optional[float] = -10000.0
+    w_mandatory: Optional[float] = TUNED_DEFAULTS.get("w_mandatory", -10000.0)
     w_first_class: Optional[float] = 50.0
     w_lunch_overlap: Optional[float] = 30.0
     r_free_day: Optional[float] = 100.0
     p_free_day_break: Optional[float] = 500.0
     w_contiguous_reward: Optional[float] = -20.0
     w_tension_base: Optional[float] = 5.0
+    w_same_course: Optional[float] = TUNED_DEFAULTS.get("w_same_course", 10000.0)
+    w_course_group: Optional[float] = TUNED_DEFAULTS.get("w_course_group", 10000.0)
+    # Per unit of building distance, for breaks of at most transition_window minutes (up to 60)
+    w_distance: Optional[float] = 0.1
+    transition_window: Optional[int] = 30
+
+class BatchOptimizationRequest(BaseModel):
+    requests: List[OptimizationRequest]
+    # Worker processes to spread the batch over (default: one per CPU core)
+    max_workers: Optional[int] = None
+
+MAX_BATCH_SIZE = 1000
+
+class CohortOptimizationRequest(BaseModel):
+    # One preference set per student; selected_lecture_ids are the requested sections
+    students: List[OptimizationRequest]
+    # Catalog of the whole cohort (the students' own catalog_id must be unset or the same)
+    catalog_id: Optional[str] = None
+    # Lagrangian rounds (seat prices) before the capacity repair
+    max_iterations: Optional[int] = 20
+    price_step: Optional[float] = 100.0
+    # Bonus for the requested section over the other sections of its course
+    section_bonus: Optional[float] = 500.0
+    # Keep the requested sections mandatory instead of allowing moves to other sections
+    fixed_sections: Optional[bool] = False
+    # Candidate pool per student (capped at the student's own max_candidates)
+    max_candidates: Optional[int] = 80
+    # {lecture_id: seats}, replaces the catalog's 수강제한인원 (0 = not limited)
+    capacity_overrides: Optional[Dict[str, int]] = None
+    seed: Optional[int] = 0
+    # Worker processes (default: one per CPU core)
+    max_workers: Optional[int] = None
+
+MAX_COHORT_SIZE = 20000
+
+class SessionOp(BaseModel):
+    op: Literal[SESSION_OPS]
+    lecture_id: str
+
+class SessionOpsRequest(BaseModel):
+    ops: List[SessionOp]
+
+def _check_qpu_sampler(request: OptimizationRequest):
+    if request.qpu_sampler and request.qpu_sampler not in available_samplers():
+        raise HTTPException(status_code=400,
+                            detail=f"Unknown qpu_sampler '{request.qpu_sampler}'. Available: {', '.join(available_samplers())}")
+
+def _check_portfolio_engines(request: OptimizationRequest):
+    unknown = [name for name in request.portfolio_engines or [] if name not in available_engines()]
+    if unknown:
+        raise HTTPException(status_code=400,
+                            detail=f"Unknown portfolio engine(s) {', '.join(unknown)}. Available: {', '.join(available_engines())}")
+
+def _check_latency_budget(request: OptimizationRequest):
+    if request.latency_budget_ms is None:
+        return
+    if request.latency_budget_ms <= 0:
+        raise HTTPException(status_code=400, detail="latency_budget_ms must be positive.")
+    if request.use_quantum_annealing or request.portfolio or request.credit_encoding not in (None, "dense"):
+        raise HTTPException(status_code=400,
+                            detail="latency_budget_ms sizes the Simulated Annealing path (dense encoding) only.")
+
+def _check_annealing_schedule(request: OptimizationRequest):
+    if request.num_sweeps is not None and request.num_sweeps <= 0:
+        raise HTTPException(status_code=400, detail="num_sweeps must be positive.")
+    if request.beta_range_scale is not None and \
+            (len(request.beta_range_scale) != 2 or min(request.beta_range_scale) <= 0):
+        raise HTTPException(status_code=400, detail="beta_range_scale must be two positive multipliers [hot, cold].")
+
+def _check_catalog(catalog_id: Optional[str]):
+    if catalog_id is not None and catalog_id not in catalog_sources():
+        raise HTTPException(status_code=404, detail=f"Unknown catalog '{catalog_id}' (see GET /catalogs).")
+
+def _check_pareto_objectives(request: OptimizationRequest):
+    unknown = [name for name in request.pareto_objectives or [] if name not in OBJECTIVE_WEIGHTS]
+    if unknown:
+        raise HTTPException(status_code=400,
+                            detail=f"Unknown pareto objective(s) {', '.join(unknown)}. Available: {', '.join(OBJECTIVE_WEIGHTS)}")
+    if request.pareto_objectives is not None and len(set(request.pareto_objectives)) < 2:
+        raise HTTPException(status_code=400, detail="Pareto mode needs at least two distinct objectives.")
+
+@router.get("/catalogs")
+def get_catalogs():
+    """Lists the available semester / campus catalogs (catalog_id of the other endpoints)."""
+    return {"catalogs": list_catalogs()}
 
 @router.get("/lectures")
-def get_lectures():
+def get_lectures(catalog_id: Optional[str] = None):
     """Returns the list of all available lectures."""
-    lectures = get_all_lectures()
+    _check_catalog(catalog_id)
+    lectures = get_all_lectures(catalog_id)
     if not lectures:
         raise HTTPException(status_code=500, detail="Lectures not loaded properly.")
     return {"lectures": lectures}
 
+@router.get("/lectures/search")
+def search_lecture_catalog(
+    q: Optional[str] = None,
+    days: Optional[List[str]] = Query(None),
+    start_after: Optional[str] = None,
+    end_before: Optional[str] = None,
+    credit: Optional[float] = None,
+    no_conflict_with: Optional[List[str]] = Query(None),
+    limit: int = Query(50, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    catalog_id: Optional[str] = None,
+):
+    """Searches lectures by name/professor/course number/category with structured filters."""
+    _check_catalog(catalog_id)
+    if not get_all_lectures(catalog_id):
+        raise HTTPException(status_code=500, detail="Lectures not loaded properly.")
+    try:
+        start_min = parse_clock_to_minutes(start_after)
+        end_min = parse_clock_to_minutes(end_before)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return search_lectures(
+        q or "",
+        catalog_id=catalog_id,
+        days=days,
+        start_after=start_min,
+        end_before=end_min,
+        credit=credit,
+        no_conflict_with=no_conflict_with,
+        limit=limit,
+        offset=offset,
+    )
+
 @router.post("/optimize")
 def start_optimization(request: OptimizationRequest, background_tasks: BackgroundTasks):
     """Submits a timetable optimization task to run in the background."""
     if not request.selected_lecture_ids:
         raise HTTPException(status_code=400, detail="No lectures selected.")
+    _check_catalog(request.catalog_id)
+    _check_qpu_sampler(request)
+    _check_portfolio_engines(request)
+    _check_pareto_objectives(request)
+    _check_latency_budget(request)
+    _check_annealing_schedule(request)
         
     preferences = request.dict()
     task_id = create_optimization_task(preferences)
@@ -51,11 +241,197 @@ def start_optimization(request: OptimizationRequest, background_tasks: Backgroun
     
     return {"task_id": task_id, "status": "PENDING"}
 
+@router.post("/optimize/batch")
+def start_batch_optimization(request: BatchOptimizationRequest):
+    """
+    Optimizes many preference sets at once. Each request gets its own pool (bounded by its max_candidates),
+    and the pair structure of the pools is computed once for the whole batch.
+    Results are streamed back as NDJSON, one line per request in completion order:
+    {"index": <position in requests>, "status": "SUCCESS" | "FAILURE", "result" | "error": ...}
+    """
+    if not request.requests:
+        raise HTTPException(status_code=400, detail="No optimization requests given.")
+    if len(request.requests) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_SIZE} requests per batch.")
+    for i, item in enumerate(request.requests):
+        if not item.selected_lecture_ids:
+            raise HTTPException(status_code=400, detail=f"No lectures selected in request {i}.")
+        _check_qpu_sampler(item)
+        _check_portfolio_engines(item)
+        _check_pareto_objectives(item)
+        _check_annealing_schedule(item)
+        if item.latency_budget_ms is not None:
+            # The batch draws every pool up front, before any per-request size could be chosen
+            raise HTTPException(status_code=400, detail=f"latency_budget_ms is not supported in batches (request {i}).")
+    # One shared pair structure per batch: every request must use the same catalog
+    catalog_ids = {item.catalog_id for item in request.requests}
+    if len(catalog_ids) > 1:
+        raise HTTPException(status_code=400, detail="All requests of a batch must use the same catalog_id.")
+    _check_catalog(catalog_ids.pop())
+
+    preference_sets = [item.dict() for item in request.requests]
+
+    def stream_results():
+        for item in run_batch(preference_sets, max_workers=request.max_workers):
+            yield json.dumps(item, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+@router.post("/optimize/cohort")
+def start_cohort_optimization(request: CohortOptimizationRequest, background_tasks: BackgroundTasks):
+    """
+    Assigns timetables to a whole cohort under the per-section seat limits, as a background task
+    (poll GET /optimize/{task_id}). The result lists every student's sections plus the final seat prices.
+    """
+    if not request.students:
+        raise HTTPException(status_code=400, detail="No students given.")
+    if len(request.students) > MAX_COHORT_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_COHORT_SIZE} students per cohort.")
+    for i, item in enumerate(request.students):
+        if not item.selected_lecture_ids:
+            raise HTTPException(status_code=400, detail=f"No lectures selected for student {i}.")
+        if item.catalog_id not in (None, request.catalog_id):
+            raise HTTPException(status_code=400, detail=f"Student {i} uses another catalog than the cohort.")
+    _check_catalog(request.catalog_id)
+
+    cohort = request.dict()
+    # The task keeps a summary (it is sent with every poll); only the worker gets the students
+    summary = {key: value for key, value in cohort.items() if key not in ("students", "capacity_overrides")}
+    summary["num_students"] = len(request.students)
+    summary["num_capacity_overrides"] = len(request.capacity_overrides or {})
+    task_id = create_optimization_task(summary)
+    background_tasks.add_task(optimize_cohort, task_id, cohort)
+    return {"task_id": task_id, "status": "PENDING"}
+
 @router.get("/optimize/{task_id}")
-def check_optimization_status(task_id: str):
-    """Checks the status of a previously submitted optimization task."""
+def check_optimization_status(task_id: str, response: Response, since_version: Optional[int] = None,
+                              if_none_match: Optional[str] = Header(None)):
+    """
+    Checks the status of a previously submitted optimization task.
+    Every change bumps the task's version (also sent as the ETag). Pollers that send the last ETag as
+    If-None-Match, or the last version as since_version, get an empty 304 while nothing changed.
+    """
     status_info = get_task_status(task_id)
     if status_info["status"] == "NOT_FOUND":
         raise HTTPException(status_code=404, detail="Task not found")
-    
+
+    etag = f'"{status_info["version"]}"'
+    if (if_none_match is not None and etag in [tag.strip() for tag in if_none_match.split(",")]) or \
+            (since_version is not None and since_version >= status_info["version"]):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
     return status_info
+
+@router.post("/optimize/{task_id}/cancel")
+def cancel_optimization(task_id: str):
+    """
+    Stops a running task at its next sampling checkpoint. The task then finishes as SUCCESS with the
+    best schedules found so far (result.stopped_early), or as FAILURE if it had not found any yet.
+    Clients that already show the partial_result can cancel to free the server.
+    """
+    status = get_task_status(task_id)["status"]
+    if status == "NOT_FOUND":
+        raise HTTPException(status_code=404, detail="Task not found")
+    if not request_cancel(task_id):
+        raise HTTPException(status_code=409, detail=f"Task already finished ({status}).")
+    return {"task_id": task_id, "status": status, "cancel_requested": True}
+
+@router.get("/optimize/{task_id}/profile")
+def download_task_profile(task_id: str, format: Literal["pstats", "text"] = "pstats"):
+    """
+    Returns the cProfile capture of a task submitted with profile=true, once it has finished:
+    the raw pstats file (for snakeviz / pstats) or a text report sorted by cumulative time.
+    """
+    if get_task_status(task_id)["status"] == "NOT_FOUND":
+        raise HTTPException(status_code=404, detail="Task not found")
+    missing = HTTPException(status_code=404, detail="No profile for this task (submit with profile=true and wait "
+                                                    "for it to finish; only the most recent profiles are kept).")
+    if not profile_path(task_id).exists():
+        raise missing
+    if format == "text":
+        summary = profile_summary(task_id)
+        if summary is None:
+            raise missing
+        return PlainTextResponse(summary)
+    return FileResponse(profile_path(task_id), media_type="application/octet-stream", filename=f"{task_id}.prof")
+
+@router.post("/sessions")
+def start_session(request: OptimizationRequest):
+    """
+    Opens an interactive optimization session: builds and solves the model once and keeps it,
+    so follow-up edits (POST /sessions/{session_id}/ops) only patch it and re-solve warm-started.
+    """
+    if not request.selected_lecture_ids:
+        raise HTTPException(status_code=400, detail="No lectures selected.")
+    _check_catalog(request.catalog_id)
+    _check_qpu_sampler(request)
+    _check_portfolio_engines(request)
+    _check_annealing_schedule(request)
+    # A session keeps one BQM over a fixed pool and re-solves it in place
+    if request.latency_budget_ms is not None:
+        raise HTTPException(status_code=400, detail="latency_budget_ms is not supported for sessions.")
+    if request.pareto:
+        raise HTTPException(status_code=400, detail="pareto is not supported for sessions.")
+    if request.credit_encoding == "cqm":
+        raise HTTPException(status_code=400, detail="credit_encoding 'cqm' is not supported for sessions.")
+    try:
+        session_id, result = create_session(request.dict())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"session_id": session_id, "result": result}
+
+@router.post("/sessions/{session_id}/ops")
+def update_session(session_id: str, request: SessionOpsRequest):
+    """Applies delta operations (mark_mandatory, exclude, add_candidate, ...) in order and returns the re-solved result."""
+    if not request.ops:
+        raise HTTPException(status_code=400, detail="No operations given.")
+    try:
+        result = apply_session_ops(session_id, [item.dict() for item in request.ops])
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Session not found (it may have expired).")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"session_id": session_id, "result": result}
+
+@router.delete("/sessions/{session_id}")
+def close_session(session_id: str):
+    if not delete_session(session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"session_id": session_id, "status": "DELETED"}
+
+def _check_admin_token(x_admin_token: Optional[str]):
+    """Admin endpoints require the X-Admin-Token header to match ADMIN_TOKEN; without ADMIN_TOKEN they are disabled."""
+    expected = os.environ.get("ADMIN_TOKEN")
+    if not expected:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (ADMIN_TOKEN is not set).")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token.encode(), expected.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token.")
+
+@router.post("/admin/catalog/reload")
+def reload_catalog(catalog_id: Optional[str] = None, x_admin_token: Optional[str] = Header(None)):
+    """Rebuilds a lecture catalog (default: "default") in the background and swaps it in when ready."""
+    _check_admin_token(x_admin_token)
+    _check_catalog(catalog_id)
+    started = reload_lectures_in_background(catalog_id)
+    state = get_reload_state(catalog_id)
+    state["status"] = "RELOADING" if started else "ALREADY_RELOADING"
+    return state
+
+@router.get("/admin/catalog")
+def get_catalog_state(catalog_id: Optional[str] = None, x_admin_token: Optional[str] = Header(None)):
+    """Returns a catalog's active version, the resident catalogs and the state of the last reload."""
+    _check_admin_token(x_admin_token)
+    _check_catalog(catalog_id)
+    return get_reload_state(catalog_id)
+
+@router.get("/admin/cost-model")
+def get_cost_model(x_admin_token: Optional[str] = Header(None)):
+    """Returns the latency cost model of this worker: coefficients, their profile and the live corrections."""
+    _check_admin_token(x_admin_token)
+    return get_cost_model_state()
+
+@router.get("/admin/embedding-cache")
+def get_embedding_cache(x_admin_token: Optional[str] = Header(None)):
+    """Returns the embedding cache hit rate and embedding times of this worker."""
+    _check_admin_token(x_admin_token)
+    return get_embedding_cache_stats()
@@ -1,54 +1,469 @@
-import pandas as pd
-import pathlib
-
-# In-memory storage for lectures
-global_lectures_store = []
-
-def load_lectures():
-    global global_lectures_store
-    data_path = pathlib.Path(__file__).parent.parent.parent / "data" / "lectures.csv"
-    
-    if not data_path.exists():
-        print(f"Warning: Data file not found at {data_path}")
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from .snapshot import (
+    DATA_DIR, DEFAULT_CSV_PATH, default_snapshot_dir, compile_snapshot, load_snapshot, snapshot_lectures,
+    catalog_arrays, decode_string_table
+)
+from ..utils.text_utils import normalize_text, is_chosung_query, query_ngrams
+from ..utils.location_utils import CAMPUS_IDS
+
+DAYS = ['월', '화', '수', '목', '금', '토', '일']
+
+# Catalog ids: "<semester>" or "<semester>:<campus>". The semester "default" is data/lectures.csv,
+# every other one a data/catalogs/<semester>.csv; a campus id (CAMPUS_IDS) restricts the semester to
+# the lectures of that campus (see snapshot.compile_snapshot).
+DEFAULT_CATALOG_ID = "default"
+CATALOG_DIR = DATA_DIR / "catalogs"
+
+# Rough per-lecture size of the materialized lecture dicts, intervals and search haystacks
+LECTURE_OVERHEAD_BYTES = 1536
+
+class LectureCatalog:
+    """
+    One immutable version of the lecture catalog together with everything derived from it:
+    parsed intervals, the inverted search index and the pairwise conflict matrix.
+    A reload builds a new LectureCatalog and swaps the registry entry, so readers that
+    grabbed a catalog (e.g. a running optimization task) keep a consistent snapshot.
+
+    The array data comes straight from the memory-mapped snapshot (see snapshot.py), so it
+    is shared between all worker processes instead of being copied into each of them.
+    """
+
+    def __init__(self, lectures, parsed_times, arrays, version=0, source_sha256=None, snapshot_path=None,
+                 catalog_id=DEFAULT_CATALOG_ID):
+        self.catalog_id = catalog_id
+        self.version = version
+        self.source_sha256 = source_sha256
+        self.snapshot_path = snapshot_path
+        self.loaded_at = time.time()
+        self.lectures = lectures
+        self.parsed_times = parsed_times
+        self.positions = {lec["id"]: pos for pos, lec in enumerate(lectures)}
+        # Estimated memory footprint, charged against the catalog memory budget
+        self.nbytes = sum(arr.nbytes for arr in arrays.values()) + len(lectures) * LECTURE_OVERHEAD_BYTES
+
+        # Caches of data derived from this catalog version (see memo)
+        self._memo = {}
+        self._memo_lock = threading.Lock()
+
+        # Flat interval arrays (one row per meeting), used by vectorized consumers
+        self.interval_offsets = arrays["interval_offsets"]
+        self.interval_lecture = arrays["interval_lecture"]
+        self.interval_day = arrays["interval_day"]
+        self.interval_start = arrays["interval_start"]
+        self.interval_end = arrays["interval_end"]
+        self.interval_building = arrays["interval_building"]
+
+        # Seat limit (수강제한인원) per lecture, 0 = not limited
+        self.capacity = arrays["capacity"] if "capacity" in arrays else np.zeros(len(lectures), dtype=np.int32)
+
+        # Dense building-to-building distance table, indexed by an interval's 'building'
+        self.building_distance = arrays["building_distance"]
+
+        # Packed N x N bit matrix: bit (i, j) set if lectures i and j overlap in time
+        self.conflict_bits = arrays["conflict_bits"]
+
+        # Inverted search index as sorted n-gram keys + CSR postings
+        self.search_keys = arrays["search_keys"]
+        self.search_offsets = arrays["search_offsets"]
+        self.search_postings = arrays["search_postings"]
+        self.chosung_keys = arrays["chosung_keys"]
+        self.chosung_offsets = arrays["chosung_offsets"]
+        self.chosung_postings = arrays["chosung_postings"]
+        self.search_haystacks = decode_string_table(arrays["search_haystacks"])
+        self.chosung_haystacks = decode_string_table(arrays["chosung_haystacks"])
+
+        N = len(lectures)
+        self.day_bits = [0] * N          # bit d set if the lecture meets on DAYS[d]
+        self.time_bounds = [None] * N    # (earliest start, latest end) in minutes, or None
+        for pos, parsed in enumerate(parsed_times):
+            for pt in parsed:
+                self.day_bits[pos] |= 1 << DAYS.index(pt['day'])
+            if parsed:
+                self.time_bounds[pos] = (min(pt['start'] for pt in parsed), max(pt['end'] for pt in parsed))
+
+    @classmethod
+    def from_snapshot(cls, snapshot, version=0, catalog_id=DEFAULT_CATALOG_ID):
+        lectures, parsed_times = snapshot_lectures(snapshot)
+        return cls(lectures, parsed_times, snapshot["arrays"], version=version,
+                   source_sha256=snapshot["meta"]["source_sha256"], snapshot_path=snapshot.get("path"),
+                   catalog_id=catalog_id)
+
+    @classmethod
+    def empty(cls):
+        return cls([], [], catalog_arrays([], []))
+
+    # ------------------------------------------------------------------
+    # Accessors
+    # ------------------------------------------------------------------
+    def get_lecture(self, lec_id):
+        pos = self.positions.get(lec_id)
+        if pos is None:
+            return None
+        return self.lectures[pos]
+
+    def get_parsed_time(self, lec_id):
+        pos = self.positions.get(lec_id)
+        if pos is None:
+            return []
+        return self.parsed_times[pos]
+
+    def conflict_row(self, pos):
+        """Boolean vector of the lectures that overlap lecture `pos`."""
+        return np.unpackbits(self.conflict_bits[pos], count=len(self.lectures)).astype(bool)
+
+    def conflicts(self, id_a, id_b):
+        pos_a, pos_b = self.positions.get(id_a), self.positions.get(id_b)
+        if pos_a is None or pos_b is None:
+            return False
+        return bool(self.conflict_bits[pos_a, pos_b >> 3] & (0x80 >> (pos_b & 7)))
+
+    def memo(self, key, factory):
+        """
+        Returns a value derived from this catalog version, computing it once with factory().
+        Because the cache lives on the catalog object, a reload invalidates it automatically.
+        """
+        if key in self._memo:
+            return self._memo[key]
+        with self._memo_lock:
+            if key not in self._memo:
+                self._memo[key] = factory()
+            return self._memo[key]
+
+    # ------------------------------------------------------------------
+    # Search
+    # ------------------------------------------------------------------
+    def _match_term(self, term):
+        """Returns the set of lecture positions whose text contains the normalized term."""
+        if is_chosung_query(term):
+            keys, offsets, flat, haystacks = self.chosung_keys, self.chosung_offsets, self.chosung_postings, self.chosung_haystacks
+        else:
+            keys, offsets, flat, haystacks = self.search_keys, self.search_offsets, self.search_postings, self.search_haystacks
+
+        postings = []
+        for gram in query_ngrams(term):
+            k = int(np.searchsorted(keys, gram))
+            if k >= len(keys) or keys[k] != gram:
+                return set()
+            postings.append(flat[offsets[k]:offsets[k + 1]])
+        postings.sort(key=len)
+
+        candidates = postings[0]
+        for posting in postings[1:]:
+            candidates = np.intersect1d(candidates, posting, assume_unique=True)
+            if len(candidates) == 0:
+                return set()
+
+        # n-gram hits are only a superset; confirm the term is a real substring
+        return {pos for pos in candidates.tolist() if term in haystacks[pos]}
+
+    def search(self, query: str = "", days=None, start_after: int = None, end_before: int = None,
+               credit: float = None, no_conflict_with=None, limit: int = 50, offset: int = 0):
+        """
+        Searches the catalog with the inverted index and structured filters.
+        - query: whitespace separated terms, all of which must match (name, professor, number, category).
+                 A term made only of initial consonants (e.g. 'ㅂㄷㅊ') is matched against course names.
+        - days: allowed meeting days; every meeting of a lecture must fall on one of them.
+        - start_after / end_before: time window in minutes from midnight.
+        - credit: exact credit value.
+        - no_conflict_with: lecture ids whose time slots the results must not overlap.
+        Returns {"total": ..., "lectures": [...]} ordered as in the catalog.
+        """
+        positions = None
+        for raw_term in (query or "").split():
+            term = normalize_text(raw_term)
+            matched = self._match_term(term)
+            positions = matched if positions is None else positions & matched
+            if not positions:
+                return {"total": 0, "lectures": [], "catalog_version": self.version}
+        positions = range(len(self.lectures)) if positions is None else sorted(positions)
+
+        allowed_day_bits = None
+        if days:
+            allowed_day_bits = 0
+            for d in days:
+                if d in DAYS:
+                    allowed_day_bits |= 1 << DAYS.index(d)
+
+        # Rows of the precomputed conflict matrix, OR-ed over the busy lectures
+        blocked = None
+        for lec_id in no_conflict_with or []:
+            pos = self.positions.get(lec_id)
+            if pos is None:
+                continue
+            row = self.conflict_row(pos)
+            row[pos] = True
+            blocked = row if blocked is None else blocked | row
+
+        matches = []
+        for pos in positions:
+            if allowed_day_bits is not None and self.day_bits[pos] & ~allowed_day_bits:
+                continue
+            bounds = self.time_bounds[pos]
+            if bounds is not None:
+                if start_after is not None and bounds[0] < start_after:
+                    continue
+                if end_before is not None and bounds[1] > end_before:
+                    continue
+            if credit is not None and self.lectures[pos]["credit"] != credit:
+                continue
+            if blocked is not None and blocked[pos]:
+                continue
+            matches.append(pos)
+
+        return {
+            "total": len(matches),
+            "lectures": [self.lectures[pos] for pos in matches[offset:offset + limit]],
+            "catalog_version": self.version
+        }
+
+# Resident catalogs are evicted (least recently used first) while their estimated size exceeds
+# CATALOG_MEMORY_BUDGET_MB. Evicting only drops the registry's reference: tasks and sessions that
+# hold an evicted catalog keep using it, and its next request loads it again (from the snapshot).
+DEFAULT_MEMORY_BUDGET_MB = 256
+
+_catalogs = OrderedDict()   # catalog id -> LectureCatalog, least recently used first
+_catalogs_lock = threading.Lock()
+_load_locks = {}            # catalog id -> lock serializing its (lazy) load
+_empty_catalog = LectureCatalog.empty()
+_catalog_version = 0         # last version handed out (versions are unique across catalogs)
+_version_lock = threading.Lock()
+_reload_locks = {}          # catalog id -> lock of its reloads (different catalogs reload independently)
+_reload_states = {}         # catalog id -> {"status", "error", "last_reload_at", "catalog_id"}
+
+def _next_version():
+    global _catalog_version
+    with _version_lock:
+        _catalog_version += 1
+        return _catalog_version
+
+def _idle_reload_state(catalog_id):
+    return {"status": "IDLE", "error": None, "last_reload_at": None, "catalog_id": catalog_id}
+
+def _reload_slot(catalog_id):
+    """(lock, state dict) of the reloads of `catalog_id`."""
+    with _catalogs_lock:
+        if catalog_id not in _reload_locks:
+            _reload_locks[catalog_id] = threading.Lock()
+            _reload_states[catalog_id] = _idle_reload_state(catalog_id)
+        return _reload_locks[catalog_id], _reload_states[catalog_id]
+
+def memory_budget_bytes():
+    return float(os.environ.get("CATALOG_MEMORY_BUDGET_MB") or DEFAULT_MEMORY_BUDGET_MB) * 2**20
+
+def catalog_sources():
+    """Available catalog ids -> (source CSV path, campus id or None). Scans data/catalogs on every call."""
+    semesters = {}
+    if DEFAULT_CSV_PATH.exists():
+        semesters[DEFAULT_CATALOG_ID] = DEFAULT_CSV_PATH
+    if CATALOG_DIR.is_dir():
+        for csv_path in sorted(CATALOG_DIR.glob("*.csv")):
+            semesters.setdefault(csv_path.stem, csv_path)
+
+    sources = {}
+    for semester, csv_path in semesters.items():
+        sources[semester] = (csv_path, None)
+        for campus in CAMPUS_IDS:
+            sources[f"{semester}:{campus}"] = (csv_path, campus)
+    return sources
+
+def build_catalog(csv_path=DEFAULT_CSV_PATH, campus=None, catalog_id=DEFAULT_CATALOG_ID):
+    """Builds a new LectureCatalog from the CSV (via its binary snapshot). Does not activate it."""
+    # Prefer the memory-mapped binary snapshot; recompile it (pandas path) only when stale
+    snapshot_dir = default_snapshot_dir(csv_path, campus)
+    snapshot = load_snapshot(snapshot_dir, csv_path=csv_path)
+    if snapshot is None:
+        print(f"Catalog snapshot missing or stale, compiling {snapshot_dir.name}...")
+        compile_snapshot(csv_path, snapshot_dir, campus=campus)
+        snapshot = load_snapshot(snapshot_dir)
+
+    return LectureCatalog.from_snapshot(snapshot, version=_next_version(), catalog_id=catalog_id)
+
+def _build_by_id(catalog_id):
+    source = catalog_sources().get(catalog_id)
+    if source is None:
+        raise KeyError(f"Unknown catalog '{catalog_id}'.")
+    csv_path, campus = source
+    return build_catalog(csv_path, campus=campus, catalog_id=catalog_id)
+
+def _activate(catalog):
+    """Makes `catalog` the resident (most recently used) catalog of its id and evicts over the memory budget."""
+    budget = memory_budget_bytes()
+    with _catalogs_lock:
+        _catalogs[catalog.catalog_id] = catalog
+        _catalogs.move_to_end(catalog.catalog_id)
+        total = sum(resident.nbytes for resident in _catalogs.values())
+        while total > budget and len(_catalogs) > 1:
+            evicted_id, evicted = _catalogs.popitem(last=False)
+            total -= evicted.nbytes
+            print(f"Evicted catalog '{evicted_id}' ({evicted.nbytes / 2**20:.1f} MB) over the "
+                  f"{budget / 2**20:.0f} MB catalog budget.")
+
+def get_catalog(catalog_id=None):
+    """
+    Returns the catalog `catalog_id` (default: DEFAULT_CATALOG_ID), loading it on first use.
+    Hold on to the result to keep a consistent snapshot. Raises KeyError for unknown ids.
+    """
+    catalog_id = catalog_id or DEFAULT_CATALOG_ID
+    with _catalogs_lock:
+        catalog = _catalogs.get(catalog_id)
+        if catalog is not None:
+            _catalogs.move_to_end(catalog_id)
+            return catalog
+        load_lock = _load_locks.setdefault(catalog_id, threading.Lock())
+
+    if catalog_id == DEFAULT_CATALOG_ID and not DEFAULT_CSV_PATH.exists():
+        return _empty_catalog
+
+    # Concurrent first requests of one catalog load it once; other catalogs are not blocked
+    with load_lock:
+        catalog = _catalogs.get(catalog_id)
+        if catalog is None:
+            catalog = _build_by_id(catalog_id)
+            _activate(catalog)
+            print(f"Loaded catalog '{catalog_id}': {len(catalog.lectures)} lectures (catalog v{catalog.version}).")
+    return catalog
+
+def list_catalogs():
+    """The available catalogs, with the size of the resident ones."""
+    with _catalogs_lock:
+        resident = dict(_catalogs)
+    catalogs = []
+    for catalog_id, (csv_path, campus) in catalog_sources().items():
+        entry = {"id": catalog_id, "source": csv_path.name, "campus": campus, "resident": catalog_id in resident}
+        if catalog_id in resident:
+            entry["num_lectures"] = len(resident[catalog_id].lectures)
+            entry["version"] = resident[catalog_id].version
+        catalogs.append(entry)
+    return catalogs
+
+def load_lectures(catalog_id=None):
+    """Loads a catalog (default: DEFAULT_CATALOG_ID) now instead of on its first request."""
+    if (catalog_id or DEFAULT_CATALOG_ID) == DEFAULT_CATALOG_ID and not DEFAULT_CSV_PATH.exists():
+        print(f"Warning: Data file not found at {DEFAULT_CSV_PATH}")
         return
 
-    # Read CSV
-    df = pd.read_csv(data_path)
-    
-    # Fill NaN
-    df = df.fillna("")
-
-    # Process to list of dicts for easy access
-    global_lectures_store.clear()
-    seen_ids = set()
-    for _, row in df.iterrows():
-        lec_id = str(row["교과목번호"]) + "-" + str(row["분반"])
-        if lec_id in seen_ids:
-            continue
-            
-        time_room_val = str(row["시간표"]).strip()
-        if not time_room_val:
-            continue
-            
-        seen_ids.add(lec_id)
-        
-        global_lectures_store.append({
-            "id": lec_id,
-            "number": str(row["교과목번호"]),
-            "class_num": str(row["분반"]),
-            "name": str(row["교과목명"]),
-            "credit": float(row["학점"]) if row["학점"] else 0.0,
-            "time_room": time_room_val,
-            "professor": str(row["교수명"]),
-            "category": str(row["교과목구분"])
-        })
-    print(f"Loaded {len(global_lectures_store)} lectures.")
-
-def get_all_lectures():
-    return global_lectures_store
-
-def get_lecture_by_id(lec_id: str):
-    for lec in global_lectures_store:
-        if lec["id"] == lec_id:
-            return lec
-    return None
+    reload_lock, reload_state = _reload_slot(catalog_id or DEFAULT_CATALOG_ID)
+    with reload_lock:
+        get_catalog(catalog_id)
+        reload_state["last_reload_at"] = time.time()
+
+def reload_lectures(catalog_id=None):
+    """
+    Rebuilds a catalog (snapshot, indexes, conflict matrix) and swaps it in atomically.
+    Concurrent calls for the same catalog are coalesced: returns False if one is already running.
+    """
+    catalog_id = catalog_id or DEFAULT_CATALOG_ID
+    reload_lock, reload_state = _reload_slot(catalog_id)
+    if not reload_lock.acquire(blocking=False):
+        return False
+    try:
+        reload_state["status"] = "RELOADING"
+        reload_state["error"] = None
+        new_catalog = _build_by_id(catalog_id)
+        _activate(new_catalog)
+        reload_state["last_reload_at"] = time.time()
+        print(f"Catalog '{catalog_id}' reloaded: {len(new_catalog.lectures)} lectures (catalog v{new_catalog.version}).")
+        return True
+    except Exception as e:
+        reload_state["error"] = str(e)
+        print(f"Catalog '{catalog_id}' reload failed: {str(e)}")
+        raise
+    finally:
+        reload_state["status"] = "IDLE"
+        reload_lock.release()
+
+def reload_lectures_in_background(catalog_id=None):
+    """Starts a reload on a daemon thread. Returns False if a reload of that catalog is already running."""
+    if _reload_slot(catalog_id or DEFAULT_CATALOG_ID)[0].locked():
+        return False
+
+    def _run():
+        try:
+            reload_lectures(catalog_id)
+        except Exception:
+            pass  # recorded in the catalog's reload state
+
+    threading.Thread(target=_run, name="catalog-reload", daemon=True).start()
+    return True
+
+def get_reload_state(catalog_id=None):
+    """Reload state and version of `catalog_id` (None while it is not resident), plus the resident catalogs."""
+    catalog_id = catalog_id or DEFAULT_CATALOG_ID
+    with _catalogs_lock:
+        catalog = _catalogs.get(catalog_id)
+        resident = {resident_id: round(resident.nbytes / 2**20, 1) for resident_id, resident in _catalogs.items()}
+        reload_state = dict(_reload_states.get(catalog_id) or _idle_reload_state(catalog_id))
+    return {
+        **reload_state,
+        "catalog_version": catalog.version if catalog else None,
+        "source_sha256": catalog.source_sha256 if catalog else None,
+        "num_lectures": len(catalog.lectures) if catalog else None,
+        # Resident catalog id -> estimated MB, least recently used first
+        "resident_catalogs": resident,
+        "memory_budget_mb": memory_budget_bytes() / 2**20,
+    }
+
+def start_catalog_watcher(interval_seconds: float):
+    """
+    Polls the source CSVs of the resident catalogs every `interval_seconds` and hot-reloads
+    the catalogs of a CSV when it changes.
+    """
+    def _watch():
+        last_mtimes = {}
+        while True:
+            with _catalogs_lock:
+                resident_ids = list(_catalogs)
+            sources = catalog_sources()
+            for catalog_id in resident_ids:
+                if catalog_id not in sources:
+                    continue
+                csv_path = sources[catalog_id][0]
+                try:
+                    mtime = os.stat(csv_path).st_mtime_ns
+                except OSError:
+                    continue
+                last_mtime = last_mtimes.get(catalog_id)
+                if last_mtime is not None and mtime != last_mtime:
+                    print(f"{csv_path.name} changed on disk, reloading catalog '{catalog_id}'...")
+                    try:
+                        reload_lectures(catalog_id)
+                    except Exception:
+                        pass  # keep serving the previous catalog
+                last_mtimes[catalog_id] = mtime
+            time.sleep(interval_seconds)
+
+    threading.Thread(target=_watch, name="catalog-watcher", daemon=True).start()
+
+def attach_catalog(snapshot_path, source_sha256=None, catalog_id=None):
+    """
+    Attaches this process to an already compiled snapshot (zero-copy, via mmap).
+    Meant as a process-pool initializer: workers share the parent's catalog arrays
+    instead of re-reading the CSV. Falls back to a full load if the snapshot is gone
+    or belongs to another catalog version.
+    """
+    catalog_id = catalog_id or DEFAULT_CATALOG_ID
+    current = _catalogs.get(catalog_id)
+    if current is not None and current.source_sha256 is not None and current.source_sha256 == source_sha256:
+        return
+    snapshot = load_snapshot(snapshot_path) if snapshot_path else None
+    if snapshot is None or (source_sha256 and snapshot["meta"]["source_sha256"] != source_sha256):
+        get_catalog(catalog_id)
+        return
+    _activate(LectureCatalog.from_snapshot(snapshot, catalog_id=catalog_id))
+
+def get_all_lectures(catalog_id=None):
+    return get_catalog(catalog_id).lectures
+
+def get_lecture_by_id(lec_id: str, catalog_id=None):
+    return get_catalog(catalog_id).get_lecture(lec_id)
+
+def get_parsed_time(lec_id: str, catalog_id=None):
+    """Returns the precomputed interval list of a lecture ([] if unknown)."""
+    return get_catalog(catalog_id).get_parsed_time(lec_id)
+
+def search_lectures(query: str = "", catalog_id=None, **filters):
+    return get_catalog(catalog_id).search(query, **filters)
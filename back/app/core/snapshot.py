@@ -0,0 +1,385 @@
+"""
+Binary catalog snapshot.
+
+Compiles `lectures.csv` into a directory of `.npy` arrays plus a string table so that
+startup can memory-map the catalog (with its parsed time intervals) instead of importing
+pandas and re-parsing every row. pandas is only imported when the snapshot is missing or stale.
+
+Everything derived from the catalog that is expensive to hold per process (the pairwise
+conflict matrix and the search index postings) is compiled into the snapshot as well.
+Every worker process maps the same files read-only, so the pages are shared through the
+OS page cache and each additional uvicorn/process-pool worker adds almost no memory.
+
+A snapshot can also hold one campus of the CSV only (--campus): the lectures meeting on that
+campus, plus those without a parseable room (remote / external), which every campus offers.
+
+Build step:
+    python -m app.core.snapshot [--csv data/lectures.csv] [--campus yangsan] [--out data/lectures.snapshot]
+"""
+import argparse
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import numpy as np
+from ..utils.time_utils import parse_time_to_range
+from ..utils.text_utils import normalize_text, to_chosung, char_ngrams
+from ..utils.location_utils import CAMPUS_IDS, parse_building, building_distance_matrix
+
+# 5: rooms no longer swallow the day of the next meeting (time_utils._ROOM)
+SNAPSHOT_FORMAT_VERSION = 5
+
+DAYS = ['월', '화', '수', '목', '금', '토', '일']
+
+# Lecture string fields, stored as indices into the string table
+STRING_FIELDS = ["id", "number", "class_num", "name", "time_room", "professor", "category"]
+
+# Separator of the string table blob (never present in the CSV text fields)
+STRING_SEPARATOR = "\x00"
+
+DATA_DIR = pathlib.Path(__file__).parent.parent.parent / "data"
+DEFAULT_CSV_PATH = DATA_DIR / "lectures.csv"
+
+def default_snapshot_dir(csv_path, campus=None):
+    csv_path = pathlib.Path(csv_path)
+    if campus is not None:
+        return csv_path.with_name(f"{csv_path.stem}.{campus}.snapshot")
+    return csv_path.with_suffix(".snapshot")
+
+def lecture_campuses(parsed):
+    """Campus ids (CAMPUS_IDS) a lecture meets on; empty if none of its rooms has a building number."""
+    campuses = set()
+    for pt in parsed:
+        building = parse_building(pt.get('room'))
+        if building is not None:
+            campuses.add(CAMPUS_IDS[building[0]])
+    return campuses
+
+def source_fingerprint(csv_path):
+    """sha256 of the source CSV; the snapshot is stale whenever it changes."""
+    digest = hashlib.sha256()
+    with open(csv_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def read_lecture_rows(csv_path):
+    """
+    Reads the raw CSV with pandas (imported lazily) and returns the de-duplicated lecture dicts.
+    Columns are converted to Python lists up front instead of walking the frame with iterrows().
+    """
+    import pandas as pd
+
+    df = pd.read_csv(csv_path)
+    df = df.fillna("")
+    numbers = [str(v) for v in df["교과목번호"].tolist()]
+    class_nums = [str(v) for v in df["분반"].tolist()]
+    names = [str(v) for v in df["교과목명"].tolist()]
+    credits = df["학점"].tolist()
+    time_rooms = [str(v) for v in df["시간표"].tolist()]
+    professors = [str(v) for v in df["교수명"].tolist()]
+    categories = [str(v) for v in df["교과목구분"].tolist()]
+    # Seat limit (수강제한인원); 0 when the CSV gives none
+    capacities = df["수강제한인원"].tolist() if "수강제한인원" in df.columns else [""] * len(df)
+
+    lectures = []
+    seen_ids = set()
+    for i in range(len(df)):
+        lec_id = numbers[i] + "-" + class_nums[i]
+        if lec_id in seen_ids:
+            continue
+
+        time_room_val = time_rooms[i].strip()
+        if not time_room_val:
+            continue
+
+        seen_ids.add(lec_id)
+        lectures.append({
+            "id": lec_id,
+            "number": numbers[i],
+            "class_num": class_nums[i],
+            "name": names[i],
+            "credit": float(credits[i]) if credits[i] else 0.0,
+            "capacity": int(float(capacities[i])) if capacities[i] != "" else 0,
+            "time_room": time_room_val,
+            "professor": professors[i],
+            "category": categories[i]
+        })
+    return lectures
+
+def interval_arrays(parsed_times):
+    """
+    Parsed intervals in CSR layout: lecture i owns rows interval_offsets[i]:interval_offsets[i+1]
+    of the flat interval_lecture/day/start/end/building arrays.
+    interval_building indexes the building table (building_campus/number, 0 = unknown) and
+    building_distance is the dense building-to-building distance matrix over that table.
+    """
+    interval_offsets = np.zeros(len(parsed_times) + 1, dtype=np.int32)
+    interval_lecture, interval_day, interval_start, interval_end, interval_building = [], [], [], [], []
+    building_ids = {}
+    for i, parsed in enumerate(parsed_times):
+        for pt in parsed:
+            interval_lecture.append(i)
+            interval_day.append(DAYS.index(pt['day']))
+            interval_start.append(pt['start'])
+            interval_end.append(pt['end'])
+            building = parse_building(pt.get('room'))
+            if building is None:
+                interval_building.append(0)
+            else:
+                interval_building.append(building_ids.setdefault(building, len(building_ids) + 1))
+        interval_offsets[i + 1] = len(interval_day)
+
+    buildings = sorted(building_ids, key=building_ids.get)
+    building_campus = np.array([b[0] for b in buildings], dtype=np.int8)
+    building_number = np.array([b[1] for b in buildings], dtype=np.int16)
+    return {
+        "interval_offsets": interval_offsets,
+        "interval_lecture": np.array(interval_lecture, dtype=np.int32),
+        "interval_day": np.array(interval_day, dtype=np.int8),
+        "interval_start": np.array(interval_start, dtype=np.int16),
+        "interval_end": np.array(interval_end, dtype=np.int16),
+        "interval_building": np.array(interval_building, dtype=np.int16),
+        "building_campus": building_campus,
+        "building_number": building_number,
+        "building_distance": building_distance_matrix(building_campus, building_number),
+    }
+
+def conflict_bit_matrix(intervals, num_lectures):
+    """Packed N x N bit matrix: bit (i, j) set if lectures i and j overlap in time."""
+    conflicts = np.zeros((num_lectures, num_lectures), dtype=bool)
+    for day_idx in range(len(DAYS)):
+        on_day = intervals["interval_day"] == day_idx
+        if not on_day.any():
+            continue
+        lec = intervals["interval_lecture"][on_day]
+        start = intervals["interval_start"][on_day].astype(np.int32)
+        end = intervals["interval_end"][on_day].astype(np.int32)
+        overlap = (start[:, None] < end[None, :]) & (start[None, :] < end[:, None])
+        rows, cols = np.nonzero(overlap)
+        conflicts[lec[rows], lec[cols]] = True
+    np.fill_diagonal(conflicts, False)
+    return np.packbits(conflicts, axis=1)
+
+def _posting_arrays(postings):
+    """
+    Turns {gram: [positions]} into sorted fixed-width keys plus CSR offsets/postings,
+    so lookups are a binary search over a memory-mapped array.
+    """
+    keys = sorted(postings)
+    offsets = np.zeros(len(keys) + 1, dtype=np.int32)
+    flat = []
+    for k, key in enumerate(keys):
+        flat.extend(sorted(postings[key]))
+        offsets[k + 1] = len(flat)
+    return np.array(keys, dtype="<U2"), offsets, np.array(flat, dtype=np.int32)
+
+def search_index_arrays(lectures):
+    """
+    Inverted n-gram index over course name, professor, course number and category,
+    and an initial-consonant (chosung) index over course names.
+    """
+    search_postings = {}
+    chosung_postings = {}
+    haystacks = []
+    chosung_haystacks = []
+    for pos, lec in enumerate(lectures):
+        haystacks.append("|".join(normalize_text(lec[key]) for key in ("name", "professor", "number", "category", "id")))
+        for field in ("name", "professor", "number", "category"):
+            for gram in char_ngrams(normalize_text(lec[field])):
+                search_postings.setdefault(gram, set()).add(pos)
+
+        chosung_name = to_chosung(normalize_text(lec["name"]))
+        chosung_haystacks.append(chosung_name)
+        for gram in char_ngrams(chosung_name):
+            chosung_postings.setdefault(gram, set()).add(pos)
+
+    arrays = {}
+    for prefix, postings in (("search", search_postings), ("chosung", chosung_postings)):
+        keys, offsets, flat = _posting_arrays(postings)
+        arrays[f"{prefix}_keys"] = keys
+        arrays[f"{prefix}_offsets"] = offsets
+        arrays[f"{prefix}_postings"] = flat
+    arrays["search_haystacks"] = np.frombuffer(STRING_SEPARATOR.join(haystacks).encode("utf-8"), dtype=np.uint8)
+    arrays["chosung_haystacks"] = np.frombuffer(STRING_SEPARATOR.join(chosung_haystacks).encode("utf-8"), dtype=np.uint8)
+    return arrays
+
+def catalog_arrays(lectures, parsed_times):
+    """All derived catalog arrays: intervals, conflict matrix and search index."""
+    arrays = interval_arrays(parsed_times)
+    arrays["conflict_bits"] = conflict_bit_matrix(arrays, len(lectures))
+    arrays.update(search_index_arrays(lectures))
+    return arrays
+
+def decode_string_table(blob):
+    """Splits a separator-joined utf-8 blob back into its strings."""
+    if len(blob) == 0:
+        return [""]
+    return bytes(blob).decode("utf-8").split(STRING_SEPARATOR)
+
+def compile_snapshot(csv_path=DEFAULT_CSV_PATH, snapshot_dir=None, campus=None):
+    """
+    Compiles the CSV (or only its `campus` lectures) into a versioned snapshot directory and returns its path.
+    The directory is written next to the target and renamed into place, so concurrent
+    readers see either the old or the new snapshot.
+    """
+    if campus is not None and campus not in CAMPUS_IDS:
+        raise ValueError(f"Unknown campus '{campus}'. Available: {', '.join(CAMPUS_IDS)}")
+    csv_path = pathlib.Path(csv_path)
+    snapshot_dir = pathlib.Path(snapshot_dir) if snapshot_dir else default_snapshot_dir(csv_path, campus)
+    fingerprint = source_fingerprint(csv_path)
+    lectures = read_lecture_rows(csv_path)
+    parsed_times = [parse_time_to_range(lec["time_room"]) for lec in lectures]
+    if campus is not None:
+        # Lectures without a known building (remote / external) belong to every campus
+        keep = [i for i, parsed in enumerate(parsed_times) if campus in (lecture_campuses(parsed) or {campus})]
+        lectures = [lectures[i] for i in keep]
+        parsed_times = [parsed_times[i] for i in keep]
+
+    # String table: every distinct field value once, referenced by index
+    string_ids = {}
+    strings = []
+    field_refs = {field: np.empty(len(lectures), dtype=np.int32) for field in STRING_FIELDS}
+    for i, lec in enumerate(lectures):
+        for field in STRING_FIELDS:
+            value = lec[field]
+            ref = string_ids.get(value)
+            if ref is None:
+                ref = string_ids[value] = len(strings)
+                strings.append(value)
+            field_refs[field][i] = ref
+
+    interval_room = []
+    for parsed in parsed_times:
+        for pt in parsed:
+            ref = string_ids.get(pt['room'])
+            if ref is None:
+                ref = string_ids[pt['room']] = len(strings)
+                strings.append(pt['room'])
+            interval_room.append(ref)
+
+    arrays = {
+        "strings": np.frombuffer(STRING_SEPARATOR.join(strings).encode("utf-8"), dtype=np.uint8),
+        "credit": np.array([lec["credit"] for lec in lectures], dtype=np.float64),
+        "capacity": np.array([lec["capacity"] for lec in lectures], dtype=np.int32),
+    }
+    for field, refs in field_refs.items():
+        arrays[f"field_{field}"] = refs
+    arrays["interval_room"] = np.array(interval_room, dtype=np.int32)
+    arrays.update(catalog_arrays(lectures, parsed_times))
+
+    meta = {
+        "format_version": SNAPSHOT_FORMAT_VERSION,
+        "source_sha256": fingerprint,
+        "campus": campus,
+        "num_lectures": len(lectures),
+        "num_intervals": len(arrays["interval_day"]),
+        "arrays": sorted(arrays),
+    }
+
+    tmp_dir = snapshot_dir.with_name(f"{snapshot_dir.name}.tmp-{os.getpid()}")
+    if tmp_dir.exists():
+        shutil.rmtree(tmp_dir)
+    tmp_dir.mkdir(parents=True)
+    for name, arr in arrays.items():
+        np.save(tmp_dir / f"{name}.npy", arr)
+    # meta.json is written last: a snapshot without it is never considered valid
+    with open(tmp_dir / "meta.json", "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+
+    old_dir = snapshot_dir.with_name(f"{snapshot_dir.name}.old-{os.getpid()}")
+    if snapshot_dir.exists():
+        os.replace(snapshot_dir, old_dir)
+    os.replace(tmp_dir, snapshot_dir)
+    if old_dir.exists():
+        shutil.rmtree(old_dir, ignore_errors=True)
+    return snapshot_dir
+
+def load_snapshot(snapshot_dir, csv_path=None):
+    """
+    Memory-maps a snapshot. Returns None if it is missing, of another format version,
+    or (when csv_path is given) compiled from a different CSV.
+    """
+    snapshot_dir = pathlib.Path(snapshot_dir)
+    meta_path = snapshot_dir / "meta.json"
+    if not meta_path.exists():
+        return None
+    try:
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if meta.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+        return None
+    if csv_path is not None and meta.get("source_sha256") != source_fingerprint(csv_path):
+        return None
+
+    arrays = {}
+    try:
+        for name in meta["arrays"]:
+            path = snapshot_dir / f"{name}.npy"
+            try:
+                arrays[name] = np.load(path, mmap_mode="r")
+            except ValueError:
+                # Zero-length arrays cannot be memory-mapped
+                arrays[name] = np.load(path)
+    except (OSError, ValueError):
+        return None
+    return {"meta": meta, "arrays": arrays, "path": snapshot_dir}
+
+def snapshot_lectures(snapshot):
+    """
+    Materializes lecture dicts and their parsed intervals from a loaded snapshot.
+    Returns (lectures, parsed_times) in catalog order; intervals carry their room and
+    building index (see interval_arrays).
+    """
+    arrays = snapshot["arrays"]
+    strings = decode_string_table(arrays["strings"])
+    columns = {field: [strings[ref] for ref in arrays[f"field_{field}"].tolist()] for field in STRING_FIELDS}
+    credits = arrays["credit"].tolist()
+    capacities = arrays["capacity"].tolist()
+
+    offsets = arrays["interval_offsets"].tolist()
+    interval_day = arrays["interval_day"].tolist()
+    interval_start = arrays["interval_start"].tolist()
+    interval_end = arrays["interval_end"].tolist()
+    interval_room = [strings[ref] for ref in arrays["interval_room"].tolist()]
+    interval_building = arrays["interval_building"].tolist()
+
+    lectures = []
+    parsed_times = []
+    for i in range(snapshot["meta"]["num_lectures"]):
+        lectures.append({
+            "id": columns["id"][i],
+            "number": columns["number"][i],
+            "class_num": columns["class_num"][i],
+            "name": columns["name"][i],
+            "credit": credits[i],
+            "capacity": capacities[i],
+            "time_room": columns["time_room"][i],
+            "professor": columns["professor"][i],
+            "category": columns["category"][i]
+        })
+        parsed_times.append([
+            {'day': DAYS[interval_day[k]], 'start': interval_start[k], 'end': interval_end[k],
+             'room': interval_room[k], 'building': interval_building[k]}
+            for k in range(offsets[i], offsets[i + 1])
+        ])
+    return lectures, parsed_times
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile lectures.csv into a binary catalog snapshot.")
+    parser.add_argument("--csv", default=str(DEFAULT_CSV_PATH), help="Source CSV path")
+    parser.add_argument("--campus", default=None, choices=CAMPUS_IDS, help="Only this campus' lectures")
+    parser.add_argument("--out", default=None, help="Snapshot directory (default: <csv>[.<campus>].snapshot)")
+    args = parser.parse_args()
+
+    out_dir = compile_snapshot(args.csv, args.out, campus=args.campus)
+    with open(out_dir / "meta.json", encoding="utf-8") as f:
+        meta = json.load(f)
+    print(f"Compiled {meta['num_lectures']} lectures ({meta['num_intervals']} intervals) into {out_dir}")
+
+if __name__ == "__main__":
+    main()
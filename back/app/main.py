@@ -1,7 +1,10 @@
+import os
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from .api import router as api_router
-from .core.loader import load_lectures
+from .core.loader import load_lectures, start_catalog_watcher
+from .services.metrics import render_prometheus
 
 app = FastAPI(title="Timetable Optimizer API", version="0.1.0")
 
@@ -19,8 +22,19 @@ async def startup_event():
     load_lectures()
     print("Lectures loaded successfully!")
 
+    # Optional file-watch mode: hot-reload a resident catalog when its CSV changes
+    watch_interval = float(os.environ.get("CATALOG_WATCH_INTERVAL", "0") or 0)
+    if watch_interval > 0:
+        start_catalog_watcher(watch_interval)
+        print(f"Watching the catalog CSVs for changes every {watch_interval}s.")
+
 app.include_router(api_router, prefix="/api")
 
 @app.get("/")
 def root():
     return {"message": "Timetable Optimizer API Context"}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus scrape endpoint: stage / task duration histograms of this worker."""
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,121 @@
+import os
+import random
+import itertools
+import multiprocessing
+import concurrent.futures
+from ..core.loader import get_catalog, attach_catalog
+from .bqm_builder import collect_pair_structure, slice_pair_structure
+from .metrics import observe_timings
+from .quantum_optimizer import expand_course_groups, run_optimization, weekday_candidates
+
+# Largest union of request pools whose pair structure is computed once and shared (over this, every
+# request computes the structure of its own pool, as a single request would)
+MAX_SHARED_POOL_LECTURES = 2000
+
+# Per-process state of batch workers (set once by _init_batch_worker)
+_worker_lectures = None
+_worker_pair_structure = None
+
+def prepare_shared_pool(catalog, preference_sets, seed=None):
+    """
+    Builds the candidate pools of a batch. Every request gets its own pool, bounded by its own
+    max_candidates: its mandatory lectures and course group members + random candidates, drawn in
+    the order of one shuffle shared by the batch, so the pools overlap heavily.
+    The weight-independent pair structure is computed once over the union of the pools and sliced
+    per request (see slice_pair_structure), unless the union exceeds MAX_SHARED_POOL_LECTURES.
+    Returns (union lectures, union pair structure or None, pool positions in the union per request).
+    """
+    fill_ids = [lec["id"] for lec in weekday_candidates(catalog)]
+    random.Random(seed).shuffle(fill_ids)
+
+    union_positions = {}
+    pools = []
+    for preferences in preference_sets:
+        selected_ids = list(dict.fromkeys(preferences.get("selected_lecture_ids", [])))
+        group_ids = list(dict.fromkeys(expand_course_groups(catalog, preferences.get("course_groups"))))
+        fixed_ids = [lec_id for lec_id in dict.fromkeys(selected_ids + group_ids)
+                     if catalog.get_lecture(lec_id) is not None]
+        fixed_set = set(fixed_ids)
+        room = max(preferences.get("max_candidates", 300) - len(fixed_ids), 0)
+        fill = itertools.islice((lec_id for lec_id in fill_ids if lec_id not in fixed_set), room)
+        pools.append(sorted(union_positions.setdefault(lec_id, len(union_positions))
+                            for lec_id in itertools.chain(fixed_ids, fill)))
+
+    lectures = []
+    for lec_id in union_positions:
+        lec_copy = catalog.get_lecture(lec_id).copy()
+        lec_copy['parsed_time'] = catalog.get_parsed_time(lec_id)
+        lectures.append(lec_copy)
+
+    if len(lectures) > MAX_SHARED_POOL_LECTURES:
+        print(f"Batch pools cover {len(lectures)} lectures (> {MAX_SHARED_POOL_LECTURES}): "
+              f"pair structure computed per request")
+        return lectures, None, pools
+    return lectures, collect_pair_structure(lectures, catalog.building_distance), pools
+
+def _init_batch_worker(snapshot_path, source_sha256, catalog_id, lectures, pair_structure):
+    """Process-pool initializer: attach to the shared catalog and receive the batch pools once."""
+    global _worker_lectures, _worker_pair_structure
+    attach_catalog(snapshot_path, source_sha256, catalog_id)
+    _worker_lectures = lectures
+    _worker_pair_structure = pair_structure
+
+def solve_batch_item(index, preferences, positions, lectures=None, pair_structure=None):
+    """
+    Solves one request of a batch over its pool (positions in the batch's union of pools).
+    Never raises: failures are reported in the returned dict.
+    """
+    if lectures is None:
+        lectures, pair_structure = _worker_lectures, _worker_pair_structure
+    try:
+        pool = [lectures[p] for p in positions]
+        if pair_structure is not None:
+            pair_structure = slice_pair_structure(pair_structure, positions)
+        result = run_optimization(preferences, catalog=get_catalog(preferences.get("catalog_id")), lectures=pool,
+                                  pair_structure=pair_structure, log_prefix=f"Batch item {index}")
+        return {"index": index, "status": "SUCCESS", "result": result}
+    except Exception as e:
+        print(f"Batch item {index} Failed: {str(e)}")
+        return {"index": index, "status": "FAILURE", "error": str(e)}
+
+def _observed(item):
+    # Workers are separate processes: their stage timings reach /metrics through the results
+    if item["status"] == "SUCCESS":
+        observe_timings(item["result"]["timings"])
+    return item
+
+def run_batch(preference_sets, max_workers=None):
+    """
+    Solves many preference sets (all of one catalog) over their own candidate pools, which share one
+    pair structure (see prepare_shared_pool), spread across CPU cores.
+    Yields {"index", "status", "result" | "error"} dicts in completion order.
+    """
+    catalog = get_catalog(preference_sets[0].get("catalog_id"))
+    lectures, pair_structure, pools = prepare_shared_pool(catalog, preference_sets)
+
+    if max_workers is None or max_workers <= 0:
+        max_workers = os.cpu_count() or 1
+    max_workers = min(max_workers, len(preference_sets))
+
+    if max_workers <= 1:
+        for index, preferences in enumerate(preference_sets):
+            yield _observed(solve_batch_item(index, preferences, pools[index], lectures, pair_structure))
+        return
+
+    # spawn (not fork): the server process runs threads, and workers attach to the
+    # catalog snapshot via mmap instead of inheriting a copy of it.
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_batch_worker,
+        initargs=(catalog.snapshot_path, catalog.source_sha256, catalog.catalog_id, lectures, pair_structure),
+    ) as executor:
+        futures = [executor.submit(solve_batch_item, index, preferences, pools[index])
+                   for index, preferences in enumerate(preference_sets)]
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                yield _observed(future.result())
+        finally:
+            # Client went away (generator closed early): drop the requests not started yet
+            for future in futures:
+                future.cancel()
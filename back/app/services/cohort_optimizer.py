@@ -0,0 +1,387 @@
+"""
+Cohort mode: assigns timetables to many students at once under the per-section seat limits
+(수강제한인원, catalog.capacity; 0 = not limited).
+
+Solved by Lagrangian relaxation of the capacity constraints sum_s x_sj <= capacity_j:
+- every student keeps an own model (candidate pool + BQM, built like a single request but over
+  a smaller pool) and solves min E_s(x) + sum_j price_j * x_j; the prices only shift linear biases
+- after each round the prices follow the subgradient of the relaxation,
+  price_j <- max(0, price_j + step_t * (demand_j - capacity_j) / capacity_j), step_t = price_step / sqrt(t + 1)
+- the student models live in worker processes that each own a fixed shard of the cohort, so a round
+  only sends the price vector out and the selected sections back; from the second round on the
+  students are re-solved warm-started from their previous samples (session_manager.warm_start_sample)
+The relaxation usually ends with a few sections slightly over their limit. A repair pass then keeps
+`capacity` holders of each such section (students who requested that exact section first), closes
+every full section for the others and re-solves them, for up to REPAIR_ROUNDS rounds; whatever is
+still over after that is dropped from the schedules of the last holders.
+
+Mandatory lectures are treated as "one section of this course" (a course group, with a bonus for
+the requested section), so a student can be moved to another section of a full course;
+fixed_sections keeps them mandatory as requested.
+"""
+import concurrent.futures
+import multiprocessing
+import os
+import random
+import time
+
+import numpy as np
+from ..core.loader import get_catalog, attach_catalog
+from .bqm_builder import (DAYS, build_timetable_bqm, collect_choice_constraints, collect_pair_structure, free_day_variable,
+                          repair_choice_constraints, sample_matrix)
+from .quantum_optimizer import expand_course_groups, select_candidate_pool
+from .session_manager import warm_start_sample
+
+import dimod
+try:
+    import neal
+except ImportError:
+    neal = None
+
+DEFAULT_MAX_ITERATIONS = 20
+DEFAULT_PRICE_STEP = 100.0
+DEFAULT_SECTION_BONUS = 500.0
+# Per-student pool: much smaller than a single request's, so thousands of models fit in memory
+COHORT_MAX_CANDIDATES = 80
+# First solve of a student: many short anneals find the requested sections more often than a few long ones
+COHORT_READS = 30
+COHORT_SWEEPS = 500
+# Samples kept for the warm-started re-solves of later rounds
+COHORT_WARM_READS = 10
+REPAIR_ROUNDS = 10
+
+# Per-process shard of cohort workers (set once by _init_cohort_worker)
+_worker_shard = None
+
+class _StudentModel:
+    """Pool, BQM and last samples of one student; prices and closed sections are applied as linear deltas."""
+
+    def __init__(self, index, preferences, catalog, options):
+        self.index = index
+        self.seed = (options.get("seed") or 0) * 1000003 + index
+        selected_ids = list(dict.fromkeys(preferences.get("selected_lecture_ids", [])))
+        preferences = dict(preferences)
+        course_groups = list(preferences.get("course_groups") or [])
+        if options.get("fixed_sections"):
+            preferences["mandatory_ids"] = selected_ids
+        else:
+            numbers = [catalog.get_lecture(lec_id)["number"] for lec_id in selected_ids if catalog.get_lecture(lec_id)]
+            course_groups.extend([number] for number in dict.fromkeys(numbers))
+            preferences["course_groups"] = course_groups
+            preferences["mandatory_ids"] = []
+        self.preferences = preferences
+        self.requested = set(selected_ids)
+
+        group_ids = expand_course_groups(catalog, course_groups)
+        max_candidates = min(preferences.get("max_candidates") or COHORT_MAX_CANDIDATES,
+                             options.get("max_candidates") or COHORT_MAX_CANDIDATES)
+        self.lectures = select_candidate_pool(catalog, selected_ids, max(max_candidates, len(selected_ids) + len(group_ids)),
+                                              required_ids=group_ids, seed=self.seed)
+        if not self.lectures:
+            raise ValueError("None of the selected lectures were found in the database.")
+        pair_structure = collect_pair_structure(self.lectures, catalog.building_distance)
+        self.bqm = build_timetable_bqm(self.lectures, preferences, pair_structure=pair_structure)
+        self.day_members = [pair_structure["members"][d] for d in DAYS]
+
+        N = len(self.lectures)
+        bonus = options.get("section_bonus", DEFAULT_SECTION_BONUS)
+        if not options.get("fixed_sections") and bonus:
+            for i, lec in enumerate(self.lectures):
+                if lec["id"] in self.requested:
+                    self.bqm.add_linear(i, -bonus)
+        self.positions = np.array([catalog.positions[lec["id"]] for lec in self.lectures], dtype=np.int64)
+        self.choice_constraints = collect_choice_constraints(self.lectures, preferences)
+        # Pool lectures overlapping each section (of a course with several sections in the pool)
+        requested_mask = np.array([lec["id"] in self.requested for lec in self.lectures])
+        self.displaced = {}
+        for members in self.choice_constraints["sections"]:
+            for k in members.tolist():
+                overlapping = catalog.conflict_row(self.positions[k])[self.positions] & ~requested_mask
+                self.displaced[k] = np.flatnonzero(overlapping)
+        capacity = options["capacity"]
+        self.priced = np.flatnonzero(capacity[self.positions] > 0)
+        self.applied = np.zeros(len(self.priced))
+        self.closed = set()
+        self.states = None
+        self.selection = None
+        self.num_lectures = N
+
+    def solve(self, prices, closed=()):
+        """Re-solves under `prices` (per catalog position) with the `closed` positions excluded; returns the chosen positions."""
+        new_prices = prices[self.positions[self.priced]]
+        delta = new_prices - self.applied
+        changed = np.flatnonzero(delta)
+        pool_index = {int(pos): i for i, pos in enumerate(self.positions)}
+        newly_closed = {pos for pos in closed if pos in pool_index} - self.closed
+        if self.states is not None and not len(changed) and not newly_closed:
+            # Nothing in this student's model moved since the last round
+            return self.selection
+
+        if len(changed):
+            self.bqm.add_linear_from(zip(self.priced[changed].tolist(), delta[changed].tolist()))
+            self.applied = new_prices
+        penalty = self.preferences.get("w_hard_overlap", 10000.0)
+        for pos in newly_closed:
+            self.bqm.add_linear(pool_index[pos], penalty)
+        self.closed |= newly_closed
+
+        if self.states is None:
+            if neal is not None:
+                sampleset = neal.SimulatedAnnealingSampler().sample(self.bqm, num_reads=COHORT_READS,
+                                                                     num_sweeps=COHORT_SWEEPS, seed=self.seed)
+            else:
+                sampleset = dimod.SimulatedAnnealingSampler().sample(self.bqm, num_reads=COHORT_READS)
+        else:
+            states = self.states
+            for pos in self.closed:
+                states[:, pool_index[pos]] = 0
+            sampleset = warm_start_sample(self.bqm, states)
+
+        samples, energies = sample_matrix(sampleset, self.bqm.num_variables)
+        order = np.argsort(energies, kind="stable")
+        self.states = samples[order[:COHORT_WARM_READS]].copy()
+
+        priority = -np.array([self.bqm.get_linear(i) for i in range(self.num_lectures)])
+        best = samples[order[0]].copy()
+        best[:self.num_lectures] = repair_choice_constraints(best[:self.num_lectures], self.lectures,
+                                                             self.choice_constraints, priority)
+        best = self._polish_sections(best)
+        self.selection = self.positions[np.flatnonzero(best[:self.num_lectures])]
+        return self.selection
+
+    def _polish_sections(self, sample):
+        """
+        Moves every chosen section to the best section of its course, one course after another
+        (dropping the non-requested lectures it would overlap). Short anneals often stop at a worse
+        section of the right course, and section moves are exactly what the seat prices ask for.
+        """
+        N = self.num_lectures
+        for members in self.choice_constraints["sections"]:
+            if sample[members].sum() != 1:
+                continue
+            candidates = np.repeat(sample[None, :], len(members), axis=0)
+            candidates[:, members] = 0
+            for row, k in enumerate(members.tolist()):
+                candidates[row, self.displaced[k]] = 0
+                candidates[row, k] = 1
+            # Free-day variables follow the lectures (set iff no lecture meets that day)
+            for day_idx, day_members in enumerate(self.day_members):
+                if len(day_members):
+                    candidates[:, free_day_variable(N, day_idx)] = candidates[:, day_members].sum(axis=1) == 0
+            energies = self.bqm.energies((candidates, range(self.bqm.num_variables)))
+            sample = candidates[np.argmin(energies)]
+        return sample
+
+class _CohortShard:
+    """The student models of one worker. Students whose model fails to build are reported, not solved."""
+
+    def __init__(self, students, options):
+        catalog = get_catalog(options.get("catalog_id"))
+        self.models = {}
+        self.errors = {}
+        for index, preferences in students:
+            try:
+                self.models[index] = _StudentModel(index, preferences, catalog, options)
+            except Exception as e:
+                self.errors[index] = str(e)
+
+    def solve(self, prices, closed=None, only=None):
+        """Returns {student index: chosen catalog positions} for the students in `only` (default: all)."""
+        closed = closed or {}
+        indices = self.models if only is None else [index for index in only if index in self.models]
+        return {index: self.models[index].solve(prices, closed.get(index, ())) for index in indices}
+
+def _init_cohort_worker(snapshot_path, source_sha256, students, options):
+    """Process-pool initializer: attach to the shared catalog and build this worker's student models."""
+    global _worker_shard
+    attach_catalog(snapshot_path, source_sha256, options.get("catalog_id"))
+    _worker_shard = _CohortShard(students, options)
+
+def _worker_errors():
+    return _worker_shard.errors
+
+def _solve_worker_shard(prices, closed, only):
+    return _worker_shard.solve(prices, closed, only)
+
+def _update_prices(prices, demand, capacity, limited, step):
+    violation = (demand[limited] - capacity[limited]) / capacity[limited]
+    prices[limited] = np.maximum(0.0, prices[limited] + step * violation)
+
+def _demand(assignments, num_positions):
+    chosen = [positions for positions in assignments.values() if len(positions)]
+    if not chosen:
+        return np.zeros(num_positions, dtype=np.int64)
+    return np.bincount(np.concatenate(chosen), minlength=num_positions)
+
+def run_cohort(preference_sets, options=None, progress=None):
+    """
+    Assigns schedules to a cohort of students (one preference set each) under the seat limits.
+    options: catalog_id, max_iterations, price_step, section_bonus, fixed_sections, max_candidates, seed,
+    capacity_overrides ({lecture_id: seats}), max_workers.
+    Returns {"students": [...], "sections": [...], "iterations": [...], "overloaded_sections": int, "seconds"}.
+    """
+    options = dict(options or {})
+    catalog = get_catalog(options.get("catalog_id"))
+    start = time.perf_counter()
+
+    capacity = np.array(catalog.capacity, dtype=np.int64)
+    for lec_id, seats in (options.get("capacity_overrides") or {}).items():
+        if lec_id not in catalog.positions:
+            raise ValueError(f"Unknown lecture '{lec_id}' in capacity_overrides.")
+        capacity[catalog.positions[lec_id]] = seats
+    options["capacity"] = capacity
+    limited = np.flatnonzero(capacity > 0)
+    num_positions = len(catalog.lectures)
+
+    def report(summary):
+        print(f"Cohort: {summary}")
+        if progress:
+            progress(summary)
+
+    students = list(enumerate(preference_sets))
+    max_workers = options.get("max_workers") or os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, len(students)))
+    report(f"Building {len(students)} student models on {max_workers} worker(s)...")
+
+    executors = []
+    local_shard = None
+    try:
+        if max_workers == 1:
+            local_shard = _CohortShard(students, options)
+            errors = dict(local_shard.errors)
+
+            def solve(prices, closed=None, only=None):
+                return local_shard.solve(prices, closed, only)
+        else:
+            # One single-process executor per shard: a shard's models stay in "its" worker between rounds.
+            # spawn (not fork): the server process runs threads, and workers attach to the catalog via mmap.
+            for shard in range(max_workers):
+                executors.append(concurrent.futures.ProcessPoolExecutor(
+                    max_workers=1, mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_cohort_worker,
+                    initargs=(catalog.snapshot_path, catalog.source_sha256, students[shard::max_workers], options)))
+            errors = {}
+            for future in [executor.submit(_worker_errors) for executor in executors]:
+                errors.update(future.result())
+
+            def solve(prices, closed=None, only=None):
+                assignments = {}
+                for future in [executor.submit(_solve_worker_shard, prices, closed, only) for executor in executors]:
+                    assignments.update(future.result())
+                return assignments
+
+        # -------------------------------------------------------------------------
+        # Lagrangian rounds
+        # -------------------------------------------------------------------------
+        prices = np.zeros(num_positions, dtype=np.float64)
+        price_step = options.get("price_step") or DEFAULT_PRICE_STEP
+        max_iterations = options.get("max_iterations") or DEFAULT_MAX_ITERATIONS
+        iterations = []
+        assignments = {}
+        for t in range(max_iterations):
+            round_start = time.perf_counter()
+            assignments = solve(prices)
+            demand = _demand(assignments, num_positions)
+            excess = np.maximum(0, demand[limited] - capacity[limited])
+            iterations.append({"iteration": t, "overloaded_sections": int(np.count_nonzero(excess)),
+                               "excess_seats": int(excess.sum()), "max_price": round(float(prices.max()), 2),
+                               "seconds": round(time.perf_counter() - round_start, 3)})
+            report(f"Round {t + 1}/{max_iterations}: {iterations[-1]['overloaded_sections']} sections over capacity "
+                   f"({iterations[-1]['excess_seats']} seats)")
+            if not excess.any():
+                break
+            _update_prices(prices, demand, capacity, limited, price_step / np.sqrt(t + 1))
+
+        # -------------------------------------------------------------------------
+        # Repair: evict the excess holders of full sections and re-solve them with those sections closed
+        # -------------------------------------------------------------------------
+        rng = random.Random(options.get("seed") or 0)
+        tiebreak = {index: rng.random() for index in assignments}
+        requested = {index: {catalog.positions[lec_id] for lec_id in preferences.get("selected_lecture_ids", [])
+                             if lec_id in catalog.positions}
+                     for index, preferences in students}
+        closed = {}
+        evicted = {}
+        for repair_round in range(REPAIR_ROUNDS + 1):
+            demand = _demand(assignments, num_positions)
+            over = [pos for pos in limited if demand[pos] > capacity[pos]]
+            if not over:
+                break
+            full = {int(pos) for pos in limited if demand[pos] >= capacity[pos]}
+            dropped = {}
+            for pos in over:
+                holders = sorted((index for index, positions in assignments.items() if pos in positions),
+                                 key=lambda index: (pos not in requested[index], tiebreak[index]))
+                for index in holders[capacity[pos]:]:
+                    dropped.setdefault(index, set()).add(int(pos))
+            if repair_round == REPAIR_ROUNDS:
+                # Out of repair rounds: the remaining excess holders lose the section
+                for index, positions in dropped.items():
+                    assignments[index] = np.array([pos for pos in assignments[index] if pos not in positions], dtype=np.int64)
+                    evicted.setdefault(index, set()).update(positions)
+                break
+            for index, positions in dropped.items():
+                holding = set(assignments[index].tolist()) - positions
+                closed.setdefault(index, set()).update(positions | (full - holding))
+            report(f"Repair round {repair_round + 1}: re-solving {len(dropped)} students for {len(over)} full sections")
+            for index, positions in solve(prices, {index: closed[index] for index in dropped}, list(dropped)).items():
+                # A closed section can still win when the student has no other way to satisfy a course group
+                kept = [pos for pos in positions.tolist() if pos not in closed[index]]
+                evicted.setdefault(index, set()).update(set(positions.tolist()) - set(kept))
+                assignments[index] = np.array(kept, dtype=np.int64)
+
+        demand = _demand(assignments, num_positions)
+    finally:
+        for executor in executors:
+            executor.shutdown(cancel_futures=True)
+
+    student_results = []
+    for index, preferences in students:
+        if index in errors:
+            student_results.append({"index": index, "status": "FAILURE", "error": errors[index]})
+            continue
+        chosen = [catalog.lectures[pos] for pos in assignments[index].tolist()]
+        chosen_numbers = {lec["number"] for lec in chosen}
+        chosen_ids = {lec["id"] for lec in chosen}
+        moved, missing = [], []
+        for lec_id in preferences.get("selected_lecture_ids", []):
+            lec = catalog.get_lecture(lec_id)
+            if lec is None or lec_id in chosen_ids:
+                continue
+            if lec["number"] in chosen_numbers:
+                moved.append({"requested": lec_id, "assigned": next(other["id"] for other in chosen if other["number"] == lec["number"])})
+            else:
+                missing.append(lec_id)
+        student_results.append({
+            "index": index,
+            "status": "SUCCESS",
+            "lecture_ids": [lec["id"] for lec in chosen],
+            "total_credits": sum(lec["credit"] for lec in chosen),
+            "moved": moved,
+            "missing": missing,
+            "evicted": [catalog.lectures[pos]["id"] for pos in sorted(evicted.get(index, ()))],
+        })
+
+    sections = [{"lecture_id": catalog.lectures[pos]["id"], "capacity": int(capacity[pos]), "demand": int(demand[pos]),
+                 "price": round(float(prices[pos]), 2)}
+                for pos in limited if demand[pos] or prices[pos]]
+    sections.sort(key=lambda section: (-section["price"], -section["demand"]))
+    overloaded = sum(1 for section in sections if section["demand"] > section["capacity"])
+    seconds = round(time.perf_counter() - start, 3)
+    report(f"Assigned {len(students) - len(errors)} students in {seconds}s, {overloaded} sections over capacity.")
+    return {"students": student_results, "sections": sections, "iterations": iterations,
+            "overloaded_sections": overloaded, "seconds": seconds}
+
+def optimize_cohort(task_id, request):
+    """Background worker of a cohort task (request: {"students": [...preferences], **options})."""
+    from .task_manager import update_task_status
+
+    try:
+        update_task_status(task_id, "PROCESSING")
+        options = {key: value for key, value in request.items() if key != "students"}
+        result = run_cohort(request["students"], options,
+                            progress=lambda summary: update_task_status(task_id, "PROCESSING", summary=summary))
+        update_task_status(task_id, "SUCCESS", result=result)
+    except Exception as e:
+        print(f"Task {task_id} Failed: {str(e)}")
+        update_task_status(task_id, "FAILURE", error=str(e))
@@ -0,0 +1,234 @@
+"""
+Latency cost model of the Simulated Annealing path and the planner behind latency_budget_ms.
+
+The time of every pipeline stage (see metrics.py) is modelled as a non-negative linear function
+of a few size features. The credit term makes the BQM dense, so building it and each annealing
+sweep cost ~N^2 for a pool of N lectures:
+
+    pair_structure, bqm_build:  N^2, N, 1
+    sampling:                   sweeps * N^2, sweeps * N, batches, 1   (sweeps = reads * num_sweeps)
+    decoding:                   N, 1
+    candidate_selection:        1
+
+The coefficients are fitted offline from real pipeline runs (python -m benchmarks.cost_model,
+which writes data/cost_model.json; without it the defaults below, fitted the same way, are used).
+Live runs then correct each stage by a running factor (EWMA of log(observed / predicted)), so the
+model follows the speed of the machine it actually runs on.
+
+plan_parameters() picks max_candidates, total_reads and batch_size for a latency budget: the
+largest pool that fits with BASE_READS reads, then more reads once the pool is at its maximum,
+or fewer reads (down to MIN_READS) when even the smallest pool does not fit.
+"""
+import json
+import math
+import os
+import pathlib
+import threading
+import numpy as np
+from ..core.snapshot import DATA_DIR
+
+DEFAULT_PROFILE_PATH = DATA_DIR / "cost_model.json"
+
+STAGES = ("candidate_selection", "pair_structure", "bqm_build", "sampling", "decoding")
+
+# ms per feature unit (features are scaled in stage_features), fitted with benchmarks/cost_model.py
+# on a single-core development machine (N = 50..400, 20..300 reads; within +-16% of the measured totals)
+DEFAULT_COEFFICIENTS = {
+    "candidate_selection": [2.12],
+    "pair_structure": [0.518, 0.491, 0.753],
+    "bqm_build": [0.896, 0.0, 0.738],
+    "sampling": [422.5, 269.1, 0.0, 0.0],
+    "decoding": [0.351, 0.458],
+}
+
+# Weight of a new observation in a stage's running correction factor
+CORRECTION_ALPHA = 0.2
+# Single observations off by more than this factor are clipped (cold caches, GC pauses, ...)
+MAX_CORRECTION_STEP = 10.0
+
+# Planner limits
+MIN_FREE_CANDIDATES = 30    # candidates beyond the mandatory / course group lectures
+MAX_AUTO_CANDIDATES = 1000
+MIN_READS = 20
+BASE_READS = 100
+MAX_AUTO_READS = 2000
+DEFAULT_BATCH_SIZE = 100
+# neal's sweeps per read when the request does not set num_sweeps (the unit of the sampling features)
+DEFAULT_NUM_SWEEPS = 1000
+# Share of the budget the prediction may use (the rest absorbs model error)
+BUDGET_HEADROOM = 0.9
+
+_lock = threading.Lock()
+_coefficients = None    # stage -> coefficient list, loaded on first use
+_profile_source = None
+_log_corrections = {}   # stage -> EWMA of log(observed / predicted)
+_observations = 0
+
+def profile_path():
+    return pathlib.Path(os.environ.get("COST_MODEL_PATH") or DEFAULT_PROFILE_PATH)
+
+def effective_reads(total_reads, batch_size):
+    """Reads sample_bqm actually takes: whole batches only."""
+    total_reads = total_reads if total_reads and total_reads > 0 else 100
+    batch_size = batch_size if batch_size and batch_size > 0 else 100
+    return max(1, total_reads // batch_size) * batch_size
+
+def stage_features(stage, num_lectures, total_reads=100, batch_size=100, num_sweeps=None):
+    N = float(num_lectures)
+    if stage in ("pair_structure", "bqm_build"):
+        return [N * N / 1e4, N / 100, 1.0]
+    if stage == "sampling":
+        reads = effective_reads(total_reads, batch_size)
+        # Reads of DEFAULT_NUM_SWEEPS sweeps each
+        sweeps = reads * (num_sweeps or DEFAULT_NUM_SWEEPS) / DEFAULT_NUM_SWEEPS
+        return [sweeps * N * N / 1e6, sweeps * N / 1e4, reads / batch_size if batch_size else 1.0, 1.0]
+    if stage == "decoding":
+        return [N / 100, 1.0]
+    return [1.0]
+
+def fit_coefficients(rows):
+    """
+    Non-negative least squares fit per stage.
+    rows: [{"num_lectures", "total_reads", "batch_size", "stages": {stage: ms}}] of real runs, plus
+    "num_sweeps" for runs that did not use DEFAULT_NUM_SWEEPS.
+    """
+    coefficients = {}
+    for stage in STAGES:
+        X = np.array([stage_features(stage, row["num_lectures"], row["total_reads"], row["batch_size"],
+                                     row.get("num_sweeps"))
+                      for row in rows if stage in row["stages"]])
+        y = np.array([row["stages"][stage] for row in rows if stage in row["stages"]])
+        if not len(y):
+            coefficients[stage] = list(DEFAULT_COEFFICIENTS[stage])
+            continue
+        # Relative error matters (stages span 1 ms .. 1 min): weight rows by 1/y
+        weights = 1.0 / np.maximum(y, 1.0)
+        active = np.ones(X.shape[1], dtype=bool)
+        coef = np.zeros(X.shape[1])
+        # Active-set NNLS: drop the features fitted negative and refit
+        while active.any():
+            solution = np.linalg.lstsq(X[:, active] * weights[:, None], y * weights, rcond=None)[0]
+            if (solution >= 0).all():
+                coef[active] = solution
+                break
+            active[np.flatnonzero(active)[solution < 0]] = False
+        coefficients[stage] = [round(float(c), 6) for c in coef]
+    return coefficients
+
+def _load():
+    """Coefficients of the calibration profile, or the built-in defaults. Caller holds _lock."""
+    global _coefficients, _profile_source
+    if _coefficients is not None:
+        return _coefficients
+    path = profile_path()
+    coefficients = {stage: list(values) for stage, values in DEFAULT_COEFFICIENTS.items()}
+    _profile_source = "defaults"
+    try:
+        with open(path, encoding="utf-8") as f:
+            profile = json.load(f)
+        for stage, values in profile.get("coefficients", {}).items():
+            if stage in coefficients and len(values) == len(coefficients[stage]):
+                coefficients[stage] = [float(v) for v in values]
+        _profile_source = str(path)
+    except (OSError, ValueError):
+        pass
+    _coefficients = coefficients
+    return _coefficients
+
+def _predict_stage(coefficients, stage, num_lectures, total_reads, batch_size, num_sweeps=None, corrected=True):
+    base = float(np.dot(coefficients[stage], stage_features(stage, num_lectures, total_reads, batch_size, num_sweeps)))
+    if corrected:
+        base *= math.exp(_log_corrections.get(stage, 0.0))
+    return base
+
+def predict(num_lectures, total_reads=100, batch_size=100, pareto=False, num_sweeps=None):
+    """Predicted ms per stage and in total ("total_ms") of a Simulated Annealing run over `num_lectures`."""
+    with _lock:
+        coefficients = _load()
+        prediction = {stage: _predict_stage(coefficients, stage, num_lectures, total_reads, batch_size, num_sweeps)
+                      for stage in STAGES}
+    if pareto:
+        # Pareto mode rebuilds the BQM and decodes once per batch (see pareto.py)
+        num_batches = effective_reads(total_reads, batch_size) // (batch_size or 100)
+        prediction["bqm_build"] *= num_batches
+        prediction["decoding"] *= num_batches
+    prediction = {stage: round(ms, 1) for stage, ms in prediction.items()}
+    prediction["total_ms"] = round(sum(prediction.values()), 1)
+    return prediction
+
+def observe(num_lectures, total_reads, batch_size, timings, num_sweeps=None):
+    """Folds the stage spans of a finished Simulated Annealing run (result["timings"]) into the corrections."""
+    global _observations
+    durations = {}
+    for span in timings.get("spans", []):
+        if span["stage"] in STAGES:
+            durations[span["stage"]] = durations.get(span["stage"], 0.0) + span["duration_ms"]
+    with _lock:
+        coefficients = _load()
+        for stage, observed in durations.items():
+            predicted = _predict_stage(coefficients, stage, num_lectures, total_reads, batch_size, num_sweeps,
+                                       corrected=False)
+            if predicted <= 0 or observed <= 0:
+                continue
+            step = math.log(min(max(observed / predicted, 1 / MAX_CORRECTION_STEP), MAX_CORRECTION_STEP))
+            _log_corrections[stage] = (1 - CORRECTION_ALPHA) * _log_corrections.get(stage, 0.0) + CORRECTION_ALPHA * step
+        _observations += 1
+
+def plan_parameters(latency_budget_ms, num_fixed, pareto=False, num_sweeps=None):
+    """
+    Chooses max_candidates / total_reads / batch_size so that the predicted run fits the budget.
+    num_fixed: mandatory + course group lectures (always in the pool). Returns the choice with its
+    prediction; "within_budget" is False when even the smallest setting is predicted to overrun.
+    """
+    target = latency_budget_ms * BUDGET_HEADROOM
+    n_min = num_fixed + MIN_FREE_CANDIDATES
+    n_max = max(n_min, MAX_AUTO_CANDIDATES)
+
+    def batch_for(reads):
+        return min(reads, DEFAULT_BATCH_SIZE)
+
+    def cost(num_lectures, reads):
+        return predict(num_lectures, reads, batch_for(reads), pareto=pareto, num_sweeps=num_sweeps)["total_ms"]
+
+    def largest(lo, hi, fits, step=1):
+        """Largest value in lo..hi (multiples of step above lo) with fits(value), assuming monotonicity."""
+        if not fits(lo):
+            return None
+        lo_k, hi_k = 0, (hi - lo) // step
+        while lo_k < hi_k:
+            mid = (lo_k + hi_k + 1) // 2
+            if fits(lo + mid * step):
+                lo_k = mid
+            else:
+                hi_k = mid - 1
+        return lo + lo_k * step
+
+    reads = BASE_READS
+    num_lectures = largest(n_min, n_max, lambda n: cost(n, BASE_READS) <= target)
+    if num_lectures is None:
+        # Not even the smallest pool fits with BASE_READS reads: trade reads for time
+        num_lectures = n_min
+        reads = largest(MIN_READS, BASE_READS, lambda r: cost(n_min, r) <= target) or MIN_READS
+    elif num_lectures == n_max:
+        reads = largest(BASE_READS, MAX_AUTO_READS, lambda r: cost(n_max, r) <= target, step=DEFAULT_BATCH_SIZE)
+
+    prediction = predict(num_lectures, reads, batch_for(reads), pareto=pareto, num_sweeps=num_sweeps)
+    return {
+        "latency_budget_ms": latency_budget_ms,
+        "max_candidates": num_lectures,
+        "total_reads": reads,
+        "batch_size": batch_for(reads),
+        "predicted_ms": prediction,
+        "within_budget": prediction["total_ms"] <= latency_budget_ms,
+    }
+
+def get_state():
+    """Coefficients, their source and the live correction factors of this process."""
+    with _lock:
+        coefficients = _load()
+        return {
+            "profile": _profile_source,
+            "coefficients": {stage: list(values) for stage, values in coefficients.items()},
+            "corrections": {stage: round(math.exp(value), 3) for stage, value in _log_corrections.items()},
+            "observations": _observations,
+        }
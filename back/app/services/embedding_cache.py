@@ -0,0 +1,151 @@
+"""
+On-disk cache of minor embeddings for the quantum annealing path.
+
+Finding an embedding (minorminer) is usually the most expensive step of a QPU request, and
+repeated requests over the same candidate pool produce the same labeled interaction graph.
+Embeddings are stored per target graph (the QPU's qubit/coupler graph) and per source edge list,
+both identified by a sha256 of their sorted, labeled edge lists (not a graph-isomorphism hash:
+the same graph with its variables relabeled is a different key):
+
+    <EMBEDDING_CACHE_DIR>/<target hash>/<source hash>.json
+
+Only identical graphs hit, so by default (a fresh random candidate pool per request) the hit rate is
+near zero; requests with stable_qpu_pool get the same pool, and hence the same key, every time.
+
+Entries are written atomically (temp file + rename), so concurrent workers never read a
+partial file. The cache keeps at most EMBEDDING_CACHE_MAX_ENTRIES entries (default
+DEFAULT_MAX_ENTRIES) and evicts the least recently used ones, by file mtime, which a hit refreshes.
+The directory defaults to data/embeddings and can be moved with the EMBEDDING_CACHE_DIR
+environment variable.
+"""
+import hashlib
+import json
+import os
+import pathlib
+import threading
+import time
+import numpy as np
+from ..core.snapshot import DATA_DIR
+
+DEFAULT_CACHE_DIR = DATA_DIR / "embeddings"
+DEFAULT_MAX_ENTRIES = 256
+
+# Counters of this process (the embedding itself runs in sampler worker processes,
+# which report back through record_lookup)
+_stats_lock = threading.Lock()
+_stats = {"lookups": 0, "hits": 0, "misses": 0, "embedding_seconds": 0.0, "last_embedding_seconds": None}
+
+def cache_dir():
+    return pathlib.Path(os.environ.get("EMBEDDING_CACHE_DIR") or DEFAULT_CACHE_DIR)
+
+def max_entries():
+    return int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES") or DEFAULT_MAX_ENTRIES)
+
+def _edge_hash(edges, num_nodes):
+    edges = np.array([sorted(edge) for edge in edges], dtype=np.int64).reshape(-1, 2)
+    if len(edges):
+        edges = edges[np.lexsort((edges[:, 1], edges[:, 0]))]
+    digest = hashlib.sha256()
+    digest.update(np.int64(num_nodes).tobytes())
+    digest.update(edges.tobytes())
+    return digest.hexdigest()
+
+def source_edge_key(bqm):
+    """Hash of a BQM's labeled edge list (integer labels, as produced by bqm_builder)."""
+    return _edge_hash(list(bqm.quadratic), bqm.num_variables)
+
+def target_key(sampler):
+    """Hash of a structured sampler's qubit/coupler graph."""
+    return _edge_hash(sampler.edgelist, len(sampler.nodelist))
+
+def load_embedding(target, source):
+    """Returns the cached embedding {variable: [qubits]} or None."""
+    path = cache_dir() / target / f"{source}.json"
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    try:
+        # Recently used: refresh the mtime the eviction goes by
+        os.utime(path)
+    except OSError:
+        pass
+    return {int(v): chain for v, chain in data["embedding"].items()}
+
+def save_embedding(target, source, embedding, embedding_seconds):
+    path = cache_dir() / target / f"{source}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.tmp-{os.getpid()}")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "embedding": {str(v): list(chain) for v, chain in embedding.items()},
+            "embedding_seconds": embedding_seconds,
+            "created_at": time.time(),
+        }, f)
+    os.replace(tmp_path, path)
+    evict_entries()
+
+def evict_entries(limit=None):
+    """Deletes the least recently used entries (oldest mtime) beyond `limit` (default max_entries())."""
+    limit = max_entries() if limit is None else limit
+    entries = []
+    for path in cache_dir().glob("*/*.json"):
+        try:
+            entries.append((path.stat().st_mtime, path))
+        except OSError:
+            pass
+    entries.sort(reverse=True)
+    for _, path in entries[limit:]:
+        try:
+            path.unlink()
+        except OSError:
+            # Already evicted by another worker
+            pass
+
+def find_embedding(bqm, sampler, use_cache=True, **embedding_parameters):
+    """
+    Returns (embedding, cache_hit, embedding_seconds) for `bqm` on the structured `sampler`,
+    running minorminer only on a cache miss. Raises ValueError if no embedding is found.
+    """
+    import minorminer
+
+    target = target_key(sampler)
+    source = source_edge_key(bqm)
+    if use_cache:
+        embedding = load_embedding(target, source)
+        if embedding is not None and all(v in embedding for v in bqm.variables):
+            return embedding, True, 0.0
+
+    start = time.perf_counter()
+    # Self-loops make isolated variables part of the source graph, as EmbeddingComposite does
+    source_edges = list(bqm.quadratic) + [(v, v) for v in bqm.variables]
+    embedding = minorminer.find_embedding(source_edges, sampler.edgelist, **embedding_parameters)
+    embedding_seconds = time.perf_counter() - start
+    if bqm.num_variables and not embedding:
+        raise ValueError("No embedding found for the BQM on the target graph.")
+
+    embedding = {v: list(chain) for v, chain in embedding.items()}
+    if use_cache:
+        save_embedding(target, source, embedding, embedding_seconds)
+    return embedding, False, embedding_seconds
+
+def record_lookup(cache_hit, embedding_seconds):
+    with _stats_lock:
+        _stats["lookups"] += 1
+        _stats["hits" if cache_hit else "misses"] += 1
+        if not cache_hit:
+            _stats["embedding_seconds"] += embedding_seconds
+            _stats["last_embedding_seconds"] = embedding_seconds
+
+def get_stats():
+    """Hit rate and embedding time of this process, plus the number of cached embeddings on disk."""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["hit_rate"] = stats["hits"] / stats["lookups"] if stats["lookups"] else None
+    stats["avg_embedding_seconds"] = stats["embedding_seconds"] / stats["misses"] if stats["misses"] else None
+    root = cache_dir()
+    stats["cached_embeddings"] = sum(1 for _ in root.glob("*/*.json")) if root.exists() else 0
+    stats["max_entries"] = max_entries()
+    stats["cache_dir"] = str(root)
+    return stats
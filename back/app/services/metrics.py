@@ -0,0 +1,192 @@
+"""
+Stage timing of the optimization pipeline and its Prometheus-style aggregation.
+
+run_optimization opens a StageTimer. Code anywhere below it marks stages without
+having the timer passed in:
+- stage(name): context manager timing a block
+- lap(name): closes a sub-span of the current stage, from its start or the previous lap
+  (for long straight-line functions such as build_timetable_bqm)
+Both are no-ops outside of a timer. The collected spans are returned with every result
+(result["timings"]), and observe_timings() aggregates them into the histograms that
+render_prometheus() exposes on /metrics. Tasks submitted with profile=true are additionally
+run under cProfile (see profiled()), and the stats can be downloaded for that task (only the
+MAX_PROFILES most recent profiles are kept).
+"""
+import contextlib
+import contextvars
+import cProfile
+import io
+import os
+import pathlib
+import pstats
+import tempfile
+import threading
+import time
+
+# Histogram buckets in seconds (stages range from sub-millisecond to QPU timeouts)
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_current_timer = contextvars.ContextVar("stage_timer", default=None)
+
+class StageTimer:
+    """Collects {"stage", "start_ms", "duration_ms"} spans relative to its creation."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans = []
+        self._lap_start = None
+
+    def _add(self, name, start, end):
+        self.spans.append({"stage": name,
+                           "start_ms": round((start - self.start) * 1000, 3),
+                           "duration_ms": round((end - start) * 1000, 3)})
+
+    def as_dict(self):
+        return {"total_ms": round((time.perf_counter() - self.start) * 1000, 3), "spans": list(self.spans)}
+
+@contextlib.contextmanager
+def collect_timings():
+    """Activates a new StageTimer for the calling context and yields it."""
+    timer = StageTimer()
+    token = _current_timer.set(timer)
+    try:
+        yield timer
+    finally:
+        _current_timer.reset(token)
+
+@contextlib.contextmanager
+def stage(name):
+    """Records the enclosed block as a span of the active timer (if any)."""
+    timer = _current_timer.get()
+    if timer is None:
+        yield
+        return
+    start = time.perf_counter()
+    outer_lap_start, timer._lap_start = timer._lap_start, start
+    try:
+        yield
+    finally:
+        timer._lap_start = outer_lap_start
+        timer._add(name, start, time.perf_counter())
+
+def lap(name):
+    """Records the time since the enclosing stage started (or the previous lap) as span `name`."""
+    timer = _current_timer.get()
+    if timer is None or timer._lap_start is None:
+        return
+    now = time.perf_counter()
+    timer._add(name, timer._lap_start, now)
+    timer._lap_start = now
+
+# -----------------------------------------------------------------------------
+# Aggregation (per server process)
+# -----------------------------------------------------------------------------
+
+_metrics_lock = threading.Lock()
+# metric name -> {label value: [bucket counts..., +Inf count, sum]}
+_histograms = {"timetable_stage_duration_seconds": {}, "timetable_task_duration_seconds": {}}
+_task_counts = {}
+
+_HELP = {
+    "timetable_stage_duration_seconds": ("stage", "Duration of optimization pipeline stages."),
+    "timetable_task_duration_seconds": ("status", "End-to-end duration of optimization tasks."),
+}
+
+def _observe(metric, label, seconds):
+    series = _histograms[metric].setdefault(label, [0] * (len(DURATION_BUCKETS) + 1) + [0.0])
+    for idx, bound in enumerate(DURATION_BUCKETS):
+        if seconds <= bound:
+            series[idx] += 1
+    series[len(DURATION_BUCKETS)] += 1
+    series[-1] += seconds
+
+def observe_timings(timings, status="SUCCESS"):
+    """Adds the spans of one finished optimization (result["timings"]) to the histograms."""
+    with _metrics_lock:
+        for span in timings.get("spans", []):
+            _observe("timetable_stage_duration_seconds", span["stage"], span["duration_ms"] / 1000)
+        _observe("timetable_task_duration_seconds", status, timings.get("total_ms", 0.0) / 1000)
+        _task_counts[status] = _task_counts.get(status, 0) + 1
+
+def render_prometheus():
+    """Prometheus text exposition (version 0.0.4) of the aggregated metrics."""
+    lines = []
+    with _metrics_lock:
+        for metric, series_by_label in _histograms.items():
+            label_name, help_text = _HELP[metric]
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} histogram")
+            for label, series in sorted(series_by_label.items()):
+                for idx, bound in enumerate(DURATION_BUCKETS):
+                    lines.append(f'{metric}_bucket{{{label_name}="{label}",le="{bound}"}} {series[idx]}')
+                lines.append(f'{metric}_bucket{{{label_name}="{label}",le="+Inf"}} {series[len(DURATION_BUCKETS)]}')
+                lines.append(f'{metric}_sum{{{label_name}="{label}"}} {series[-1]}')
+                lines.append(f'{metric}_count{{{label_name}="{label}"}} {series[len(DURATION_BUCKETS)]}')
+        lines.append("# HELP timetable_tasks_total Finished optimization tasks by status.")
+        lines.append("# TYPE timetable_tasks_total counter")
+        for status, count in sorted(_task_counts.items()):
+            lines.append(f'timetable_tasks_total{{status="{status}"}} {count}')
+    return "\n".join(lines) + "\n"
+
+# -----------------------------------------------------------------------------
+# Opt-in per-task profiles
+# -----------------------------------------------------------------------------
+
+# Saved profiles kept on disk; older ones are deleted when a new one is written
+MAX_PROFILES = 50
+
+def profile_dir():
+    return pathlib.Path(os.environ.get("PROFILE_DIR") or pathlib.Path(tempfile.gettempdir()) / "timetable_profiles")
+
+def profile_path(task_id):
+    return profile_dir() / f"{task_id}.prof"
+
+@contextlib.contextmanager
+def profiled(task_id, enabled=True):
+    """
+    Runs the enclosed block under cProfile and saves the stats (pstats format) to profile_path(task_id).
+    Only the calling thread is profiled; sampling in worker processes shows up as waiting time.
+    """
+    if not enabled:
+        yield
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:
+        # Another profiler is active in this interpreter
+        print(f"Task {task_id}: profiling unavailable ({e}).")
+        yield
+        return
+    try:
+        yield
+    finally:
+        profiler.disable()
+        path = profile_path(task_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(path)
+        _prune_profiles()
+
+def _prune_profiles():
+    """Deletes all but the MAX_PROFILES most recently written profiles."""
+    profiles = []
+    for path in profile_dir().glob("*.prof"):
+        try:
+            profiles.append((path.stat().st_mtime, path))
+        except OSError:
+            pass
+    profiles.sort(reverse=True)
+    for _, path in profiles[MAX_PROFILES:]:
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+def profile_summary(task_id, limit=50):
+    """Text report of a saved profile (top `limit` functions by cumulative time), or None."""
+    path = profile_path(task_id)
+    if not path.exists():
+        return None
+    out = io.StringIO()
+    pstats.Stats(str(path), stream=out).sort_stats("cumulative").print_stats(limit)
+    return out.getvalue()
@@ -0,0 +1,154 @@
+"""
+Pareto mode: one job returns the trade-off schedules between several objectives instead of the
+single optimum of one weighting (which used to take one resubmission per weight setting).
+
+The objectives are categories of the energy breakdown (see decode_top_schedules), all minimized
+and always measured with the request's own weights. Sampling runs in batches; every batch samples
+a BQM whose objective weights are scaled by a different factor vector (the first batch uses the
+request's weights, later ones log-uniform factors in [1/WEIGHT_SPREAD, WEIGHT_SPREAD], so a batch
+takes ~10 ms to rebuild on the shared pair structure). Every decoded sample is scored once per
+objective and folded into a nondominated archive that survives across batches.
+"""
+import math
+import random
+
+from .bqm_builder import build_timetable_bqm
+from .metrics import stage
+from .tuning import annealing_parameters
+from ..utils.time_utils import check_overlap
+
+try:
+    import neal
+except ImportError:
+    neal = None
+import dimod
+
+# Breakdown category -> the preference weights that scale it (free-day rewards keep their break penalty above them)
+OBJECTIVE_WEIGHTS = {
+    "credit_penalty": ("w_target_credit",),
+    "free_day_reward": ("r_free_day", "p_free_day_break"),
+    "tension_penalty": ("w_tension_base",),
+    "1st_period_penalty": ("w_first_class",),
+    "lunch_overlap_penalty": ("w_lunch_overlap",),
+    "contiguous_reward": ("w_contiguous_reward",),
+    "credit/time_mismatch_penalty": ("w_time_credit_ratio",),
+    "distance_penalty": ("w_distance",),
+}
+DEFAULT_OBJECTIVES = ("credit_penalty", "free_day_reward", "tension_penalty")
+WEIGHT_SPREAD = 4.0
+MAX_PARETO_SIZE = 50
+
+def dominates(a, b):
+    """True if objective vector a is at least as good as b everywhere and better somewhere (minimization)."""
+    return all(x <= y for x, y in zip(a, b)) and any(x < y for x, y in zip(a, b))
+
+class ParetoArchive:
+    """Nondominated schedules seen so far, deduplicated by their lecture set."""
+
+    def __init__(self, objectives, max_size=MAX_PARETO_SIZE):
+        self.objectives = list(objectives)
+        self.max_size = max_size
+        self.entries = []   # (objective vector, schedule dict)
+        self.keys = set()
+
+    def add(self, schedule):
+        """Offers a decoded schedule; returns True if it entered the archive."""
+        key = frozenset(lec["id"] for lec in schedule["schedule"])
+        if key in self.keys:
+            return False
+        vector = tuple(schedule["breakdown"][name] for name in self.objectives)
+        if any(dominates(other, vector) or other == vector for other, _ in self.entries):
+            return False
+        kept = [(other, entry) for other, entry in self.entries if not dominates(vector, other)]
+        kept.append((vector, dict(schedule, objectives=dict(zip(self.objectives, vector)))))
+        if len(kept) > self.max_size:
+            # Keep the extremes of every objective, then the lowest total energy
+            extremes = {min(range(len(kept)), key=lambda i: kept[i][0][k]) for k in range(len(self.objectives))}
+            rest = sorted((i for i in range(len(kept)) if i not in extremes), key=lambda i: kept[i][1]["energy"])
+            kept = [kept[i] for i in sorted(extremes | set(rest[:self.max_size - len(extremes)]))]
+        self.entries = kept
+        self.keys = {frozenset(lec["id"] for lec in entry["schedule"]) for _, entry in kept}
+        return key in self.keys
+
+    def front(self):
+        """The archived schedules, lowest (request-weighted) energy first."""
+        return sorted((entry for _, entry in self.entries), key=lambda entry: entry["energy"])
+
+def is_feasible(schedule, mandatory):
+    """Only schedules holding every mandatory lecture without time overlaps are trade-offs worth showing."""
+    if not mandatory <= {lec["id"] for lec in schedule}:
+        return False
+    return not any(check_overlap(schedule[i].get("parsed_time", []), schedule[j].get("parsed_time", []))
+                   for i in range(len(schedule)) for j in range(i + 1, len(schedule)))
+
+def scaled_preferences(preferences, objectives, rng, batch_index):
+    """The request's weights for the first batch, then every objective's weights scaled by a random factor."""
+    if batch_index == 0:
+        return preferences, {name: 1.0 for name in objectives}
+    factors = {name: math.exp(rng.uniform(-math.log(WEIGHT_SPREAD), math.log(WEIGHT_SPREAD))) for name in objectives}
+    scaled = dict(preferences)
+    for name, factor in factors.items():
+        for key in OBJECTIVE_WEIGHTS[name]:
+            if scaled.get(key) is not None:
+                scaled[key] = scaled[key] * factor
+    return scaled, {name: round(factor, 3) for name, factor in factors.items()}
+
+def run_pareto(lectures, pair_structure, preferences, decode, log_prefix="", progress=None,
+               partial=None, should_stop=None):
+    """
+    Samples `total_reads` reads in batches of `batch_size`, one weight scaling per batch, and returns
+    the Pareto front as the result dict (top_schedules = the front, each schedule with its
+    "objectives" and the "weights" factors of the batch that found it).
+    decode(sampleset, bqm) -> decoded schedules with breakdowns under the request's weights.
+    """
+    objectives = list(dict.fromkeys(preferences.get("pareto_objectives") or DEFAULT_OBJECTIVES))
+    total_reads = preferences.get("total_reads") or 100
+    batch_size = preferences.get("batch_size") or 100
+    num_batches = max(1, total_reads // batch_size)
+    mandatory = set(preferences.get("mandatory_ids", []))
+    rng = random.Random(preferences.get("pool_seed"))
+    sampler = neal.SimulatedAnnealingSampler() if neal else dimod.SimulatedAnnealingSampler()
+
+    archive = ParetoArchive(objectives)
+    num_seen = 0
+    print(f"{log_prefix}: Pareto mode over {', '.join(objectives)} ({num_batches} batches of {batch_size} reads)...")
+    for b in range(num_batches):
+        if progress:
+            progress(f"Pareto sampling batch {b + 1}/{num_batches} ({len(archive.entries)} trade-off schedules so far)...")
+        batch_preferences, factors = scaled_preferences(preferences, objectives, rng, b)
+        with stage("pareto_batch"):
+            bqm = build_timetable_bqm(lectures, batch_preferences, pair_structure=pair_structure)
+            sampleset = sampler.sample(bqm, num_reads=batch_size, **annealing_parameters(bqm, preferences))
+            num_seen += batch_size
+            for schedule in decode(sampleset, bqm):
+                if is_feasible(schedule["schedule"], mandatory):
+                    archive.add(dict(schedule, weights=factors))
+        if partial and archive.entries:
+            partial(pareto_result(archive, num_seen))
+        if should_stop and should_stop() and b + 1 < num_batches:
+            print(f"{log_prefix}: Stopped after {num_seen} of {num_batches * batch_size} reads.")
+            break
+
+    if not archive.entries:
+        raise ValueError("No valid schedules could be generated.")
+    result = pareto_result(archive, num_seen)
+    print(f"{log_prefix}: Pareto front of {len(result['top_schedules'])} schedules from {num_seen} reads.")
+    return result
+
+def pareto_result(archive, num_reads):
+    front = archive.front()
+    best = front[0]
+    return {
+        "schedule": best["schedule"],
+        "energy": best["energy"],
+        "total_credits": best["total_credits"],
+        "breakdown": best["breakdown"],
+        "top_schedules": front,
+        "pareto": {
+            "objectives": archive.objectives,
+            "size": len(front),
+            # Best value reached per objective across the front
+            "ideal": {name: min(entry["objectives"][name] for entry in front) for name in archive.objectives},
+        },
+        "num_reads": num_reads,
+    }
@@ -0,0 +1,264 @@
+"""
+Portfolio solving: several engines race on the same BQM under one shared time budget.
+
+Every engine gets the same absolute deadline and runs concurrently (classical engines in their
+own worker process, so they use separate cores; the QPU engine through samplers.sample_embedded,
+which already runs in a worker process). Worker processes are kept between races (up to
+MAX_IDLE_WORKERS) and acquired before the deadline is set, so starting one never eats into the
+budget. Whatever has finished when the deadline (plus a short grace period for returning results)
+hits is merged into a single sampleset. Its "engine" data vector records which engine produced
+each sample; unfinished workers are terminated (and replaced by the next race). Built-in engines:
+- "neal": batched Simulated Annealing until the deadline, keeping the best total_reads unique samples
+- "tabu": Tabu search (dwave.samplers), restarts sharing the remaining time
+- "exact": exhaustive enumeration, only for BQMs of at most EXACT_MAX_VARIABLES variables
+- "qpu": the structured sampler of the request (qpu_sampler), only when the quantum path is enabled
+"""
+import concurrent.futures
+import multiprocessing
+import threading
+import time
+
+import dimod
+import numpy as np
+from .bqm_builder import sample_matrix
+from .samplers import sample_embedded
+from .sample_reducer import TopKSamples
+from .tuning import annealing_parameters
+
+try:
+    import neal
+except ImportError:
+    neal = None
+
+DEFAULT_TIME_BUDGET = 10.0
+# Extra wait for the workers to return (pickle) their samples after the deadline
+RESULT_GRACE_SECONDS = 2.0
+# 2^20 states is ~1s of exhaustive enumeration
+EXACT_MAX_VARIABLES = 20
+# Samples returned by an engine that enumerates far more states than anyone needs
+EXACT_KEEP_SAMPLES = 100
+NEAL_PORTFOLIO_BATCH = 10
+# How often a worker engine checks whether the task was cancelled
+CANCEL_POLL_SECONDS = 0.25
+# Idle engine worker processes kept for the next race (starting one costs ~1-2s of imports)
+MAX_IDLE_WORKERS = 4
+
+# name -> (sample(bqm, preferences, deadline) -> SampleSet, applies(bqm, preferences) -> bool, in_worker)
+_ENGINES = {}
+
+def register_engine(name, sample, applies=None, in_worker=True):
+    """
+    Registers a portfolio engine. sample(bqm, preferences, deadline) must return by the absolute
+    time.time() `deadline`; with in_worker it runs in a separate process and must be a module-level function.
+    """
+    _ENGINES[name] = (sample, applies or (lambda bqm, preferences: True), in_worker)
+
+def available_engines():
+    return sorted(_ENGINES)
+
+class _EngineCancelled(Exception):
+    pass
+
+_idle_workers = []
+_idle_lock = threading.Lock()
+
+def _warm_up():
+    """First task of a new worker: loads the engines' libraries before any race."""
+    from dwave.samplers import TabuSampler  # noqa: F401
+    return True
+
+def _acquire_worker():
+    """An idle engine worker process, or a new (warmed-up) one."""
+    with _idle_lock:
+        if _idle_workers:
+            return _idle_workers.pop()
+    # spawn (not fork): the server process runs threads
+    pool = multiprocessing.get_context("spawn").Pool(1)
+    pool.apply(_warm_up)
+    return pool
+
+def _release_worker(pool, reusable):
+    if reusable:
+        with _idle_lock:
+            if len(_idle_workers) < MAX_IDLE_WORKERS:
+                _idle_workers.append(pool)
+                return
+    pool.terminate()
+    pool.join()
+
+def _run_in_worker(pool, sample, bqm, preferences, deadline, should_stop=None):
+    """Runs sample() on `pool`; the worker is kept if it finished in time, else terminated."""
+    finished = False
+    try:
+        result = pool.apply_async(sample, (bqm, preferences, deadline))
+        while True:
+            remaining = deadline + RESULT_GRACE_SECONDS - time.time()
+            try:
+                sampleset = result.get(max(0.0, min(remaining, CANCEL_POLL_SECONDS)))
+                finished = True
+                return sampleset
+            except multiprocessing.TimeoutError:
+                if remaining <= CANCEL_POLL_SECONDS:
+                    raise
+                if should_stop and should_stop():
+                    raise _EngineCancelled()
+            except Exception:
+                # The engine raised inside a healthy worker
+                finished = True
+                raise
+    finally:
+        _release_worker(pool, reusable=finished)
+
+def _run_engine(name, bqm, preferences, deadline, should_stop=None, worker=None):
+    """Runs one engine (in_worker engines on `worker`, see _acquire_worker) and returns (sampleset or None, stats dict). Never raises."""
+    sample, _, in_worker = _ENGINES[name]
+    start = time.perf_counter()
+    try:
+        if in_worker:
+            sampleset = _run_in_worker(worker, sample, bqm, preferences, deadline, should_stop)
+        else:
+            sampleset = sample(bqm, preferences, deadline)
+        status, error = "ok", None
+    except multiprocessing.TimeoutError:
+        sampleset, status, error = None, "timeout", None
+    except _EngineCancelled:
+        sampleset, status, error = None, "cancelled", None
+    except Exception as e:
+        sampleset, status, error = None, "error", str(e)
+
+    stats = {"status": status, "seconds": round(time.perf_counter() - start, 3),
+             "num_samples": len(sampleset) if sampleset is not None else 0,
+             "best_energy": float(sampleset.first.energy) if sampleset is not None and len(sampleset) else None}
+    if error:
+        stats["error"] = error
+    return sampleset, stats
+
+def _merge_samplesets(bqm, samplesets):
+    """One BINARY sampleset of all engines' samples (energies recomputed on `bqm`) with an "engine" data vector."""
+    num_variables = bqm.num_variables
+    sample_blocks, energy_blocks, engine_blocks = [], [], []
+    for name, sampleset in samplesets.items():
+        if sampleset is None or not len(sampleset):
+            continue
+        samples, energies = sample_matrix(sampleset, num_variables)
+        sample_blocks.append(samples)
+        # Engines report energies of their own (e.g. the QPU: of the embedded problem), so recompute
+        energy_blocks.append(bqm.energies((samples, range(num_variables))))
+        engine_blocks.append(np.full(len(samples), name))
+
+    if sample_blocks:
+        return dimod.SampleSet.from_samples(
+            (np.concatenate(sample_blocks), range(num_variables)), dimod.BINARY,
+            energy=np.concatenate(energy_blocks), engine=np.concatenate(engine_blocks))
+    return dimod.SampleSet.from_samples(
+        (np.empty((0, num_variables), dtype=np.int8), range(num_variables)), dimod.BINARY, energy=[])
+
+def run_portfolio(bqm, preferences, log_prefix="", progress=None, checkpoint=None, should_stop=None):
+    """
+    Races the portfolio engines (preferences["portfolio_engines"], default: all applicable) on `bqm`
+    for preferences["portfolio_time_budget"] seconds. Returns the merged sampleset, with the
+    per-engine stats in sampleset.info["portfolio"]. The sampleset is empty if no engine produced samples.
+    checkpoint(sampleset) receives the merged samples each time an engine finishes; once should_stop()
+    returns True, the engines still running in worker processes are stopped.
+    """
+    time_budget = preferences.get("portfolio_time_budget") or DEFAULT_TIME_BUDGET
+    requested = preferences.get("portfolio_engines") or available_engines()
+    unknown = [name for name in requested if name not in _ENGINES]
+    if unknown:
+        raise ValueError(f"Unknown portfolio engine(s) {', '.join(unknown)}. Available: {', '.join(available_engines())}")
+
+    engine_stats = {}
+    engines = []
+    for name in requested:
+        if _ENGINES[name][1](bqm, preferences):
+            engines.append(name)
+        else:
+            engine_stats[name] = {"status": "skipped", "seconds": 0.0, "num_samples": 0, "best_energy": None}
+
+    print(f"{log_prefix}: Racing portfolio engines {', '.join(engines)} for {time_budget}s...")
+    if progress:
+        progress(f"Portfolio: {', '.join(engines)} racing for {time_budget:g}s...")
+
+    samplesets = {}
+    if engines:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(engines)) as executor:
+            # Worker processes are ready before the clock starts
+            in_worker = [name for name in engines if _ENGINES[name][2]]
+            workers = dict(zip(in_worker, executor.map(lambda name: _acquire_worker(), in_worker)))
+            deadline = time.time() + time_budget
+            futures = {executor.submit(_run_engine, name, bqm, preferences, deadline, should_stop, workers.get(name)): name
+                       for name in engines}
+            for future in concurrent.futures.as_completed(futures):
+                name = futures[future]
+                samplesets[name], engine_stats[name] = future.result()
+                if checkpoint and samplesets[name] is not None and len(samplesets[name]):
+                    checkpoint(_merge_samplesets(bqm, samplesets))
+    engine_stats = {name: engine_stats[name] for name in requested}
+
+    for name in engines:
+        stats = engine_stats[name]
+        print(f"{log_prefix}:   {name}: {stats['status']} in {stats['seconds']:.2f}s, "
+              f"{stats['num_samples']} samples, best energy {stats['best_energy']}")
+
+    merged = _merge_samplesets(bqm, samplesets)
+    merged.info["portfolio"] = {"time_budget": time_budget, "engines": engine_stats}
+    return merged
+
+def contribution_stats(sampleset, top_schedules):
+    """Per-engine stats of a portfolio run, plus how many of the returned top schedules each engine found."""
+    portfolio = sampleset.info.get("portfolio")
+    if portfolio is None:
+        return None
+    stats = {name: dict(engine) for name, engine in portfolio["engines"].items()}
+    for engine in stats.values():
+        engine["top_k_contributions"] = 0
+    for schedule in top_schedules:
+        if schedule.get("engine") in stats:
+            stats[schedule["engine"]]["top_k_contributions"] += 1
+    return {"time_budget": portfolio["time_budget"], "engines": stats}
+
+# -----------------------------------------------------------------------------
+# Engines
+# -----------------------------------------------------------------------------
+
+def _sample_neal(bqm, preferences, deadline):
+    sampler = neal.SimulatedAnnealingSampler() if neal else dimod.SimulatedAnnealingSampler()
+    best = TopKSamples(preferences.get("total_reads") or 100, bqm.num_variables)
+    schedule = annealing_parameters(bqm, preferences)
+    # At least one batch, then more until the next one would likely overrun the deadline
+    batch_seconds = 0.0
+    while not best.num_seen or time.time() + batch_seconds < deadline:
+        start = time.time()
+        best.add(sampler.sample(bqm, num_reads=NEAL_PORTFOLIO_BATCH, **schedule))
+        batch_seconds = time.time() - start
+    return best.sampleset()
+
+def _sample_tabu(bqm, preferences, deadline):
+    from dwave.samplers import TabuSampler
+    num_reads = preferences.get("portfolio_tabu_reads") or 4
+    # Tabu runs its restarts one after another, each for `timeout` milliseconds
+    timeout_ms = max(10, int((deadline - time.time()) * 1000 / num_reads))
+    return TabuSampler().sample(bqm, num_reads=num_reads, timeout=timeout_ms)
+
+def _sample_exact(bqm, preferences, deadline):
+    return dimod.ExactSolver().sample(bqm).truncate(EXACT_KEEP_SAMPLES)
+
+def _exact_applies(bqm, preferences):
+    return bqm.num_variables <= EXACT_MAX_VARIABLES
+
+def _sample_qpu(bqm, preferences, deadline):
+    # sample_embedded runs (and on timeout kills) its own worker process
+    sampleset, _, _ = sample_embedded(preferences.get("qpu_sampler") or "dwave", preferences, bqm,
+                                      max(0.0, deadline - time.time()),
+                                      use_cache=preferences.get("embedding_cache", True),
+                                      num_reads=preferences.get("total_reads") or 100)
+    return sampleset
+
+def _qpu_applies(bqm, preferences):
+    sampler_name = preferences.get("qpu_sampler") or "dwave"
+    return bool(preferences.get("use_quantum_annealing") and (preferences.get("dwave_token") or sampler_name != "dwave"))
+
+register_engine("neal", _sample_neal)
+register_engine("tabu", _sample_tabu)
+register_engine("exact", _sample_exact, applies=_exact_applies)
+register_engine("qpu", _sample_qpu, applies=_qpu_applies, in_worker=False)
@@ -1,11 +1,21 @@
 import re
 import math
 import random
-import concurrent.futures
-from .task_manager import update_task_status
-from ..core.loader import get_lecture_by_id, get_all_lectures
-from ..utils.time_utils import parse_time_to_range
-from .bqm_builder import build_timetable_bqm
+import time
+import multiprocessing
+import numpy as np
+from .task_manager import update_task_status, is_cancel_requested
+from .samplers import sample_embedded
+from .portfolio import contribution_stats, run_portfolio
+from .pareto import run_pareto
+from . import cost_model
+from .tuning import annealing_parameters
+from .metrics import collect_timings, observe_timings, profiled, stage
+from .sample_reducer import DEFAULT_KEEP_SAMPLES, TopKSamples
+from ..core.loader import get_catalog
+from .bqm_builder import (DAYS, DEFAULT_CREDIT_ENCODING, build_timetable_bqm, build_timetable_cqm,
+                          collect_choice_constraints, collect_pair_structure, free_day_variable,
+                          num_bqm_variables, repair_choice_constraints, sample_matrix)
 
 import dimod
 try:
@@ -13,269 +23,583 @@ try:
 except ImportError:
     neal = None
 
-try:
-    from dwave.system import DWaveSampler, EmbeddingComposite
-except ImportError:
-    DWaveSampler = None
-    EmbeddingComposite = None
+# Minimum seconds between two published partial results of a task (each one is a full decode)
+PARTIAL_RESULT_INTERVAL = 1.0
+
+# dwave.system (and its cloud client) is the slowest import of the service and only
+# needed for the QPU path, so it is imported on first use instead of at startup.
+EmbeddingComposite = None
+LeapHybridCQMSampler = None
+
+def _load_dwave_system():
+    """Imports dwave.system lazily. Returns True if the D-Wave composites are available."""
+    global EmbeddingComposite, LeapHybridCQMSampler
+    if EmbeddingComposite is None:
+        try:
+            from dwave.system import EmbeddingComposite, LeapHybridCQMSampler
+        except ImportError:
+            return False
+    return True
+
+def expand_course_groups(catalog, course_groups):
+    """Resolves course groups (lecture ids and/or course numbers) to the lecture ids of the catalog."""
+    by_number = catalog.memo("lectures_by_number", lambda: _group_by_number(catalog.lectures))
+    lecture_ids = []
+    for group in course_groups or []:
+        for key in group:
+            if catalog.get_lecture(key):
+                lecture_ids.append(key)
+            else:
+                lecture_ids.extend(by_number.get(key, []))
+    return lecture_ids
+
+def _group_by_number(lectures):
+    by_number = {}
+    for lec in lectures:
+        by_number.setdefault(lec.get("number"), []).append(lec["id"])
+    return by_number
+
+def weekday_candidates(catalog):
+    """Lectures that may fill a candidate pool: Saturday classes are excluded (computed once per catalog version)."""
+    return catalog.memo("weekday_candidates", lambda: [
+        lec for lec in catalog.lectures if "토" not in (lec.get("time_room") or "")
+    ])
+
+def select_candidate_pool(catalog, selected_ids, max_candidates, required_ids=(), seed=None):
+    """
+    Returns the BQM variable pool: all mandatory lectures + the required ones (e.g. course group members)
+    + a random subset of candidates, each copied with its precomputed 'parsed_time'.
+    With a seed the subset is reproducible (same request -> same pool -> same BQM graph).
+    """
+    selected_set = set(selected_ids)
+    mandatory_pool = [lec for lec in catalog.lectures if lec["id"] in selected_set]
+    required_set = set(required_ids) - selected_set
+    required_pool = [lec for lec in catalog.lectures if lec["id"] in required_set]
+    candidate_pool = [lec for lec in weekday_candidates(catalog) if lec["id"] not in selected_set and lec["id"] not in required_set]
+
+    # Shuffle candidates for variety
+    if seed is None:
+        random.shuffle(candidate_pool)
+    else:
+        random.Random(seed).shuffle(candidate_pool)
+
+    # Final set = all mandatory + required + subset of candidates
+    fixed_pool = mandatory_pool + required_pool
+    final_pool = fixed_pool + candidate_pool[:(max_candidates - len(fixed_pool))]
+
+    lectures = []
+    for lec in final_pool:
+        lec_copy = lec.copy()
+        lec_copy['parsed_time'] = catalog.get_parsed_time(lec['id'])
+        lectures.append(lec_copy)
+    return lectures
+
+def sample_bqm(bqm, preferences, log_prefix="", progress=None, checkpoint=None, should_stop=None):
+    """
+    Samples the BQM on D-Wave (if requested and available) or with batched Simulated Annealing,
+    or races several engines in portfolio mode (preferences["portfolio"], see portfolio.py).
+    progress(summary) is called with human readable status updates, checkpoint(sampleset) with the
+    best samples so far after every Simulated Annealing batch / finished portfolio engine.
+    Once should_stop() returns True, sampling ends at the next checkpoint with what it has.
+    """
+    def report(summary):
+        if progress:
+            progress(summary)
+
+    TOTAL_READS = preferences.get("total_reads", 100)
+    if TOTAL_READS <= 0:
+        TOTAL_READS = 100
+
+    use_quantum = preferences.get("use_quantum_annealing", False)
+    dwave_token = preferences.get("dwave_token", None)
+    sampler_name = preferences.get("qpu_sampler") or "dwave"
+    QPU_TIMEOUT = preferences.get("qpu_timeout", 30)
+    sampleset = None
+
+    if preferences.get("portfolio"):
+        # All engines (the QPU one included, see portfolio.py) race under one time budget
+        sampleset = run_portfolio(bqm, preferences, log_prefix=log_prefix, progress=progress,
+                                  checkpoint=checkpoint, should_stop=should_stop)
+        if len(sampleset) or (should_stop and should_stop()):
+            return sampleset
+        print(f"{log_prefix}: No portfolio engine returned samples. Falling back to Simulated Annealing...")
+        report("Portfolio returned no samples. Falling back to Simulated Annealing...")
+        sampleset = None
+        use_quantum = False
+
+    # Only the real QPU needs a token; local stand-ins (see samplers.py) run offline
+    if use_quantum and (dwave_token or sampler_name != "dwave") and _load_dwave_system():
+        print(f"{log_prefix}: Solving BQM using QPU sampler '{sampler_name}'...")
+        report("Initializing D-Wave Sampler (Connecting to QPU)...")
+
+        try:
+            report("Mapping problem to QPU topology (Embedding)...")
+            print(f"{log_prefix}: Starting sampling (includes embedding) with {QPU_TIMEOUT}s timeout...")
+
+            # Embedding and QPU access run in a worker process (see samplers.sample_embedded),
+            # which is terminated on timeout instead of being left running.
+            start = time.perf_counter()
+            try:
+                sampleset, solver_id, embedding_stats = sample_embedded(
+                    sampler_name, preferences, bqm, QPU_TIMEOUT,
+                    use_cache=preferences.get("embedding_cache", True), num_reads=TOTAL_READS)
+                elapsed = time.perf_counter() - start
+                qpu_time = sampleset.info.get('timing', {}).get('qpu_access_time', 'N/A')
+                embedding = sampleset.info.get("embedding_context", {}).get("embedding", {})
+                chain_lengths = [len(chain) for chain in embedding.values()]
+                cache_state = "cache hit" if embedding_stats["cache_hit"] else f"found in {embedding_stats['embedding_seconds']:.2f}s"
+                print(f"{log_prefix}: Sampling complete on {solver_id} in {elapsed:.2f}s. QPU access time: {qpu_time} us. "
+                      f"Embedding ({cache_state}): {sum(chain_lengths)} qubits, max chain {max(chain_lengths, default=0)}")
+                report("Retrieving results from QPU...")
+            except multiprocessing.TimeoutError:
+                print(f"{log_prefix} Error: D-Wave Optimization timed out after {QPU_TIMEOUT} seconds.")
+                report(f"D-Wave timeout ({QPU_TIMEOUT}s). Falling back to Simulated Annealing...")
+                use_quantum = False
+        except Exception as dw_e:
+            import traceback
+            traceback.print_exc()
+            print(f"{log_prefix} D-Wave Error: {str(dw_e)}")
+            # Fallback to Simulated Annealing if D-Wave fails
+            report(f"D-Wave failed ({str(dw_e)[:50]}...). Falling back to Simulated Annealing...")
+            use_quantum = False
+
+    if sampleset is None:
+        # Re-check use_quantum in case of fallback
+        print(f"{log_prefix}: Solving BQM using C++ Neal Sampler (Batched)...")
+
+        if neal:
+            sampler = neal.SimulatedAnnealingSampler()
+        else:
+            sampler = dimod.SimulatedAnnealingSampler()
+
+        BATCH_SIZE = preferences.get("batch_size", 100)
+        if BATCH_SIZE <= 0:
+            BATCH_SIZE = 100
+
+        num_batches = max(1, TOTAL_READS // BATCH_SIZE)
+        schedule = annealing_parameters(bqm, preferences)
+
+        # Each batch is folded into the best unique samples and dropped (constant memory in total_reads)
+        best = TopKSamples(preferences.get("keep_samples") or DEFAULT_KEEP_SAMPLES, bqm.num_variables)
+        for b in range(num_batches):
+            progress_pct = int(((b + 1) / num_batches) * 100)
+            report(f"Simulated Annealing in progress... ({progress_pct}%)")
+
+            # Perform batch sampling
+            best.add(sampler.sample(bqm, num_reads=BATCH_SIZE, **schedule))
+            if checkpoint:
+                best_so_far = best.sampleset()
+                best_so_far.info["num_reads"] = best.num_seen
+                checkpoint(best_so_far)
+            if should_stop and should_stop() and b + 1 < num_batches:
+                print(f"{log_prefix}: Stopped after {best.num_seen} of {num_batches * BATCH_SIZE} reads.")
+                report(f"Stopped early after {best.num_seen} reads.")
+                break
+
+        sampleset = best.sampleset()
+        sampleset.info["num_reads"] = best.num_seen
+
+    return sampleset
+
+def sample_cqm(cqm, preferences, log_prefix="", progress=None):
+    """
+    Samples a ConstrainedQuadraticModel on the Leap hybrid CQM solver.
+    Returns None if the solver is unavailable or fails, so the caller can fall back to a BQM.
+    """
+    def report(summary):
+        if progress:
+            progress(summary)
+
+    dwave_token = preferences.get("dwave_token", None)
+    if not (preferences.get("use_quantum_annealing", False) and dwave_token and _load_dwave_system()):
+        return None
+
+    try:
+        print(f"{log_prefix}: Solving CQM using Leap Hybrid CQM Sampler...")
+        report("Submitting CQM to Leap Hybrid Solver...")
+        sampler = LeapHybridCQMSampler(token=dwave_token)
+        sampleset = sampler.sample_cqm(cqm, label=log_prefix)
+        report("Retrieving results from Leap Hybrid Solver...")
+        return sampleset
+    except Exception as cqm_e:
+        print(f"{log_prefix} CQM Error: {str(cqm_e)}")
+        report(f"Hybrid CQM solver failed ({str(cqm_e)[:50]}...). Falling back to BQM...")
+        return None
+
+def decode_top_schedules(sampleset, lectures, preferences, limit=5, priority=None, building_distance=None):
+    """
+    Parses the Top `limit` unique schedules (with their energy breakdown) out of a sampleset.
+    This is where integer BQM variables are mapped back to the lectures of the pool.
+    Samples are first repaired to satisfy the course choice constraints; priority (per lecture,
+    higher is better, default: pool order) decides which section / group member is kept.
+    building_distance (the catalog's table) enables the room transition part of the breakdown.
+    """
+    from ..utils.time_utils import check_overlap, calculate_time_gap
+
+    selected_ids = set(preferences.get("selected_lecture_ids", []))
+    N = len(lectures)
+    samples, energies = sample_matrix(sampleset, num_bqm_variables(N))
+    # Portfolio samplesets record the engine of every sample
+    engines = sampleset.record.engine if "engine" in sampleset.record.dtype.names else None
+
+    choice_constraints = collect_choice_constraints(lectures, preferences)
+    if priority is None:
+        priority = -np.arange(N, dtype=np.float64)
+
+    # Free-day auxiliaries only carry terms on days where some pool lecture meets
+    active_days = {pt['day'] for lec in lectures for pt in lec.get('parsed_time', [])}
+
+    # Walk samples from lowest energy to highest
+    top_schedules = []
+    seen_combinations = set()
+
+    for row in np.argsort(energies, kind="stable"):
+        if len(top_schedules) >= limit:
+            break
+
+        # Exclude auxiliary variables y_d (indices N..N+6)
+        lecture_bits = repair_choice_constraints(samples[row, :N], lectures, choice_constraints, priority)
+        selected = np.flatnonzero(lecture_bits)
+
+        # Create a unique signature for this schedule combination
+        combo_sig = np.packbits(lecture_bits).tobytes()
+        if combo_sig not in seen_combinations and len(selected) > 0:
+            seen_combinations.add(combo_sig)
+            current_schedule = [dict(lectures[i]) for i in selected]
+            energy = float(energies[row])
+            sample = samples[row]
+
+            # Basic Check: Calculate total credits for logging
+            total_credits_found = sum(lec['credit'] for lec in current_schedule)
+
+            # Manual Breakdown Energy calculation
+            breakdown = {
+                "credit_penalty": 0.0,
+                "1st_period_penalty": 0.0,
+                "lunch_overlap_penalty": 0.0,
+                "free_day_reward": 0.0,
+                "overlap_penalty": 0.0,
+                "contiguous_reward": 0.0,
+                "tension_penalty": 0.0,
+                "mandatory_reward": 0.0,
+                "credit/time_mismatch_penalty": 0.0,
+                "distance_penalty": 0.0,
+            }
+
+            # Recalculate based on preferences weights
+            T_CREDIT = preferences.get("target_credits", 21.0)
+            W_CREDIT = preferences.get("w_target_credit", 100.0)
+            W_FIRST = preferences.get("w_first_class", 50.0)
+            W_LUNCH = preferences.get("w_lunch_overlap", 30.0)
+            R_FREE = preferences.get("r_free_day", 100.0)
+            P_FREE_BREAK = preferences.get("p_free_day_break", 500.0)
+            W_OVERLAP = preferences.get("w_hard_overlap", 10000.0)
+            W_CONTIG = preferences.get("w_contiguous_reward", -20.0)
+            W_TENSION = preferences.get("w_tension_base", 5.0)
+            W_MAN = preferences.get("w_mandatory", -10000.0)
+            W_TIME_CREDIT = preferences.get("w_time_credit_ratio", 50.0)
+            W_DISTANCE = preferences.get("w_distance", 0.1)
+            TRANSITION_WINDOW = preferences.get("transition_window", 30)
+
+            breakdown["credit_penalty"] = round(W_CREDIT * (total_credits_found - T_CREDIT)**2, 2)
+
+            days_with_classes = set()
+            for lec in current_schedule:
+                if lec["id"] in selected_ids:
+                    breakdown["mandatory_reward"] += W_MAN
+
+                total_duration_minutes = 0
+                for pt in lec.get('parsed_time', []):
+                    days_with_classes.add(pt['day'])
+                    total_duration_minutes += (pt['end'] - pt['start'])
+                    if pt['start'] <= 570:
+                        breakdown["1st_period_penalty"] += W_FIRST
+                    if max(pt['start'], 720) < min(pt['end'], 780):
+                        breakdown["lunch_overlap_penalty"] += W_LUNCH
+
+                duration_hours = total_duration_minutes / 60.0
+                if duration_hours > lec['credit']:
+                    breakdown["credit/time_mismatch_penalty"] += round(W_TIME_CREDIT * (duration_hours - lec['credit']), 2)
+
+            # Free day logical reward
+            for day_idx, d in enumerate(DAYS):
+                if d in active_days and sample[free_day_variable(N, day_idx)] == 1:
+                    breakdown["free_day_reward"] += -R_FREE
+                    if d in days_with_classes:
+                        breakdown["free_day_reward"] += P_FREE_BREAK
+
+            # Pairwise penalties
+            for i in range(len(current_schedule)):
+                for j in range(i+1, len(current_schedule)):
+                    lec_i = current_schedule[i]
+                    lec_j = current_schedule[j]
+
+                    for pt_i in lec_i.get('parsed_time', []):
+                        for pt_j in lec_j.get('parsed_time', []):
+                            if pt_i['day'] == pt_j['day']: # Same day only
+                                if check_overlap([pt_i], [pt_j]):
+                                    breakdown["overlap_penalty"] += W_OVERLAP
+                                else:
+                                    gap = calculate_time_gap([pt_i], [pt_j])
+                                    if 0 < gap <= 60:
+                                        breakdown["contiguous_reward"] += W_CONTIG
+                                    elif 60 < gap <= 180:
+                                        breakdown["tension_penalty"] += round(W_TENSION * math.sqrt(gap), 2)
+                                    if building_distance is not None and gap <= TRANSITION_WINDOW:
+                                        distance = building_distance[pt_i.get('building', 0), pt_j.get('building', 0)]
+                                        breakdown["distance_penalty"] += round(W_DISTANCE * float(distance), 2)
+
+            if "overlap_penalty" in breakdown:
+                del breakdown["overlap_penalty"]
+
+            true_energy = sum(breakdown.values())
+
+            top_schedule = {
+                "schedule": current_schedule,
+                "energy": true_energy,
+                "total_credits": total_credits_found,
+                "breakdown": breakdown,
+                "raw_bqm_energy": energy
+            }
+            if engines is not None:
+                top_schedule["engine"] = str(engines[row])
+            top_schedules.append(top_schedule)
+
+    return top_schedules
+
+def _pool_seed(preferences):
+    """
+    Seed of the candidate pool. With stable_qpu_pool, QPU requests get a seed derived from the request,
+    so repeating a request rebuilds the same interaction graph and hits the cached embedding (but
+    always explores the same pool).
+    """
+    if preferences.get("pool_seed") is not None:
+        return preferences["pool_seed"]
+    if preferences.get("use_quantum_annealing") and preferences.get("stable_qpu_pool"):
+        key = "|".join(sorted(preferences.get("selected_lecture_ids", [])) +
+                       sorted(str(group) for group in preferences.get("course_groups") or []))
+        return f"{key}|{preferences.get('max_candidates', 300)}"
+    return None
+
+class OptimizationCancelled(Exception):
+    """The task was cancelled before any schedule was found."""
+
+def run_optimization(preferences: dict, catalog=None, lectures=None, pair_structure=None,
+                     log_prefix="Optimization", progress=None, partial=None, should_stop=None):
+    """
+    Runs one full optimization (candidate pool -> BQM -> sampling -> decoding) and returns the result dict.
+    - lectures / pair_structure: a precomputed candidate pool and its weight-independent pair terms
+      (see bqm_builder.collect_pair_structure), shared when many requests are solved together.
+    - progress(summary): optional status callback.
+    - partial(result): optional callback receiving the best schedules so far (same shape as the result)
+      during sampling, at most every PARTIAL_RESULT_INTERVAL seconds.
+    - should_stop(): optional; once it returns True, sampling stops at its next checkpoint and the
+      result is decoded from the samples so far (result["stopped_early"]). Raises OptimizationCancelled
+      if that happens before sampling.
+    preferences["pareto"] returns the Pareto front over preferences["pareto_objectives"] as the
+    top schedules instead (see pareto.py).
+    preferences["latency_budget_ms"] lets the cost model choose max_candidates / total_reads /
+    batch_size (reported in result["auto_parameters"], see cost_model.py); for runs the model does not
+    describe (QPU, portfolio, non-dense credit encodings) it is ignored, with auto_parameters["ignored"].
+    The per-stage timing spans are returned in result["timings"] (see metrics.py).
+    The caller's preferences are left untouched (the stages fill in mandatory_ids and planned sizes on a copy).
+    """
+    preferences = dict(preferences)
+    with collect_timings() as timer:
+        result = _run_stages(preferences, catalog, lectures, pair_structure, log_prefix, progress, partial, should_stop)
+    result["timings"] = timer.as_dict()
+    if "auto_parameters" in result:
+        result["auto_parameters"]["actual_ms"] = result["timings"]["total_ms"]
+    if _models_cost(preferences) and not result.get("stopped_early"):
+        cost_model.observe(result["pool_size"], preferences.get("total_reads", 100), preferences.get("batch_size", 100),
+                           result["timings"], num_sweeps=preferences.get("num_sweeps"))
+    return result
+
+def _models_cost(preferences):
+    """
+    True for the runs the cost model describes: local Simulated Annealing on the dense model.
+    Pareto runs can be planned (plan_parameters(pareto=True)) but are not observed.
+    """
+    return not (preferences.get("use_quantum_annealing") or preferences.get("portfolio") or preferences.get("pareto")
+                or preferences.get("credit_encoding") not in (None, "dense"))
+
+def _run_stages(preferences, catalog, lectures, pair_structure, log_prefix, progress, partial=None, should_stop=None):
+    selected_ids = preferences.get("selected_lecture_ids", [])
+    if not selected_ids:
+        raise ValueError("No lectures provided for optimization.")
+
+    # Treat manually selected IDs as mandatory for the BQM
+    preferences["mandatory_ids"] = selected_ids
+
+    print(f"{log_prefix}: Preparing QUBO over all lectures with {len(selected_ids)} mandatory selections.")
+
+    # 1. Fetch ALL Lecture Details (intervals are precomputed by the loader)
+    # The catalog reference is held for the whole task, so a concurrent reload
+    # cannot change the lectures under us.
+    if catalog is None:
+        catalog = get_catalog(preferences.get("catalog_id"))
+
+    auto_parameters = None
+    if lectures is None:
+        with stage("candidate_selection"):
+            group_ids = expand_course_groups(catalog, preferences.get("course_groups"))
+            if preferences.get("latency_budget_ms") and not _models_cost(dict(preferences, pareto=False)):
+                # QPU / portfolio / sparse or CQM runs keep the requested sizes (the model does not describe them)
+                auto_parameters = {"latency_budget_ms": preferences["latency_budget_ms"], "ignored": True}
+                print(f"{log_prefix}: latency_budget_ms ignored, the cost model only sizes dense Simulated Annealing runs.")
+            elif preferences.get("latency_budget_ms"):
+                # Pool size and reads from the cost model instead of the request
+                auto_parameters = cost_model.plan_parameters(preferences["latency_budget_ms"],
+                                                             len(set(selected_ids) | set(group_ids)),
+                                                             pareto=bool(preferences.get("pareto")),
+                                                             num_sweeps=preferences.get("num_sweeps"))
+                preferences.update({key: auto_parameters[key] for key in ("max_candidates", "total_reads", "batch_size")})
+                print(f"{log_prefix}: Latency budget {preferences['latency_budget_ms']} ms -> "
+                      f"{auto_parameters['max_candidates']} candidates, {auto_parameters['total_reads']} reads "
+                      f"(predicted {auto_parameters['predicted_ms']['total_ms']} ms).")
+            # Performance Guard: Now scaled up to 1000 thanks to Neal (C++).
+            # 1000 candidates provide a very rich search space while completing in seconds.
+            MAX_CANDIDATES = preferences.get("max_candidates", 300)
+            lectures = select_candidate_pool(catalog, selected_ids, MAX_CANDIDATES, required_ids=group_ids,
+                                             seed=_pool_seed(preferences))
+
+    N = len(lectures)
+    if N == 0:
+         raise ValueError("None of the selected lectures were found in the database.")
+
+    if pair_structure is None:
+        with stage("pair_structure"):
+            pair_structure = collect_pair_structure(lectures, catalog.building_distance)
+
+    # 2. Build BQM using our algorithmic logic
+    def bqm_progress(msg, pct):
+        if progress:
+            progress(f"Building BQM: {msg} ({pct}%)")
+
+    if preferences.get("pareto"):
+        # Trade-off front between the breakdown objectives instead of one weighted optimum
+        if should_stop and should_stop():
+            raise OptimizationCancelled("Cancelled before any schedule was found.")
+
+        def decode(sampleset, bqm):
+            priority = -np.array([bqm.get_linear(i) for i in range(N)])
+            return decode_top_schedules(sampleset, lectures, preferences, limit=len(sampleset), priority=priority,
+                                        building_distance=catalog.building_distance)
+
+        result = run_pareto(lectures, pair_structure, preferences, decode, log_prefix=log_prefix, progress=progress,
+                            partial=partial, should_stop=should_stop)
+        return _with_sizes(result, N, auto_parameters)
+
+    sampleset = None
+    if preferences.get("credit_encoding") == "cqm":
+        # Only a CQM-capable solver benefits from the constraint form; everything else gets the dense BQM.
+        with stage("bqm_build"):
+            cqm = build_timetable_cqm(lectures, preferences, progress_callback=bqm_progress, pair_structure=pair_structure)
+        with stage("sampling"):
+            sampleset = sample_cqm(cqm, preferences, log_prefix=log_prefix, progress=progress)
+        model = cqm.objective
+        if sampleset is None:
+            print(f"{log_prefix}: No CQM solver available, using the {DEFAULT_CREDIT_ENCODING} credit encoding.")
+            preferences = dict(preferences, credit_encoding=DEFAULT_CREDIT_ENCODING)
+
+    if sampleset is None:
+        with stage("bqm_build"):
+            bqm = build_timetable_bqm(lectures, preferences, progress_callback=bqm_progress, pair_structure=pair_structure)
+        model = bqm
+
+        if should_stop and should_stop():
+            raise OptimizationCancelled("Cancelled before any schedule was found.")
+
+        last_published = None
+
+        def checkpoint(best_so_far):
+            nonlocal last_published
+            now = time.perf_counter()
+            if last_published is not None and now - last_published < PARTIAL_RESULT_INTERVAL:
+                return
+            with stage("partial_decoding"):
+                try:
+                    partial_result = build_result(best_so_far, bqm, lectures, preferences, catalog, log_prefix=None)
+                except ValueError:
+                    return
+            partial_result["num_reads"] = best_so_far.info.get("num_reads")
+            last_published = now
+            partial(partial_result)
+
+        # 3. Submit to Sampler (Simulated or D-Wave)
+        with stage("sampling"):
+            sampleset = sample_bqm(bqm, preferences, log_prefix=log_prefix, progress=progress,
+                                   checkpoint=checkpoint if partial else None, should_stop=should_stop)
+
+    if should_stop and should_stop() and not len(sampleset):
+        raise OptimizationCancelled("Cancelled before any schedule was found.")
+
+    # 4. Parse Top 5 Unique Results
+    with stage("decoding"):
+        result = build_result(sampleset, model, lectures, preferences, catalog, log_prefix=log_prefix)
+    if should_stop and should_stop():
+        result["stopped_early"] = True
+    return _with_sizes(result, N, auto_parameters)
+
+def _with_sizes(result, num_lectures, auto_parameters):
+    result["pool_size"] = num_lectures
+    if auto_parameters is not None:
+        result["auto_parameters"] = auto_parameters
+    return result
+
+def build_result(sampleset, model, lectures, preferences, catalog, log_prefix="Optimization"):
+    """
+    Decodes the top unique schedules of `sampleset` (sampled from `model` over `lectures`) into the
+    result dict of run_optimization. Raises ValueError if no valid schedule is found.
+    log_prefix=None decodes silently (partial results).
+    """
+    # Lectures with the lowest linear bias (mandatory first) win when a sample needs repair
+    priority = -np.array([model.get_linear(i) for i in range(len(lectures))])
+    top_schedules = decode_top_schedules(sampleset, lectures, preferences, priority=priority,
+                                         building_distance=catalog.building_distance)
+
+    if not top_schedules:
+        raise ValueError("No valid schedules could be generated.")
+
+    best_result = top_schedules[0]
+    if log_prefix is not None:
+        print(f"{log_prefix}: Optimization complete. Found {len(top_schedules)} unique schedules. Best Energy: {best_result['energy']}")
+
+    result = {
+        "schedule": best_result["schedule"], # Keep for backward compatibility
+        "energy": best_result["energy"],
+        "total_credits": best_result["total_credits"],
+        "breakdown": best_result["breakdown"],
+        "top_schedules": top_schedules
+    }
+    portfolio_stats = contribution_stats(sampleset, top_schedules)
+    if portfolio_stats is not None:
+        result["portfolio"] = portfolio_stats
+    return result
 
 def optimize_timetable(task_id: str, preferences: dict):
     """
     Background worker function that builds the BQM and solves it via Simulated Annealing.
     """
+    start = time.perf_counter()
     try:
         update_task_status(task_id, "PROCESSING")
-        
-        selected_ids = preferences.get("selected_lecture_ids", [])
-        if not selected_ids:
-            raise ValueError("No lectures provided for optimization.")
-            
-        # Treat manually selected IDs as mandatory for the BQM
-        preferences["mandatory_ids"] = selected_ids
-            
-        print(f"Task {task_id}: Preparing QUBO over all lectures with {len(selected_ids)} mandatory selections.")
-        
-        # 1. Fetch ALL Lecture Details and Parse Times
-        all_lectures_data = get_all_lectures()
-        
-        # Performance Guard: Now scaled up to 1000 thanks to Neal (C++).
-        # 1000 candidates provide a very rich search space while completing in seconds.
-        MAX_CANDIDATES = preferences.get("max_candidates", 300)
-        candidate_pool = []
-        mandatory_pool = []
-        for lec in all_lectures_data:
-            if lec["id"] in selected_ids:
-                mandatory_pool.append(lec)
-            else:
-                # Exclude Saturday classes from candidates
-                if "토" not in (lec.get("time_room") or ""):
-                    candidate_pool.append(lec)
-        
-        # Shuffle candidates for variety
-        random.shuffle(candidate_pool)
-        
-        # Final set = all mandatory + subset of candidates
-        final_pool = mandatory_pool + candidate_pool[:(MAX_CANDIDATES - len(mandatory_pool))]
-        
-        lectures = []
-        for lec in final_pool:
-            lec_copy = lec.copy()
-            lec_copy['parsed_time'] = parse_time_to_range(lec['time_room'])
-            lectures.append(lec_copy)
-        
-        N = len(lectures)
-        if N == 0:
-             raise ValueError("None of the selected lectures were found in the database.")
-        
-        # 2. Build BQM using our algorithmic logic
-        def bqm_progress(msg, pct):
-            update_task_status(task_id, "PROCESSING", summary=f"Building BQM: {msg} ({pct}%)")
-
-        bqm = build_timetable_bqm(lectures, preferences, progress_callback=bqm_progress)
 
-        # 3. Submit to Sampler (Simulated or D-Wave)
-        TOTAL_READS = preferences.get("total_reads", 100)
-        if TOTAL_READS <= 0:
-            TOTAL_READS = 100
+        def progress(summary):
+            update_task_status(task_id, "PROCESSING", summary=summary)
 
-        use_quantum = preferences.get("use_quantum_annealing", False)
-        dwave_token = preferences.get("dwave_token", None)
+        def partial(partial_result):
+            update_task_status(task_id, "PROCESSING", partial_result=partial_result)
+
+        with profiled(task_id, enabled=preferences.get("profile", False)):
+            result = run_optimization(preferences, log_prefix=f"Task {task_id}", progress=progress,
+                                      partial=partial, should_stop=lambda: is_cancel_requested(task_id))
 
-        if use_quantum and dwave_token and DWaveSampler is not None:
-            print(f"Task {task_id}: Solving BQM using D-Wave Quantum Sampler...")
-            update_task_status(task_id, "PROCESSING", summary="Initializing D-Wave Sampler (Connecting to QPU)...")
-            
-            try:
-                # Initialize direct sampler
-                base_sampler = DWaveSampler(token=dwave_token, solver="Advantage_system6.4")
-                print(f"Task {task_id}: D-Wave Sampler initialized. Solver: {base_sampler.solver.id}")
-                
-                update_task_status(task_id, "PROCESSING", summary=f"Connecting to QPU ({base_sampler.solver.id})...")
-                print(f"Task {task_id}: Creating EmbeddingComposite...")
-                sampler = EmbeddingComposite(base_sampler)
-                print(f"Task {task_id}: EmbeddingComposite created.")
-                
-                update_task_status(task_id, "PROCESSING", summary="Mapping problem to QPU topology (Embedding)...")
-                print(f"Task {task_id}: Starting sampling (includes embedding) with 30s timeout...")
-                
-                # The sample call is where the actual embedding and QPU access happens
-                # Wrapping in ThreadPoolExecutor to implement timeout
-                with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
-                    future = executor.submit(sampler.sample, bqm, num_reads=TOTAL_READS)
-                    try:
-                        sampleset = future.result(timeout=30)
-                        print(f"Task {task_id}: Sampling complete. QPU access time: {sampleset.info.get('timing', {}).get('qpu_access_time', 'N/A')} us")
-                        update_task_status(task_id, "PROCESSING", summary="Retrieving results from QPU...")
-                    except concurrent.futures.TimeoutError:
-                        print(f"Task {task_id} Error: D-Wave Optimization timed out after 30 seconds.")
-                        update_task_status(task_id, "PROCESSING", summary="D-Wave timeout (30s). Falling back to Simulated Annealing...")
-                        use_quantum = False
-            except Exception as dw_e:
-                import traceback
-                traceback.print_exc()
-                print(f"Task {task_id} D-Wave Error: {str(dw_e)}")
-                # Fallback to Simulated Annealing if D-Wave fails
-                update_task_status(task_id, "PROCESSING", summary=f"D-Wave failed ({str(dw_e)[:50]}...). Falling back to Simulated Annealing...")
-                use_quantum = False 
-        
-        if not use_quantum or dwave_token is None or DWaveSampler is None:
-            # Re-check use_quantum in case of fallback
-            print(f"Task {task_id}: Solving BQM using C++ Neal Sampler (Batched)...")
-            
-            if neal:
-                sampler = neal.SimulatedAnnealingSampler()
-            else:
-                sampler = dimod.SimulatedAnnealingSampler()
-                
-            BATCH_SIZE = preferences.get("batch_size", 100)
-            if BATCH_SIZE <= 0:
-                BATCH_SIZE = 100
-            
-            num_batches = max(1, TOTAL_READS // BATCH_SIZE)
-            
-            all_samplesets = []
-            for b in range(num_batches):
-                progress_pct = int(((b + 1) / num_batches) * 100)
-                update_task_status(task_id, "PROCESSING", summary=f"Simulated Annealing in progress... ({progress_pct}%)")
-                
-                # Perform batch sampling
-                batch_sampleset = sampler.sample(bqm, num_reads=BATCH_SIZE)
-                all_samplesets.append(batch_sampleset)
-                
-            # Concatenate all results
-            sampleset = dimod.concatenate(all_samplesets)
-
-        # 4. Parse Top 5 Unique Results
-        # sampleset is ordered from lowest energy to highest
-        top_schedules = []
-        seen_combinations = set()
-        
-        for sample, energy in sampleset.data(['sample', 'energy']):
-            if len(top_schedules) >= 5:
-                break
-                
-            current_schedule = []
-            current_ids = []
-            
-            # Exclude auxiliary variables such as y_d (free_월, free_화...)
-            for var_name, is_selected in sample.items():
-                if is_selected == 1 and not str(var_name).startswith("free_"):
-                    lec = get_lecture_by_id(var_name)
-                    if lec:
-                        lec_dict = lec.copy()
-                        lec_dict['parsed_time'] = parse_time_to_range(lec['time_room'])
-                        current_schedule.append(lec_dict)
-                        current_ids.append(lec['id'])
-            
-            # Create a unique signature for this schedule combination
-            combo_sig = frozenset(current_ids)
-            if combo_sig not in seen_combinations and len(current_schedule) > 0:
-                seen_combinations.add(combo_sig)
-                
-                # Basic Check: Calculate total credits for logging
-                total_credits_found = sum(lec['credit'] for lec in current_schedule)
-                
-                # Manual Breakdown Energy calculation
-                breakdown = {
-                    "credit_penalty": 0.0,
-                    "1st_period_penalty": 0.0,
-                    "lunch_overlap_penalty": 0.0,
-                    "free_day_reward": 0.0,
-                    "overlap_penalty": 0.0,
-                    "contiguous_reward": 0.0,
-                    "tension_penalty": 0.0,
-                    "mandatory_reward": 0.0,
-                    "credit/time_mismatch_penalty": 0.0,
-                }
-                
-                # Recalculate based on preferences weights
-                T_CREDIT = preferences.get("target_credits", 21.0)
-                W_CREDIT = preferences.get("w_target_credit", 100.0)
-                W_FIRST = preferences.get("w_first_class", 50.0)
-                W_LUNCH = preferences.get("w_lunch_overlap", 30.0)
-                R_FREE = preferences.get("r_free_day", 100.0)
-                P_FREE_BREAK = preferences.get("p_free_day_break", 500.0)
-                W_OVERLAP = preferences.get("w_hard_overlap", 10000.0)
-                W_CONTIG = preferences.get("w_contiguous_reward", -20.0)
-                W_TENSION = preferences.get("w_tension_base", 5.0)
-                W_MAN = preferences.get("w_mandatory", -10000.0)
-                W_TIME_CREDIT = preferences.get("w_time_credit_ratio", 50.0)
-                
-                breakdown["credit_penalty"] = round(W_CREDIT * (total_credits_found - T_CREDIT)**2, 2)
-                
-                days_with_classes = set()
-                for lec in current_schedule:
-                    if lec["id"] in selected_ids:
-                        breakdown["mandatory_reward"] += W_MAN
-                    
-                    total_duration_minutes = 0
-                    for pt in lec.get('parsed_time', []):
-                        days_with_classes.add(pt['day'])
-                        total_duration_minutes += (pt['end'] - pt['start'])
-                        if pt['start'] <= 570:
-                            breakdown["1st_period_penalty"] += W_FIRST
-                        if max(pt['start'], 720) < min(pt['end'], 780):
-                            breakdown["lunch_overlap_penalty"] += W_LUNCH
-                            
-                    duration_hours = total_duration_minutes / 60.0
-                    if duration_hours > lec['credit']:
-                        breakdown["credit/time_mismatch_penalty"] += round(W_TIME_CREDIT * (duration_hours - lec['credit']), 2)
-                            
-                # Free day logical reward
-                for d in ['월', '화', '수', '목', '금', '토', '일']:
-                    if f"free_{d}" in sample and sample[f"free_{d}"] == 1:
-                        breakdown["free_day_reward"] += -R_FREE
-                        if d in days_with_classes:
-                            breakdown["free_day_reward"] += P_FREE_BREAK
-
-                # Pairwise penalties
-                for i in range(len(current_schedule)):
-                    for j in range(i+1, len(current_schedule)):
-                        lec_i = current_schedule[i]
-                        lec_j = current_schedule[j]
-                        
-                        for pt_i in lec_i.get('parsed_time', []):
-                            for pt_j in lec_j.get('parsed_time', []):
-                                if pt_i['day'] == pt_j['day']: # Same day only
-                                    from ..utils.time_utils import check_overlap, calculate_time_gap
-                                    if check_overlap([pt_i], [pt_j]):
-                                        breakdown["overlap_penalty"] += W_OVERLAP
-                                    else:
-                                        gap = calculate_time_gap([pt_i], [pt_j])
-                                        if 0 < gap <= 60:
-                                            breakdown["contiguous_reward"] += W_CONTIG
-                                        elif 60 < gap <= 180:
-                                            breakdown["tension_penalty"] += round(W_TENSION * math.sqrt(gap), 2)
-                
-                if "overlap_penalty" in breakdown:
-                    del breakdown["overlap_penalty"]
-
-                true_energy = sum(breakdown.values())
-
-                top_schedules.append({
-                    "schedule": current_schedule,
-                    "energy": true_energy,
-                    "total_credits": total_credits_found,
-                    "breakdown": breakdown,
-                    "raw_bqm_energy": energy
-                })
-
-        if not top_schedules:
-            raise ValueError("No valid schedules could be generated.")
-            
-        best_result = top_schedules[0]
-        print(f"Task {task_id}: Optimization complete. Found {len(top_schedules)} unique schedules. Best Energy: {best_result['energy']}")
-        
         # Update status with Top 5
-        update_task_status(task_id, "SUCCESS", result={
-            "schedule": best_result["schedule"], # Keep for backward compatibility
-            "energy": best_result["energy"],
-            "total_credits": best_result["total_credits"],
-            "breakdown": best_result["breakdown"],
-            "top_schedules": top_schedules
-        })
+        update_task_status(task_id, "SUCCESS", result=result)
+        observe_timings(result["timings"])
 
     except Exception as e:
         print(f"Task {task_id} Failed: {str(e)}")
         update_task_status(task_id, "FAILURE", error=str(e))
-
+        observe_timings({"total_ms": (time.perf_counter() - start) * 1000}, status="FAILURE")
@@ -0,0 +1,64 @@
+"""
+Streaming reduction of sampler output to the best unique samples.
+
+Batched samplers used to keep every batch and concatenate them at the end, so memory grew with
+total_reads x num_variables although only a handful of unique schedules are ever decoded.
+TopKSamples folds each batch in as soon as it arrives and keeps only the `k` lowest-energy samples
+with distinct bit patterns (deduplicated on np.packbits signatures), so any read count runs in
+O((k + batch_size) x num_variables) memory and the best-so-far set can be read between batches.
+"""
+import dimod
+import numpy as np
+from .bqm_builder import sample_matrix
+
+# Unique samples kept per optimization: far more than the decoded top schedules, so that
+# samples repairing to the same schedule cannot crowd the distinct ones out
+DEFAULT_KEEP_SAMPLES = 100
+
+class TopKSamples:
+    """The `k` lowest-energy distinct samples seen so far over variables 0..num_variables-1."""
+
+    def __init__(self, k, num_variables):
+        self.k = k
+        self.num_variables = num_variables
+        self.samples = np.empty((0, num_variables), dtype=np.int8)
+        self.energies = np.empty(0, dtype=np.float64)
+        self.num_seen = 0
+
+    def __len__(self):
+        return len(self.energies)
+
+    @property
+    def best_energy(self):
+        return float(self.energies[0]) if len(self.energies) else None
+
+    def add(self, sampleset):
+        """Folds a (BINARY) sampleset in; its samples are not referenced afterwards."""
+        samples, energies = sample_matrix(sampleset, self.num_variables)
+        self.add_samples(samples, energies)
+
+    def add_samples(self, samples, energies):
+        self.num_seen += len(energies)
+        if len(self.energies) == self.k:
+            # Full: only samples at least as good as the current k-th can enter
+            better = energies <= self.energies[-1]
+            samples, energies = samples[better], energies[better]
+        if not len(energies):
+            return
+
+        samples = np.concatenate([self.samples, np.asarray(samples, dtype=np.int8)])
+        energies = np.concatenate([self.energies, np.asarray(energies, dtype=np.float64)])
+        # Stable: on equal energies the samples kept earlier stay first
+        order = np.argsort(energies, kind="stable")
+        samples, energies = samples[order], energies[order]
+
+        packed = np.ascontiguousarray(np.packbits(samples, axis=1))
+        signatures = packed.view(np.dtype((np.void, packed.shape[1]))).ravel()
+        _, first = np.unique(signatures, return_index=True)
+        keep = np.sort(first)[:self.k]
+        self.samples, self.energies = samples[keep], energies[keep]
+
+    def sampleset(self):
+        """The kept samples as a SampleSet, lowest energy first."""
+        return dimod.SampleSet.from_samples((self.samples, range(self.num_variables)), dimod.BINARY,
+                                            energy=self.energies)
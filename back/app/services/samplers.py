@@ -0,0 +1,189 @@
+"""
+Registry of the structured (QPU-like) samplers behind the quantum annealing path.
+
+A sampler factory takes the request preferences and returns a dimod structured sampler
+(nodelist / edgelist / sample). sample_embedded embeds the BQM (through the on-disk
+embedding cache, see embedding_cache.py) and samples it behind a FixedEmbeddingComposite in a
+separate process, so a request that hits its timeout (minorminer does not stop promptly on
+large problems) is killed instead of leaving a busy thread behind. Factories must therefore be
+module-level functions of an importable module. Built-in entries:
+- "dwave": the real QPU through the Leap cloud (needs dwave_token and network access)
+- "mock_qpu": MockQPUSampler, a local stand-in with the Pegasus topology, configurable
+  latency and failure rate, for testing the embedding / timeout / fallback path offline
+"""
+import multiprocessing
+import threading
+import random
+import time
+from types import SimpleNamespace
+
+import dimod
+from . import embedding_cache
+
+try:
+    import neal
+except ImportError:
+    neal = None
+
+DEFAULT_DWAVE_SOLVER = "Advantage_system6.4"
+
+_SAMPLER_FACTORIES = {}
+
+def register_sampler(name, factory):
+    """Registers factory(preferences) -> structured sampler under `name`."""
+    _SAMPLER_FACTORIES[name] = factory
+
+def available_samplers():
+    return sorted(_SAMPLER_FACTORIES)
+
+def _get_factory(name):
+    factory = _SAMPLER_FACTORIES.get(name)
+    if factory is None:
+        raise ValueError(f"Unknown sampler '{name}'. Available: {', '.join(available_samplers())}")
+    return factory
+
+def create_sampler(name, preferences):
+    """Instantiates the sampler registered as `name`. Raises ValueError for unknown names."""
+    return _get_factory(name)(preferences)
+
+def sampler_label(sampler):
+    """Human readable solver name of a structured sampler (DWaveSampler.solver.id or the class name)."""
+    solver = getattr(sampler, "solver", None)
+    return getattr(solver, "id", None) or type(sampler).__name__
+
+def _embed_and_sample(factory, preferences, bqm, sample_kwargs, embedding_parameters, use_cache):
+    """Worker process body of sample_embedded. Returns (sampleset, solver label, embedding stats)."""
+    from dwave.system import FixedEmbeddingComposite
+
+    base_sampler = factory(preferences)
+    # Every logical variable / interaction needs its own qubit / coupler: fail fast when even that cannot fit
+    if bqm.num_variables > len(base_sampler.nodelist) or bqm.num_interactions > len(base_sampler.edgelist):
+        raise ValueError(f"BQM ({bqm.num_variables} variables, {bqm.num_interactions} interactions) "
+                         f"cannot be embedded into {sampler_label(base_sampler)}.")
+
+    embedding, cache_hit, embedding_seconds = embedding_cache.find_embedding(
+        bqm, base_sampler, use_cache=use_cache, **embedding_parameters)
+    sampler = FixedEmbeddingComposite(base_sampler, embedding=embedding)
+    sampleset = sampler.sample(bqm, return_embedding=True, **sample_kwargs)
+    sampleset.resolve()
+
+    # EmbeddedStructure does not survive pickling back to the parent; keep the plain chains
+    context = sampleset.info.get("embedding_context")
+    if context:
+        context["embedding"] = {v: tuple(chain) for v, chain in context["embedding"].items()}
+    stats = {"cache_hit": cache_hit, "embedding_seconds": embedding_seconds}
+    return sampleset, sampler_label(base_sampler), stats
+
+def sample_embedded(name, preferences, bqm, timeout, use_cache=True, **sample_kwargs):
+    """
+    Embeds and samples `bqm` on the sampler registered as `name` in a worker process.
+    Returns (sampleset, solver label, {"cache_hit", "embedding_seconds"}) and records the lookup in
+    the embedding cache stats. Raises multiprocessing.TimeoutError after `timeout` seconds,
+    in which case the worker (embedding or QPU call included) has been terminated.
+    """
+    factory = _get_factory(name)
+    embedding_parameters = {"timeout": timeout}
+
+    # spawn (not fork): the server process runs threads
+    pool = multiprocessing.get_context("spawn").Pool(1)
+    try:
+        result = pool.apply_async(_embed_and_sample,
+                                  (factory, preferences, bqm, sample_kwargs, embedding_parameters, use_cache))
+        sampleset, label, stats = result.get(timeout)
+    finally:
+        pool.terminate()
+        pool.join()
+
+    embedding_cache.record_lookup(stats["cache_hit"], stats["embedding_seconds"])
+    return sampleset, label, stats
+
+# -----------------------------------------------------------------------------
+# D-Wave QPU
+# -----------------------------------------------------------------------------
+
+def _create_dwave_sampler(preferences):
+    from dwave.system import DWaveSampler
+    return DWaveSampler(token=preferences.get("dwave_token"),
+                        solver=preferences.get("dwave_solver") or DEFAULT_DWAVE_SOLVER)
+
+# -----------------------------------------------------------------------------
+# Local stand-in QPU
+# -----------------------------------------------------------------------------
+
+class MockQPUError(RuntimeError):
+    """Simulated solver failure of MockQPUSampler."""
+
+_pegasus_cache = {}
+_pegasus_lock = threading.Lock()
+
+def _pegasus_structure(shape):
+    """(nodelist, edgelist) of the Pegasus graph P(shape), built once per shape."""
+    with _pegasus_lock:
+        if shape not in _pegasus_cache:
+            import dwave.graphs
+            graph = dwave.graphs.pegasus_graph(shape)
+            _pegasus_cache[shape] = (sorted(graph.nodes), sorted(tuple(sorted(edge)) for edge in graph.edges))
+        return _pegasus_cache[shape]
+
+class MockQPUSampler(dimod.Sampler, dimod.Structured):
+    """
+    Offline stand-in for a D-Wave Advantage QPU.
+    - Only accepts BQMs that fit the Pegasus P(shape) qubit graph (P16 = Advantage), so problems
+      must go through an embedding composite exactly like on the real QPU.
+    - Each sample() waits `latency` seconds (the QPU access + network round trip) and then fails
+      with probability `failure_rate`, otherwise anneals with a short Simulated Annealing schedule.
+    """
+
+    def __init__(self, shape=16, latency=0.5, failure_rate=0.0, num_sweeps=100, seed=None):
+        self.shape = shape
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.num_sweeps = num_sweeps
+        self._nodelist, self._edgelist = _pegasus_structure(shape)
+        self._rng = random.Random(seed)
+        self.solver = SimpleNamespace(id=f"mock_pegasus_p{shape}")
+
+    @property
+    def nodelist(self):
+        return self._nodelist
+
+    @property
+    def edgelist(self):
+        return self._edgelist
+
+    @property
+    def properties(self):
+        return {
+            "topology": {"type": "pegasus", "shape": [self.shape]},
+            "num_qubits": len(self._nodelist),
+            "latency": self.latency,
+            "failure_rate": self.failure_rate,
+        }
+
+    @property
+    def parameters(self):
+        return {"num_reads": [], "seed": []}
+
+    @dimod.bqm_structured
+    def sample(self, bqm, num_reads=100, seed=None, **kwargs):
+        start = time.perf_counter()
+        time.sleep(self.latency)
+        if self._rng.random() < self.failure_rate:
+            raise MockQPUError("Mock QPU: simulated solver failure.")
+
+        if neal:
+            sampler = neal.SimulatedAnnealingSampler()
+            sampleset = sampler.sample(bqm, num_reads=num_reads, num_sweeps=self.num_sweeps, seed=seed)
+        else:
+            sampleset = dimod.RandomSampler().sample(bqm, num_reads=num_reads)
+
+        sampleset.info["timing"] = {"qpu_access_time": int((time.perf_counter() - start) * 1e6)}
+        return sampleset
+
+def _create_mock_qpu_sampler(preferences):
+    return MockQPUSampler(shape=preferences.get("mock_qpu_shape", 16),
+                          latency=preferences.get("mock_qpu_latency", 0.5),
+                          failure_rate=preferences.get("mock_qpu_failure_rate", 0.0))
+
+register_sampler("dwave", _create_dwave_sampler)
+register_sampler("mock_qpu", _create_mock_qpu_sampler)
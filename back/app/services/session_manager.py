@@ -0,0 +1,259 @@
+"""
+Interactive optimization sessions: keep the candidate pool and the built BQM between requests.
+
+The UI loop (add a mandatory lecture, reoptimize; remove one, reoptimize) used to rebuild the
+whole model over a fresh random pool on every step. A session builds it once and then applies
+delta operations that patch only the affected terms:
+- mark_mandatory / unmark_mandatory: the lecture's linear bias (+-w_mandatory); lectures
+  outside the pool are added first
+- exclude / include: a w_hard_overlap penalty on the lecture's linear bias
+- add_candidate: a new variable with its linear bias, credit cross terms, same-day pairs,
+  free-day links and same-course section terms (the free-day / auxiliary variables move up by
+  one label). Sessions with a non-dense credit encoding rebuild the model instead. Course groups
+  are fixed when the session is created (all their members are already in the pool).
+After the patch the model is re-solved with a short Simulated Annealing run warm-started from
+the previous samples (with the operations applied to them), skipping the hottest half of the
+annealing schedule.
+
+Sessions live in memory (like the task store) and expire after SESSION_TTL seconds without use.
+"""
+import threading
+import time
+import uuid
+
+import numpy as np
+from ..core.loader import get_catalog
+from .bqm_builder import (DAYS, build_timetable_bqm, collect_pair_structure,
+                          credit_increment_terms, day_pair_weights, free_day_variable,
+                          lecture_linear_biases, lecture_pair_structure, num_bqm_variables, sample_matrix)
+from .metrics import collect_timings, stage
+from .quantum_optimizer import build_result, expand_course_groups, sample_bqm, select_candidate_pool
+
+import dimod
+try:
+    import neal
+except ImportError:
+    neal = None
+
+SESSION_TTL = 1800
+MAX_SESSIONS = 500
+SESSION_OPS = ("mark_mandatory", "unmark_mandatory", "exclude", "include", "add_candidate")
+# Warm-started re-solve after a delta
+WARM_START_READS = 20
+WARM_START_SWEEPS = 200
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def warm_start_sample(bqm, states, num_sweeps=WARM_START_SWEEPS):
+    """
+    Short Simulated Annealing run from `states` (one read per row, columns = variables 0..n-1) that
+    skips the hottest half of the default annealing schedule, so good parts of the states survive.
+    """
+    if neal is None:
+        return dimod.SimulatedAnnealingSampler().sample(bqm, num_reads=len(states))
+    from dwave.samplers.sa.sampler import default_beta_range
+
+    hot_beta, cold_beta = default_beta_range(bqm)
+    return neal.SimulatedAnnealingSampler().sample(
+        bqm, initial_states=(states, range(bqm.num_variables)),
+        num_reads=len(states), num_sweeps=num_sweeps,
+        beta_range=(np.sqrt(hot_beta * cold_beta), cold_beta))
+
+class OptimizationSession:
+    """Candidate pool, built BQM and last samples of one interactive user."""
+
+    def __init__(self, preferences, catalog, lectures, pair_structure, bqm):
+        self.lock = threading.Lock()
+        self.preferences = preferences
+        self.catalog = catalog
+        self.lectures = lectures
+        self.index = {lec["id"]: i for i, lec in enumerate(lectures)}
+        self.pair_structure = pair_structure
+        self.bqm = bqm
+        self.excluded = set()
+        self.states = None
+        self.last_used = time.time()
+
+    @property
+    def mandatory(self):
+        return self.preferences["selected_lecture_ids"]
+
+    def solve(self, sampleset=None):
+        """Decodes `sampleset` (default: a warm-started re-solve) and keeps its best samples for the next warm start."""
+        with stage("sampling"):
+            if sampleset is None:
+                sampleset = self._warm_start_sample()
+        with stage("decoding"):
+            result = build_result(sampleset, self.bqm, self.lectures, self.preferences, self.catalog,
+                                  log_prefix="Session")
+        samples, energies = sample_matrix(sampleset, self.bqm.num_variables)
+        self.states = samples[np.argsort(energies, kind="stable")[:WARM_START_READS]].copy()
+        return result
+
+    def _warm_start_sample(self):
+        states = self.states
+        for lec_id in self.mandatory:
+            states[:, self.index[lec_id]] = 1
+        for lec_id in self.excluded:
+            states[:, self.index[lec_id]] = 0
+        return warm_start_sample(self.bqm, states)
+
+    # -------------------------------------------------------------------------
+    # Delta operations
+    # -------------------------------------------------------------------------
+
+    def apply(self, op, lecture_id):
+        """Applies one (validated) delta operation to the model."""
+        if lecture_id not in self.index:
+            if op in ("unmark_mandatory", "exclude", "include"):
+                return
+            self._add_candidate(lecture_id)
+
+        i = self.index[lecture_id]
+        if op == "mark_mandatory" and lecture_id not in self.mandatory:
+            if lecture_id in self.excluded:
+                self._set_excluded(lecture_id, False)
+            self.bqm.add_linear(i, self.preferences.get("w_mandatory", -10000.0))
+            self.mandatory.append(lecture_id)
+        elif op == "unmark_mandatory" and lecture_id in self.mandatory:
+            self.bqm.add_linear(i, -self.preferences.get("w_mandatory", -10000.0))
+            self.mandatory.remove(lecture_id)
+        elif op == "exclude" and lecture_id not in self.excluded:
+            if lecture_id in self.mandatory:
+                self.apply("unmark_mandatory", lecture_id)
+            self._set_excluded(lecture_id, True)
+        elif op == "include" and lecture_id in self.excluded:
+            self._set_excluded(lecture_id, False)
+
+    def _set_excluded(self, lecture_id, excluded):
+        penalty = self.preferences.get("w_hard_overlap", 10000.0)
+        self.bqm.add_linear(self.index[lecture_id], penalty if excluded else -penalty)
+        (self.excluded.add if excluded else self.excluded.discard)(lecture_id)
+
+    def _add_candidate(self, lecture_id):
+        lec = self.catalog.get_lecture(lecture_id).copy()
+        lec["parsed_time"] = self.catalog.get_parsed_time(lecture_id)
+        k = len(self.lectures)
+        self.lectures.append(lec)
+        self.index[lecture_id] = k
+
+        # Free-day / auxiliary variables follow the lectures: make room for label k
+        bqm = self.bqm
+        bqm.relabel_variables({v: v + 1 for v in range(k, bqm.num_variables)}, inplace=True)
+        bqm.add_variable(k, lecture_linear_biases([lec], dict(self.preferences, mandatory_ids=[]))[0])
+
+        credits = np.array([lecture["credit"] for lecture in self.lectures], dtype=np.float64)
+        linear_vars, linear_biases, rows, cols, biases = credit_increment_terms(
+            credits, k, self.preferences.get("target_credits", 21.0), self.preferences.get("w_target_credit", 100.0))
+        bqm.add_linear_from(zip(linear_vars.tolist(), linear_biases.tolist()))
+        bqm.add_quadratic_from(zip(rows.tolist(), cols.tolist(), biases.tolist()))
+
+        structure = lecture_pair_structure(self.lectures, k, self.catalog.building_distance)
+        for day_idx, d in enumerate(DAYS):
+            pair_i, pair_j, kinds, gaps, distances = structure["pairs"][d]
+            weights = day_pair_weights(kinds, gaps, distances, self.preferences)
+            keep = weights != 0
+            bqm.add_quadratic_from(zip(pair_i[keep].tolist(), pair_j[keep].tolist(), weights[keep].tolist()))
+            if d in structure["days"]:
+                y_d = free_day_variable(k + 1, day_idx)
+                if not len(self.pair_structure["members"][d]):
+                    # First lecture of the pool on this day: the free-day reward becomes reachable
+                    bqm.add_linear(y_d, -self.preferences.get("r_free_day", 100.0))
+                bqm.add_quadratic(k, y_d, self.preferences.get("p_free_day_break", 500.0))
+                self.pair_structure["members"][d] = np.append(self.pair_structure["members"][d], k)
+
+        # At most one section per course
+        w_same_course = self.preferences.get("w_same_course", 10000.0)
+        if w_same_course:
+            for j, other in enumerate(self.lectures[:k]):
+                if other.get("number") and other.get("number") == lec.get("number"):
+                    bqm.add_quadratic(j, k, w_same_course)
+
+        if self.states is not None:
+            self.states = np.insert(self.states, k, 0, axis=1)
+
+# -----------------------------------------------------------------------------
+# Store
+# -----------------------------------------------------------------------------
+
+def _expire_sessions(now):
+    for session_id, session in list(_sessions.items()):
+        if now - session.last_used > SESSION_TTL:
+            del _sessions[session_id]
+    while len(_sessions) >= MAX_SESSIONS:
+        oldest = min(_sessions, key=lambda sid: _sessions[sid].last_used)
+        del _sessions[oldest]
+
+def create_session(preferences):
+    """Builds the pool and model of a new session and solves it in full. Returns (session_id, result)."""
+    selected_ids = list(preferences.get("selected_lecture_ids", []))
+    if not selected_ids:
+        raise ValueError("No lectures provided for optimization.")
+    preferences = dict(preferences, selected_lecture_ids=selected_ids, mandatory_ids=selected_ids)
+
+    with collect_timings() as timer:
+        catalog = get_catalog(preferences.get("catalog_id"))
+        with stage("candidate_selection"):
+            group_ids = expand_course_groups(catalog, preferences.get("course_groups"))
+            lectures = select_candidate_pool(catalog, selected_ids, preferences.get("max_candidates", 300),
+                                             required_ids=group_ids, seed=preferences.get("pool_seed"))
+        if not lectures:
+            raise ValueError("None of the selected lectures were found in the database.")
+        with stage("pair_structure"):
+            pair_structure = collect_pair_structure(lectures, catalog.building_distance)
+        with stage("bqm_build"):
+            bqm = build_timetable_bqm(lectures, preferences, pair_structure=pair_structure)
+
+        session = OptimizationSession(preferences, catalog, lectures, pair_structure, bqm)
+        with stage("sampling"):
+            sampleset = sample_bqm(bqm, preferences, log_prefix="Session")
+        result = session.solve(sampleset)
+    result["timings"] = timer.as_dict()
+
+    session_id = str(uuid.uuid4())
+    with _sessions_lock:
+        _expire_sessions(time.time())
+        _sessions[session_id] = session
+    return session_id, result
+
+def get_session(session_id):
+    """Returns the session or raises KeyError."""
+    with _sessions_lock:
+        session = _sessions[session_id]
+        session.last_used = time.time()
+        return session
+
+def apply_session_ops(session_id, ops):
+    """
+    Applies [{"op", "lecture_id"}, ...] to the session's model in order and re-solves it (warm start).
+    Raises KeyError for an unknown session and ValueError for an invalid operation.
+    """
+    session = get_session(session_id)
+    with session.lock:
+        with collect_timings() as timer:
+            # Validate everything before the model is touched
+            mandatory = set(session.mandatory)
+            for item in ops:
+                if item["op"] not in SESSION_OPS:
+                    raise ValueError(f"Unknown session operation '{item['op']}'. Available: {', '.join(SESSION_OPS)}")
+                if item["lecture_id"] not in session.index and session.catalog.get_lecture(item["lecture_id"]) is None:
+                    raise ValueError(f"Unknown lecture '{item['lecture_id']}'.")
+                if item["op"] == "mark_mandatory":
+                    mandatory.add(item["lecture_id"])
+                elif item["op"] in ("unmark_mandatory", "exclude"):
+                    mandatory.discard(item["lecture_id"])
+            if not mandatory:
+                raise ValueError("A session needs at least one mandatory lecture.")
+            with stage("patch"):
+                for item in ops:
+                    session.apply(item["op"], item["lecture_id"])
+            result = session.solve()
+        result["timings"] = timer.as_dict()
+    result["selected_lecture_ids"] = list(session.mandatory)
+    result["excluded_lecture_ids"] = sorted(session.excluded)
+    return result
+
+def delete_session(session_id):
+    with _sessions_lock:
+        return _sessions.pop(session_id, None) is not None
@@ -1,33 +1,74 @@
+import copy
+import threading
 import uuid
 from typing import Dict, Any
 
-# In-memory global task state storage
-global_tasks_store: Dict[str, Any] = {}
+# In-memory global task state storage: task_id -> the task's current snapshot.
+# Snapshots are never mutated once stored: every update builds a new dict under _store_lock
+# and swaps it in with a single assignment, so readers (request threads) always see a
+# consistent task (e.g. never status=SUCCESS without its result) without taking the lock.
+global_tasks_store: Dict[str, Dict[str, Any]] = {}
+_store_lock = threading.Lock()
+
+TERMINAL_STATUSES = ("SUCCESS", "FAILURE")
 
 def create_optimization_task(user_preferences: dict) -> str:
     """Creates a new task ID and intializes it in the store."""
     task_id = str(uuid.uuid4())
-    global_tasks_store[task_id] = {
+    snapshot = {
         "status": "PENDING",
         "summary": "Initializing...",
-        "preferences": user_preferences,
+        # A copy: the caller keeps (and the optimizer may fill in) its own dict
+        "preferences": copy.deepcopy(user_preferences),
         "result": None,
-        "error": None
+        # Best schedules found so far, published while the task is still running
+        "partial_result": None,
+        "cancel_requested": False,
+        "error": None,
+        # Incremented by every update (ETag / since_version of the status endpoint)
+        "version": 1,
     }
+    with _store_lock:
+        global_tasks_store[task_id] = snapshot
     return task_id
 
-def update_task_status(task_id: str, status: str, summary: str = None, result: Any = None, error: str = None):
-    """Updates the status and optional result of a task."""
-    if task_id in global_tasks_store:
-        global_tasks_store[task_id]["status"] = status
-        if summary is not None:
-             global_tasks_store[task_id]["summary"] = summary
-        if result is not None:
-            global_tasks_store[task_id]["result"] = result
-        if error is not None:
-            global_tasks_store[task_id]["error"] = error
+def _replace(task_id: str, **changes) -> Dict[str, Any]:
+    """Swaps in a copy of the task's snapshot with `changes` and the next version. Returns it (None if unknown)."""
+    with _store_lock:
+        current = global_tasks_store.get(task_id)
+        if current is None:
+            return None
+        snapshot = dict(current, **changes, version=current["version"] + 1)
+        global_tasks_store[task_id] = snapshot
+        return snapshot
+
+def update_task_status(task_id: str, status: str, summary: str = None, result: Any = None, error: str = None,
+                       partial_result: Any = None):
+    """Updates the status and optional result (or best-so-far partial result) of a task."""
+    changes = {"status": status}
+    if summary is not None:
+        changes["summary"] = summary
+    if result is not None:
+        changes["result"] = result
+    if partial_result is not None:
+        changes["partial_result"] = partial_result
+    if error is not None:
+        changes["error"] = error
+    if _replace(task_id, **changes) is not None and partial_result is None:
         print(f"STORE_UPDATE: Task {task_id} -> {status} ({summary or ''})")
 
+def request_cancel(task_id: str) -> bool:
+    """Asks a running task to stop at its next checkpoint. Returns False if the task is unknown or already finished."""
+    with _store_lock:
+        current = global_tasks_store.get(task_id)
+        if current is None or current["status"] in TERMINAL_STATUSES:
+            return False
+        global_tasks_store[task_id] = dict(current, cancel_requested=True, version=current["version"] + 1)
+        return True
+
+def is_cancel_requested(task_id: str) -> bool:
+    return global_tasks_store.get(task_id, {}).get("cancel_requested", False)
+
 def get_task_status(task_id: str) -> dict:
-    """Retrieves the full task information."""
+    """Retrieves the task's current snapshot (read-only: callers must not modify it)."""
     return global_tasks_store.get(task_id, {"status": "NOT_FOUND"})
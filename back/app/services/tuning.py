@@ -0,0 +1,84 @@
+"""
+Tuned defaults for the penalty weights and the Simulated Annealing schedule.
+
+The hand-picked hard penalties (10000 for overlaps, -10000 per mandatory lecture, ...) dwarf the
+soft terms (tens to hundreds), and neal derives its default beta range from the largest energy
+changes, so most sweeps are spent too hot or too cold for the soft part of the landscape.
+benchmarks/autotune.py searches a penalty scale and the annealing schedule offline and writes
+the winner as a profile:
+
+    {"defaults": {"w_hard_overlap": ..., "num_sweeps": ..., "beta_range_scale": [hot, cold], ...},
+     "tuned_at": ..., "tts_ms": {"default": ..., "tuned": ...}, ...}
+
+The API reads it once at import (data/tuned_profile.json, or TUNED_PROFILE_PATH) and uses its
+values as the defaults of OptimizationRequest; explicit request fields still win.
+"""
+import json
+import os
+import pathlib
+from ..core.snapshot import DATA_DIR
+
+try:
+    import neal
+except ImportError:
+    neal = None
+
+DEFAULT_PROFILE_PATH = DATA_DIR / "tuned_profile.json"
+
+# The hard constraints, scaled together by the tuner's penalty scale
+BASE_PENALTIES = {
+    "w_hard_overlap": 10000.0,
+    "w_mandatory": -10000.0,
+    "w_same_course": 10000.0,
+    "w_course_group": 10000.0,
+}
+# Fields a profile may set: the penalties and the annealing schedule of sample_bqm
+TUNABLE_FIELDS = tuple(BASE_PENALTIES) + ("num_sweeps", "beta_range_scale", "beta_schedule_type")
+
+def profile_path():
+    return pathlib.Path(os.environ.get("TUNED_PROFILE_PATH") or DEFAULT_PROFILE_PATH)
+
+def scaled_penalties(scale):
+    return {key: value * scale for key, value in BASE_PENALTIES.items()}
+
+def load_tuned_defaults():
+    """The tunable request defaults of the profile ({} without a readable profile)."""
+    path = profile_path()
+    try:
+        with open(path, encoding="utf-8") as f:
+            profile = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    defaults = {key: value for key, value in profile.get("defaults", {}).items() if key in TUNABLE_FIELDS}
+    print(f"Using tuned defaults from {path}: {defaults}")
+    return defaults
+
+def annealing_parameters(bqm, preferences):
+    """
+    neal keyword arguments of the request's annealing schedule: num_sweeps,
+    beta_schedule_type and beta_range_scale, multipliers of neal's default [hot, cold] beta range.
+    Empty when the request keeps neal's defaults.
+    """
+    params = {}
+    if preferences.get("num_sweeps"):
+        params["num_sweeps"] = int(preferences["num_sweeps"])
+    if not neal:
+        return params
+    if preferences.get("beta_schedule_type"):
+        params["beta_schedule_type"] = preferences["beta_schedule_type"]
+    if preferences.get("beta_range_scale"):
+        hot, cold = neal.default_beta_range(bqm)
+        hot_scale, cold_scale = preferences["beta_range_scale"]
+        params["beta_range"] = [hot * hot_scale, max(cold * cold_scale, hot * hot_scale)]
+    return params
+
+def write_profile(defaults, **info):
+    """Writes a profile atomically (temp file + rename) and returns its path."""
+    path = profile_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.tmp-{os.getpid()}")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"defaults": {key: defaults[key] for key in TUNABLE_FIELDS if key in defaults}, **info},
+                  f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    return path
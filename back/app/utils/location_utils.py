@@ -0,0 +1,47 @@
+import re
+import numpy as np
+
+# Campus of a room: main campus (Busan) unless the room code says otherwise
+CAMPUSES = ['부산', '양산', '밀양']
+# Their names in catalog ids (e.g. 'default:yangsan', see core/loader.py)
+CAMPUS_IDS = ['busan', 'yangsan', 'miryang']
+
+# Walking-distance heuristic between buildings (arbitrary units)
+DISTANCE_UNKNOWN = 500.0        # room missing or unparseable
+DISTANCE_OTHER_CAMPUS = 50000.0 # Yangsan / Miryang are separate campuses
+DISTANCE_SAME_ZONE = 100.0      # same hundreds block of building numbers (e.g. 303 / 306)
+DISTANCE_PER_ZONE = 300.0       # per hundreds block between buildings
+
+def parse_building(room):
+    """
+    Parses a room code (e.g. '507-102', '양산Y15-315', '밀양M03-3350') into (campus index, building number).
+    Returns None if the room has no building number.
+    """
+    if not room:
+        return None
+    match = re.search(r'(\d+)-', room)
+    if not match:
+        return None
+    campus = 0
+    for idx, name in enumerate(CAMPUSES[1:], start=1):
+        if name in room:
+            campus = idx
+    return campus, int(match.group(1))
+
+def building_distance_matrix(campus, number):
+    """
+    Dense building-to-building distance table for buildings given as parallel (campus, number) arrays.
+    Row/column 0 is reserved for the unknown building.
+    """
+    campus = np.concatenate([[-1], np.asarray(campus, dtype=np.int64)])
+    number = np.concatenate([[-1], np.asarray(number, dtype=np.int64)])
+
+    zone_diff = np.abs(number[:, None] // 100 - number[None, :] // 100)
+    distance = np.where(zone_diff == 0, DISTANCE_SAME_ZONE, zone_diff * DISTANCE_PER_ZONE)
+    distance = np.where(number[:, None] == number[None, :], 0.0, distance)
+    distance = np.where(campus[:, None] != campus[None, :], DISTANCE_OTHER_CAMPUS, distance)
+
+    unknown = campus < 0
+    distance[unknown, :] = DISTANCE_UNKNOWN
+    distance[:, unknown] = DISTANCE_UNKNOWN
+    return distance.astype(np.float32)
@@ -0,0 +1,62 @@
+import re
+
+# Hangul syllable block (가-힣) decomposition constants
+HANGUL_BASE = 0xAC00
+HANGUL_LAST = 0xD7A3
+JUNGSEONG_COUNT = 21
+JONGSEONG_COUNT = 28
+
+# Compatibility jamo for the 19 initial consonants, in syllable-block order
+CHOSUNG_LIST = [
+    'ㄱ', 'ㄲ', 'ㄴ', 'ㄷ', 'ㄸ', 'ㄹ', 'ㅁ', 'ㅂ', 'ㅃ',
+    'ㅅ', 'ㅆ', 'ㅇ', 'ㅈ', 'ㅉ', 'ㅊ', 'ㅋ', 'ㅌ', 'ㅍ', 'ㅎ'
+]
+CHOSUNG_SET = set(CHOSUNG_LIST)
+
+_WHITESPACE = re.compile(r'\s+')
+
+def normalize_text(text):
+    """
+    Lower-cases and strips all whitespace so that '생활 속의 반도체' matches '생활속의반도체'.
+    """
+    if not text:
+        return ""
+    return _WHITESPACE.sub("", str(text)).lower()
+
+def to_chosung(text):
+    """
+    Replaces every Hangul syllable by its initial consonant jamo (e.g. '반도체' -> 'ㅂㄷㅊ').
+    Non-Hangul characters are kept as they are.
+    """
+    chars = []
+    for ch in text:
+        code = ord(ch)
+        if HANGUL_BASE <= code <= HANGUL_LAST:
+            chars.append(CHOSUNG_LIST[(code - HANGUL_BASE) // (JUNGSEONG_COUNT * JONGSEONG_COUNT)])
+        else:
+            chars.append(ch)
+    return "".join(chars)
+
+def is_chosung_query(text):
+    """
+    True if the (normalized) text consists only of initial consonant jamo, e.g. 'ㅂㄷㅊ'.
+    """
+    return bool(text) and all(ch in CHOSUNG_SET for ch in text)
+
+def char_ngrams(text, n=2):
+    """
+    Returns the set of character unigrams and n-grams of a normalized string.
+    Unigrams are kept so that one-character queries can still use the index.
+    """
+    grams = set(text)
+    for i in range(len(text) - n + 1):
+        grams.add(text[i:i + n])
+    return grams
+
+def query_ngrams(text, n=2):
+    """
+    Returns the minimal set of index keys that every match of `text` must contain.
+    """
+    if len(text) < n:
+        return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
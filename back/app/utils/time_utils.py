@@ -1,25 +1,33 @@
 import re
 
+# Optional room after a meeting; a day letter followed by a time starts the next meeting instead
+_ROOM = r'(?:\s*(?![월화수목금토일]\s*\d{2}:\d{2})([가-힣A-Za-z0-9-]+))?'
+
 def parse_time_to_range(sched_str):
     """
-    Parses complex time strings (e.g. '화 16:30(75)', '수 13:30-16:30') into minute ranges.
+    Parses complex time strings (e.g. '화 16:30(75) 507-102', '수 13:30-16:30') into minute ranges.
+    Each interval also carries the room written after it ('' if none); the day of the next
+    meeting is never taken for a room:
+
+    >>> [(t['day'], t['start'], t['room']) for t in parse_time_to_range('월 09:00(75) 화 09:00(75) 507-102')]
+    [('월', 540, ''), ('화', 540, '507-102')]
     """
     if not sched_str: 
         return []
     intervals = []
     
     # 1. format: 화 16:30(75) 507-102
-    pattern1 = r'([월화수목금토일])\s*(\d{2}):(\d{2})\((\d+)\)'
-    for day, hr, mn, dur in re.findall(pattern1, str(sched_str)):
+    pattern1 = r'([월화수목금토일])\s*(\d{2}):(\d{2})\((\d+)\)' + _ROOM
+    for day, hr, mn, dur, room in re.findall(pattern1, str(sched_str)):
         start_min = int(hr) * 60 + int(mn) 
-        intervals.append({'day': day, 'start': start_min, 'end': start_min + int(dur)})
+        intervals.append({'day': day, 'start': start_min, 'end': start_min + int(dur), 'room': room})
         
     # 2. format: 수 13:30-16:30 밀양M03-3350
-    pattern2 = r'([월화수목금토일])\s*(\d{2}):(\d{2})-(\d{2}):(\d{2})'
-    for day, shr, smn, ehr, emn in re.findall(pattern2, str(sched_str)):
+    pattern2 = r'([월화수목금토일])\s*(\d{2}):(\d{2})-(\d{2}):(\d{2})' + _ROOM
+    for day, shr, smn, ehr, emn, room in re.findall(pattern2, str(sched_str)):
         start_min = int(shr) * 60 + int(smn)
         end_min = int(ehr) * 60 + int(emn)
-        intervals.append({'day': day, 'start': start_min, 'end': end_min})
+        intervals.append({'day': day, 'start': start_min, 'end': end_min, 'room': room})
         
     return intervals
 
@@ -54,3 +62,14 @@ def calculate_time_gap(list1, list2):
                     min_gap = min(min_gap, gap)
                     has_gap = True
     return min_gap if has_gap else 0
+
+def parse_clock_to_minutes(clock_str):
+    """
+    Parses a 'HH:MM' string into minutes from midnight. Returns None for empty input.
+    """
+    if not clock_str:
+        return None
+    match = re.fullmatch(r'(\d{1,2}):(\d{2})', str(clock_str).strip())
+    if not match:
+        raise ValueError(f"Invalid time '{clock_str}', expected HH:MM.")
+    return int(match.group(1)) * 60 + int(match.group(2))
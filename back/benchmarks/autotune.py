@@ -0,0 +1,282 @@
+"""
+Offline autotuner of the hard-penalty scale and the Simulated Annealing schedule (app/services/tuning.py).
+
+Draws a corpus of realistic requests from the catalog (1-6 mutually compatible mandatory lectures,
+12-24 target credits, half of them with a course group) and runs successive halving over random
+configurations (penalty scale x num_sweeps x beta range multipliers x schedule shape): every rung
+evaluates the surviving configurations on twice the requests with twice the reads, spread over
+worker processes, and keeps the best 1/ETA.
+
+A configuration is scored per request by its time-to-feasible-optimum,
+    TTS99 = t_read * log(0.01) / log(1 - p)
+the expected sampling time until one read, with 99% probability, is feasible (every mandatory
+lecture kept, no overlaps, course choices satisfied after repair) and reaches the best energy known
+for the request. p is the share of reads that do. Energies are always compared under the default
+weights, whatever penalties a configuration samples with. Configurations rank by the number of
+requests they never solve, then by the geometric mean TTS.
+
+--write saves the winner as the tuned profile the API loads as its defaults (data/tuned_profile.json,
+or TUNED_PROFILE_PATH), if it beats the current defaults on the whole corpus.
+
+Usage (from back/):  python -m benchmarks.autotune [--corpus 12] [--configs 27] [--workers 4] [--write]
+"""
+import argparse
+import concurrent.futures
+import itertools
+import math
+import multiprocessing
+import os
+import random
+import time
+
+import numpy as np
+
+from app.core.loader import load_lectures, get_catalog
+from app.services.bqm_builder import (DAYS, PAIR_OVERLAP, build_timetable_bqm, collect_choice_constraints,
+                                      collect_pair_structure, free_day_variable, num_bqm_variables,
+                                      repair_choice_constraints, sample_matrix)
+from app.services.quantum_optimizer import expand_course_groups, select_candidate_pool
+from app.services.tuning import annealing_parameters, scaled_penalties, write_profile
+
+import neal
+
+ETA = 3
+PENALTY_SCALES = (0.1, 0.25, 0.5, 1.0)
+NUM_SWEEPS = (100, 250, 500, 1000, 2000)
+HOT_SCALES = (0.1, 0.3, 1.0, 3.0)
+COLD_SCALES = (0.3, 1.0, 3.0)
+SCHEDULE_TYPES = ("geometric", "linear")
+DEFAULT_CONFIG = {"penalty_scale": 1.0, "num_sweeps": 1000, "beta_range_scale": [1.0, 1.0],
+                  "beta_schedule_type": "geometric"}
+# Energies within this of the best known one count as optimal
+ENERGY_TOLERANCE = 1e-6
+
+# -----------------------------------------------------------------------------
+# Corpus
+# -----------------------------------------------------------------------------
+
+def build_corpus(catalog, size, max_candidates, seed):
+    """`size` requests with their candidate pools and pair structures, drawn reproducibly from the catalog."""
+    rng = random.Random(seed)
+    weekday = [lec for lec in catalog.lectures
+               if "토" not in (lec.get("time_room") or "") and catalog.get_parsed_time(lec["id"])]
+    sections = {}
+    for lec in weekday:
+        sections.setdefault(lec["number"], []).append(lec["id"])
+    multi_section = sorted(number for number, ids in sections.items() if len(ids) >= 2)
+
+    cases = []
+    while len(cases) < size:
+        num_mandatory = rng.randint(1, 6)
+        chosen = []
+        for lec in rng.sample(weekday, 60):
+            if lec["number"] in {catalog.get_lecture(other)["number"] for other in chosen}:
+                continue
+            if all(not catalog.conflicts(lec["id"], other) for other in chosen):
+                chosen.append(lec["id"])
+            if len(chosen) == num_mandatory:
+                break
+        preferences = {"selected_lecture_ids": chosen, "mandatory_ids": chosen,
+                       "target_credits": float(rng.choice([12, 15, 18, 21, 24]))}
+        if rng.random() < 0.5:
+            preferences["course_groups"] = [[rng.choice(multi_section)]]
+
+        group_ids = expand_course_groups(catalog, preferences.get("course_groups"))
+        lectures = select_candidate_pool(catalog, chosen, max_candidates, required_ids=group_ids,
+                                         seed=rng.randrange(2**31))
+        cases.append({"preferences": preferences, "lectures": lectures,
+                      "pair_structure": collect_pair_structure(lectures, catalog.building_distance)})
+    return cases
+
+# -----------------------------------------------------------------------------
+# Evaluation (runs in worker processes)
+# -----------------------------------------------------------------------------
+
+_worker_cases = None
+_scorers = {}
+
+def _init_autotune_worker(cases):
+    global _worker_cases
+    _worker_cases = cases
+
+class _CaseScorer:
+    """Repairs samples of one request and scores them under the default weights (inf if infeasible)."""
+
+    def __init__(self, case):
+        lectures, preferences = case["lectures"], case["preferences"]
+        self.lectures = lectures
+        self.N = len(lectures)
+        self.bqm = build_timetable_bqm(lectures, preferences, pair_structure=case["pair_structure"])
+        self.priority = -np.array([self.bqm.get_linear(i) for i in range(self.N)])
+        self.choice_constraints = collect_choice_constraints(lectures, preferences)
+        positions = {lec["id"]: pos for pos, lec in enumerate(lectures)}
+        self.mandatory = np.array([positions[lec_id] for lec_id in preferences["mandatory_ids"] if lec_id in positions],
+                                  dtype=np.int64)
+        overlaps = [(i[kind == PAIR_OVERLAP], j[kind == PAIR_OVERLAP])
+                    for i, j, kind, _, _ in case["pair_structure"]["pairs"].values()]
+        self.overlap_i = np.concatenate([i for i, _ in overlaps]) if overlaps else np.empty(0, dtype=np.int64)
+        self.overlap_j = np.concatenate([j for _, j in overlaps]) if overlaps else np.empty(0, dtype=np.int64)
+        self.day_members = case["pair_structure"]["members"]
+
+    def energies(self, sampleset):
+        N = self.N
+        num_variables = num_bqm_variables(N)
+        samples, _ = sample_matrix(sampleset, num_variables)
+        bits = np.array([repair_choice_constraints(row, self.lectures, self.choice_constraints, self.priority)
+                         for row in samples[:, :N]], dtype=np.int8)
+        feasible = bits[:, self.mandatory].all(axis=1)
+        if len(self.overlap_i):
+            feasible &= ~(bits[:, self.overlap_i] & bits[:, self.overlap_j]).any(axis=1)
+
+        # Free-day variables follow the lectures (set iff no lecture meets that day)
+        full = np.zeros((len(bits), num_variables), dtype=np.int8)
+        full[:, :N] = bits
+        for day_idx, day in enumerate(DAYS):
+            members = self.day_members[day]
+            if len(members):
+                full[:, free_day_variable(N, day_idx)] = bits[:, members].sum(axis=1) == 0
+        energies = self.bqm.energies((full, range(num_variables)))
+        return np.where(feasible, energies, np.inf)
+
+def evaluate(config, case_index, reads, seed):
+    """Samples one request with one configuration. Returns (sampling ms per read, default-weight energy per read)."""
+    case = _worker_cases[case_index]
+    if case_index not in _scorers:
+        _scorers[case_index] = _CaseScorer(case)
+    preferences = dict(case["preferences"], **scaled_penalties(config["penalty_scale"]),
+                       num_sweeps=config["num_sweeps"], beta_range_scale=config["beta_range_scale"],
+                       beta_schedule_type=config["beta_schedule_type"])
+    bqm = build_timetable_bqm(case["lectures"], preferences, pair_structure=case["pair_structure"])
+    schedule = annealing_parameters(bqm, preferences)
+
+    start = time.perf_counter()
+    sampleset = neal.SimulatedAnnealingSampler().sample(bqm, num_reads=reads, seed=seed, **schedule)
+    ms_per_read = (time.perf_counter() - start) * 1000 / reads
+    return ms_per_read, _scorers[case_index].energies(sampleset)
+
+# -----------------------------------------------------------------------------
+# Search
+# -----------------------------------------------------------------------------
+
+def random_configs(count, rng):
+    """DEFAULT_CONFIG plus count-1 distinct random grid points."""
+    grid = [{"penalty_scale": scale, "num_sweeps": sweeps, "beta_range_scale": [hot, cold], "beta_schedule_type": shape}
+            for scale, sweeps, hot, cold, shape in itertools.product(
+                PENALTY_SCALES, NUM_SWEEPS, HOT_SCALES, COLD_SCALES, SCHEDULE_TYPES)]
+    grid = [config for config in grid if config != DEFAULT_CONFIG]
+    return [DEFAULT_CONFIG] + rng.sample(grid, min(count - 1, len(grid)))
+
+def tts99(ms_per_read, energies, best_energy):
+    hits = float(np.mean(energies <= best_energy + ENERGY_TOLERANCE * max(1.0, abs(best_energy))))
+    if hits == 0.0:
+        return math.inf
+    if hits == 1.0:
+        return ms_per_read
+    return ms_per_read * math.log(0.01) / math.log(1.0 - hits)
+
+def score(runs, best_known):
+    """(requests never solved, geometric mean TTS99 ms over the solved ones) of one configuration."""
+    values = [tts99(ms_per_read, energies, best_known[case_index])
+              for case_index, (ms_per_read, energies) in runs.items()]
+    finite = [value for value in values if math.isfinite(value)]
+    gmean = math.exp(sum(math.log(value) for value in finite) / len(finite)) if finite else math.inf
+    return len(values) - len(finite), gmean
+
+class Search:
+    def __init__(self, cases, workers, seed):
+        self.cases = cases
+        self.best_known = [math.inf] * len(cases)
+        self.seed = seed
+        self.executor = None
+        if workers > 1:
+            # spawn (not fork), as everywhere else; the corpus is shipped once per worker
+            self.executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_autotune_worker, initargs=(cases,))
+        else:
+            _init_autotune_worker(cases)
+
+    def run(self, configs, case_indices, reads, rung):
+        """{config index: {case index: (ms per read, energies)}}; also updates the best known energies."""
+        jobs = [(c, k, self.seed + 7919 * rung + 104729 * c + k) for c in configs for k in case_indices]
+        if self.executor is None:
+            outputs = [evaluate(configs[c], k, reads, seed) for c, k, seed in jobs]
+        else:
+            outputs = list(self.executor.map(evaluate, [configs[c] for c, _, _ in jobs],
+                                             [k for _, k, _ in jobs], [reads] * len(jobs), [seed for _, _, seed in jobs]))
+        runs = {c: {} for c in configs}
+        for (c, k, _), (ms_per_read, energies) in zip(jobs, outputs):
+            runs[c][k] = (ms_per_read, energies)
+            self.best_known[k] = min(self.best_known[k], float(energies.min()))
+        return runs
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+def successive_halving(search, configs, first_requests, first_reads):
+    survivors = dict(enumerate(configs))
+    num_requests, reads, rung = first_requests, first_reads, 0
+    while True:
+        case_indices = list(range(min(num_requests, len(search.cases))))
+        start = time.perf_counter()
+        runs = search.run(survivors, case_indices, reads, rung)
+        ranked = sorted(survivors, key=lambda c: score(runs[c], search.best_known))
+        print(f"rung {rung}: {len(survivors)} configs x {len(case_indices)} requests x {reads} reads "
+              f"({time.perf_counter() - start:.0f}s)")
+        for c in ranked[:ETA]:
+            unsolved, gmean = score(runs[c], search.best_known)
+            print(f"  {gmean:>9.1f} ms  unsolved {unsolved}  {survivors[c]}")
+        survivors = {c: survivors[c] for c in ranked[:max(1, math.ceil(len(survivors) / ETA))]}
+        if len(survivors) == 1:
+            return survivors[ranked[0]]
+        num_requests, reads, rung = num_requests * 2, reads * 2, rung + 1
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", type=int, default=12, help="Requests drawn from the catalog")
+    parser.add_argument("--max-candidates", type=int, default=150)
+    parser.add_argument("--configs", type=int, default=27)
+    parser.add_argument("--requests", type=int, default=3, help="Requests of the first rung")
+    parser.add_argument("--reads", type=int, default=50, help="Reads of the first rung")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--write", action="store_true", help="Save the winner as the API's tuned profile")
+    args = parser.parse_args()
+
+    load_lectures()
+    catalog = get_catalog()
+    rng = random.Random(args.seed)
+    cases = build_corpus(catalog, args.corpus, args.max_candidates, args.seed)
+    configs = random_configs(args.configs, rng)
+    print(f"Corpus: {len(cases)} requests ({args.max_candidates} candidates), {len(configs)} configurations, "
+          f"{args.workers} worker(s)")
+
+    search = Search(cases, args.workers, args.seed)
+    try:
+        winner = successive_halving(search, configs, args.requests, args.reads)
+
+        # Final comparison with the current defaults on the whole corpus
+        final_reads = args.reads * 4
+        finalists = [DEFAULT_CONFIG, winner] if winner != DEFAULT_CONFIG else [DEFAULT_CONFIG]
+        runs = search.run(dict(enumerate(finalists)), list(range(len(cases))), final_reads, rung=1000)
+    finally:
+        search.close()
+    default_score = score(runs[0], search.best_known)
+    tuned_score = score(runs[len(finalists) - 1], search.best_known)
+    print(f"defaults: {default_score[1]:.1f} ms (unsolved {default_score[0]}), "
+          f"tuned: {tuned_score[1]:.1f} ms (unsolved {tuned_score[0]})  {winner}")
+
+    if args.write:
+        if tuned_score >= default_score:
+            print("The tuned configuration does not beat the defaults; no profile written.")
+            return
+        defaults = dict(scaled_penalties(winner["penalty_scale"]), num_sweeps=winner["num_sweeps"],
+                        beta_range_scale=winner["beta_range_scale"], beta_schedule_type=winner["beta_schedule_type"])
+        path = write_profile(defaults, tuned_at=time.time(), penalty_scale=winner["penalty_scale"],
+                             corpus={"requests": len(cases), "max_candidates": args.max_candidates, "seed": args.seed},
+                             tts_ms={"default": round(default_score[1], 1), "tuned": round(tuned_score[1], 1)})
+        print(f"Wrote {path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,18 @@
+"""Model construction: pair structure (overlap / gap / distance analysis) and the full BQM build."""
+from app.services.bqm_builder import build_timetable_bqm, collect_pair_structure
+
+from conftest import ROUNDS, peak_memory_mb
+
+def bench_pair_structure(benchmark, catalog, make_case, record_case, size):
+    case = make_case(size, 3)
+    record_case(benchmark, case)
+    run = lambda: collect_pair_structure(case["lectures"], catalog.building_distance)
+    benchmark.extra_info["peak_memory_mb"] = peak_memory_mb(run)
+    benchmark.pedantic(run, rounds=ROUNDS[size], iterations=1)
+
+def bench_build_bqm(benchmark, make_case, record_case, size, num_mandatory):
+    case = make_case(size, num_mandatory)
+    record_case(benchmark, case)
+    run = lambda: build_timetable_bqm(case["lectures"], case["preferences"], pair_structure=case["pair_structure"])
+    benchmark.extra_info["peak_memory_mb"] = peak_memory_mb(run)
+    benchmark.pedantic(run, rounds=ROUNDS[size], iterations=1)
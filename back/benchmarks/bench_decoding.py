@@ -0,0 +1,22 @@
+"""Result decoding: constraint repair, deduplication and the energy breakdown of the top schedules."""
+import numpy as np
+import pytest
+
+from app.services.quantum_optimizer import decode_top_schedules
+
+from conftest import ROUNDS, peak_memory_mb
+
+neal = pytest.importorskip("neal")
+
+def bench_decode_top_schedules(benchmark, catalog, make_case, record_case, size, num_mandatory):
+    case = make_case(size, num_mandatory)
+    record_case(benchmark, case)
+    bqm = case["bqm"]
+    sampleset = neal.SimulatedAnnealingSampler().sample(bqm, num_reads=20, num_sweeps=100, seed=0)
+    priority = -np.array([bqm.get_linear(i) for i in range(len(case["lectures"]))])
+
+    run = lambda: decode_top_schedules(sampleset, case["lectures"], case["preferences"], priority=priority,
+                                       building_distance=catalog.building_distance)
+    benchmark.extra_info["peak_memory_mb"] = peak_memory_mb(run)
+    top_schedules = benchmark.pedantic(run, rounds=ROUNDS[size], iterations=1)
+    benchmark.extra_info["best_energy"] = top_schedules[0]["energy"] if top_schedules else None
@@ -0,0 +1,31 @@
+"""Samplers on the built BQM, with fixed seeds and read / sweep / time budgets; extra_info keeps the best energy."""
+import pytest
+
+from conftest import ROUNDS, peak_memory_mb
+
+neal = pytest.importorskip("neal")
+
+NEAL_READS = 10
+NEAL_SWEEPS = 100
+TABU_READS = 2
+TABU_TIMEOUT_MS = 200
+
+def _run_and_record(benchmark, sample, size):
+    benchmark.extra_info["peak_memory_mb"] = peak_memory_mb(sample)
+    sampleset = benchmark.pedantic(sample, rounds=ROUNDS[size], iterations=1)
+    benchmark.extra_info["best_energy"] = float(sampleset.first.energy)
+
+def bench_neal(benchmark, make_case, record_case, size, num_mandatory):
+    case = make_case(size, num_mandatory)
+    record_case(benchmark, case)
+    sampler = neal.SimulatedAnnealingSampler()
+    _run_and_record(benchmark, lambda: sampler.sample(case["bqm"], num_reads=NEAL_READS,
+                                                      num_sweeps=NEAL_SWEEPS, seed=0), size)
+
+def bench_tabu(benchmark, make_case, record_case, size):
+    samplers = pytest.importorskip("dwave.samplers")
+    case = make_case(size, 3)
+    record_case(benchmark, case)
+    sampler = samplers.TabuSampler()
+    _run_and_record(benchmark, lambda: sampler.sample(case["bqm"], num_reads=TABU_READS,
+                                                      timeout=TABU_TIMEOUT_MS, seed=0), size)
@@ -0,0 +1,88 @@
+"""
+Shared cases of the benchmark suite: the real catalog (data/lectures.csv) and candidate pools
+of N = 50 / 300 / 1000 / 4400 lectures with 1 / 3 / 8 mandatory lectures, all drawn with fixed
+seeds so that runs are comparable. N = 4400 asks for more weekday lectures than the catalog has,
+i.e. the whole catalog; every benchmark records the actual pool size in extra_info.
+
+Benchmarks taking a `size` and/or `num_mandatory` argument are parametrized automatically.
+"""
+import random
+import tracemalloc
+
+import pytest
+
+from app.core.loader import load_lectures, get_catalog
+from app.services.bqm_builder import build_timetable_bqm, collect_pair_structure
+from app.services.quantum_optimizer import select_candidate_pool
+
+SIZES = (50, 300, 1000, 4400)
+MANDATORY_COUNTS = (1, 3, 8)
+SEED = 1234
+# Timed rounds per pool size (single rounds for the pools that take seconds per call)
+ROUNDS = {50: 20, 300: 10, 1000: 3, 4400: 1}
+
+def pytest_generate_tests(metafunc):
+    if "size" in metafunc.fixturenames:
+        metafunc.parametrize("size", [
+            pytest.param(size, id=f"N{size}", marks=[pytest.mark.slow] if size >= 1000 else [])
+            for size in SIZES
+        ])
+    if "num_mandatory" in metafunc.fixturenames:
+        metafunc.parametrize("num_mandatory", MANDATORY_COUNTS, ids=[f"m{m}" for m in MANDATORY_COUNTS])
+
+def peak_memory_mb(fn):
+    """Peak Python/numpy heap allocated while running fn() once (native solver memory is not traced)."""
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(peak / 2**20, 2)
+
+def bqm_density(bqm):
+    n = bqm.num_variables
+    return round(bqm.num_interactions / (n * (n - 1) / 2), 4) if n > 1 else 0.0
+
+@pytest.fixture(scope="session")
+def catalog():
+    load_lectures()
+    return get_catalog()
+
+@pytest.fixture(scope="session")
+def make_case(catalog):
+    """make_case(size, num_mandatory) -> {"lectures", "preferences", "pair_structure", "bqm"}, built once per session."""
+    cases = {}
+
+    def make(size, num_mandatory):
+        key = (size, num_mandatory)
+        if key not in cases:
+            rng = random.Random(SEED + num_mandatory)
+            weekday_ids = [lec["id"] for lec in catalog.lectures if "토" not in (lec.get("time_room") or "")]
+            selected_ids = rng.sample(weekday_ids, num_mandatory)
+            preferences = {"selected_lecture_ids": selected_ids, "mandatory_ids": selected_ids}
+            lectures = select_candidate_pool(catalog, selected_ids, size, seed=SEED)
+            pair_structure = collect_pair_structure(lectures, catalog.building_distance)
+            cases[key] = {
+                "lectures": lectures,
+                "preferences": preferences,
+                "pair_structure": pair_structure,
+                "bqm": build_timetable_bqm(lectures, preferences, pair_structure=pair_structure),
+            }
+        return cases[key]
+
+    return make
+
+def record_bqm_info(benchmark, case):
+    bqm = case["bqm"]
+    benchmark.extra_info.update({
+        "lectures": len(case["lectures"]),
+        "variables": bqm.num_variables,
+        "interactions": bqm.num_interactions,
+        "density": bqm_density(bqm),
+    })
+
+@pytest.fixture
+def record_case():
+    """record_case(benchmark, case): stores the pool / BQM size and density in the benchmark's extra_info."""
+    return record_bqm_info
@@ -0,0 +1,81 @@
+"""
+Calibrates the latency cost model (app/services/cost_model.py) from real pipeline runs.
+
+Runs run_optimization (Simulated Annealing, dense credit term) over a grid of pool sizes and
+read counts, fits the per-stage coefficients to the recorded stage spans and prints predicted
+vs measured total times. With --write the fit is saved as the profile the service loads
+(data/cost_model.json, or COST_MODEL_PATH).
+
+Usage (from back/):  python -m benchmarks.cost_model [--sizes 50 100 200 400] [--reads 20 100 300]
+                     [--sweeps 250 1000] [--write]
+"""
+import argparse
+import json
+import random
+import time
+
+from app.core.loader import load_lectures, get_catalog
+from app.services import cost_model
+from app.services.quantum_optimizer import run_optimization
+
+def measure(catalog, size, reads, batch_size, seed, num_sweeps=None):
+    rng = random.Random(seed + size)
+    selected_ids = [lec["id"] for lec in rng.sample(catalog.lectures, 2)]
+    preferences = {"selected_lecture_ids": selected_ids, "max_candidates": size, "total_reads": reads,
+                   "batch_size": batch_size, "pool_seed": seed, "num_sweeps": num_sweeps}
+    result = run_optimization(preferences, catalog=catalog, log_prefix="calibration")
+    stages = {}
+    for span in result["timings"]["spans"]:
+        if span["stage"] in cost_model.STAGES:
+            stages[span["stage"]] = stages.get(span["stage"], 0.0) + span["duration_ms"]
+    return {"num_lectures": result["pool_size"], "total_reads": reads, "batch_size": batch_size,
+            "num_sweeps": num_sweeps, "stages": stages, "total_ms": result["timings"]["total_ms"]}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 100, 200, 400])
+    parser.add_argument("--reads", type=int, nargs="+", default=[20, 100, 300])
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--sweeps", type=int, nargs="+", default=[None],
+                        help="num_sweeps values to calibrate over (default: neal's)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--write", action="store_true", help="Save the fit as the service's cost model profile")
+    args = parser.parse_args()
+
+    load_lectures()
+    catalog = get_catalog()
+    # Warm-up (imports, catalog memos) so that the first grid point is not an outlier
+    measure(catalog, 20, 10, 10, args.seed)
+
+    rows = []
+    for size in args.sizes:
+        for reads in args.reads:
+            for num_sweeps in args.sweeps:
+                rows.append(measure(catalog, size, reads, min(reads, args.batch_size), args.seed, num_sweeps))
+                print(f"measured N={rows[-1]['num_lectures']} reads={reads} sweeps={num_sweeps or 'default'}: "
+                      f"{rows[-1]['total_ms']:.0f} ms")
+
+    coefficients = cost_model.fit_coefficients(rows)
+    print(json.dumps(coefficients, indent=2))
+
+    header = f"{'N':>6} {'reads':>6} {'sweeps':>7} {'measured':>10} {'predicted':>10} {'error':>7}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        predicted = sum(
+            sum(c * x for c, x in zip(coefficients[stage], cost_model.stage_features(
+                stage, row["num_lectures"], row["total_reads"], row["batch_size"], row["num_sweeps"])))
+            for stage in cost_model.STAGES)
+        measured = sum(row["stages"].values())
+        print(f"{row['num_lectures']:>6} {row['total_reads']:>6} {row['num_sweeps'] or '-':>7} {measured:>8.0f}ms {predicted:>8.0f}ms "
+              f"{(predicted - measured) / measured:>+7.0%}")
+
+    if args.write:
+        path = cost_model.profile_path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"fitted_at": time.time(), "runs": len(rows), "coefficients": coefficients}, f, indent=2)
+        print(f"Wrote {path}")
+
+if __name__ == "__main__":
+    main()
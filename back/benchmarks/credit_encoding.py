@@ -0,0 +1,88 @@
+"""
+Compares the credit-target encodings of bqm_builder (dense / cqm):
+model size, build time and the quality of the schedules Simulated Annealing finds.
+
+Quality is measured on the dense model: every sample is scored by its lecture and free-day
+bits only, so the encodings are compared on the same objective.
+
+Usage (from back/):  python -m benchmarks.credit_encoding [--sizes 50 300 1000] [--reads 100]
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+
+from app.core.loader import load_lectures, get_catalog
+from app.services.bqm_builder import (CREDIT_ENCODINGS, build_timetable_bqm, build_timetable_cqm,
+                                      collect_pair_structure, num_bqm_variables, sample_matrix)
+from app.services.quantum_optimizer import select_candidate_pool
+
+try:
+    import neal
+except ImportError:
+    neal = None
+
+def cqm_size(cqm):
+    """(variables, interactions) of a CQM: objective interactions + constraint terms."""
+    interactions = cqm.objective.num_interactions
+    for constraint in cqm.constraints.values():
+        interactions += constraint.lhs.num_interactions + len(constraint.lhs.linear)
+    return len(cqm.variables), interactions
+
+def run_case(lectures, preferences, encoding, pair_structure, reads, dense_bqm):
+    prefs = dict(preferences, credit_encoding=encoding)
+    start = time.perf_counter()
+    if encoding == "cqm":
+        model = build_timetable_cqm(lectures, prefs, pair_structure=pair_structure)
+        build_s = time.perf_counter() - start
+        variables, interactions = cqm_size(model)
+        return {"variables": variables, "interactions": interactions, "build_s": build_s}
+
+    model = build_timetable_bqm(lectures, prefs, pair_structure=pair_structure)
+    build_s = time.perf_counter() - start
+    row = {"variables": model.num_variables, "interactions": model.num_interactions, "build_s": build_s}
+
+    if neal is not None and reads > 0:
+        start = time.perf_counter()
+        sampleset = neal.SimulatedAnnealingSampler().sample(model, num_reads=reads, seed=0)
+        row["sample_s"] = time.perf_counter() - start
+
+        num_variables = num_bqm_variables(len(lectures))
+        samples, _ = sample_matrix(sampleset, num_variables)
+        energies = dense_bqm.energies((samples, list(range(num_variables))))
+        row["best_energy"] = float(energies.min())
+        row["median_energy"] = float(np.median(energies))
+    return row
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 300, 1000])
+    parser.add_argument("--reads", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    load_lectures()
+    catalog = get_catalog()
+
+    header = f"{'N':>6} {'encoding':>9} {'vars':>7} {'interactions':>13} {'build':>8} {'sample':>8} {'best E':>12} {'median E':>12}"
+    print(header)
+    print("-" * len(header))
+    for size in args.sizes:
+        random.seed(args.seed)
+        selected_ids = [lec["id"] for lec in catalog.lectures[1000:1004]]
+        lectures = select_candidate_pool(catalog, selected_ids, size)
+        preferences = {"mandatory_ids": selected_ids, "target_credits": 21.0}
+        pair_structure = collect_pair_structure(lectures, catalog.building_distance)
+        dense_bqm = build_timetable_bqm(lectures, preferences, pair_structure=pair_structure)
+
+        for encoding in CREDIT_ENCODINGS:
+            row = run_case(lectures, preferences, encoding, pair_structure, args.reads, dense_bqm)
+            sample_s = f"{row['sample_s']:.2f}s" if "sample_s" in row else "-"
+            best = f"{row['best_energy']:.1f}" if "best_energy" in row else "-"
+            median = f"{row['median_energy']:.1f}" if "median_energy" in row else "-"
+            print(f"{len(lectures):>6} {encoding:>9} {row['variables']:>7} {row['interactions']:>13} "
+                  f"{row['build_s']:>7.2f}s {sample_s:>8} {best:>12} {median:>12}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""
+Closed-loop HTTP load generator for the optimization API (registration-day traffic).
+
+Every virtual user repeatedly submits a request (POST /api/optimize), polls
+GET /api/optimize/{task_id} like the frontend until the task is SUCCESS / FAILURE and reads the
+result from the final poll, then optionally thinks before the next request. Requests are drawn
+from the catalog with a fixed seed: 1-8 non-conflicting mandatory lectures, mostly from one
+department, varied credit targets, sometimes a course group or a free-day preference.
+
+Reported: throughput, submit-to-result latency p50/p95/p99, submit latency, and the polling
+overhead (polls per task, share answered 304 Not Modified, poll request latency, share of the latency
+spent inside poll requests). Polls are conditional (If-None-Match with the last ETag).
+
+Usage (from back/):
+  python -m benchmarks.load_test --users 200                       # against an in-process uvicorn server
+  python -m benchmarks.load_test --url http://localhost:8000 --users 50 --duration 120
+The request mix is built from the local data/lectures.csv, so a remote server must serve the same catalog.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import random
+import socket
+import threading
+import time
+
+import httpx
+import numpy as np
+
+from app.core.loader import load_lectures, get_catalog
+
+TERMINAL_STATUSES = ("SUCCESS", "FAILURE")
+
+# -----------------------------------------------------------------------------
+# Request mix
+# -----------------------------------------------------------------------------
+
+def _department(lecture):
+    return lecture["number"][:2]
+
+def build_request_mix(catalog, count, seed, max_candidates, total_reads):
+    """`count` OptimizationRequest payloads drawn from the catalog with a fixed seed."""
+    rng = random.Random(seed)
+    weekday = [lec for lec in catalog.lectures if "토" not in (lec.get("time_room") or "") and lec.get("time_room")]
+    by_department = {}
+    for lec in weekday:
+        by_department.setdefault(_department(lec), []).append(lec)
+    departments = [dept for dept, lecs in by_department.items() if len(lecs) >= 10]
+    sections = {}
+    for lec in weekday:
+        sections.setdefault(lec["number"], []).append(lec["id"])
+    multi_section = [number for number, ids in sections.items() if len(ids) > 1]
+
+    payloads = []
+    for _ in range(count):
+        home = by_department[rng.choice(departments)]
+        num_mandatory = rng.choice((1, 2, 3, 3, 4, 5, 6, 8))
+        selected = []
+        for _attempt in range(num_mandatory * 5):
+            if len(selected) == num_mandatory:
+                break
+            # Mostly courses of the student's department, some electives from anywhere
+            lec = rng.choice(home) if rng.random() < 0.8 else rng.choice(weekday)
+            if all(lec["id"] != other and not catalog.conflicts(lec["id"], other) for other in selected):
+                selected.append(lec["id"])
+
+        payload = {
+            "selected_lecture_ids": selected,
+            "target_credits": float(rng.choice((15, 17, 18, 19, 21))),
+            "max_candidates": max_candidates,
+            "total_reads": total_reads,
+            "batch_size": total_reads,
+        }
+        if rng.random() < 0.3 and multi_section:
+            payload["course_groups"] = [[rng.choice(multi_section)]]
+        if rng.random() < 0.5:
+            payload["r_free_day"] = float(rng.choice((50, 100, 300)))
+        payloads.append(payload)
+    return payloads
+
+# -----------------------------------------------------------------------------
+# Virtual users
+# -----------------------------------------------------------------------------
+
+async def run_task(client, payload, poll_interval, task_timeout):
+    """Submits one request and polls it to completion. Returns the per-task record."""
+    record = {"status": None, "submit_s": None, "latency_s": None, "polls": 0, "not_modified": 0, "poll_s": 0.0,
+              "server_ms": None}
+    start = time.perf_counter()
+    try:
+        response = await client.post("/api/optimize", json=payload)
+        record["submit_s"] = time.perf_counter() - start
+        response.raise_for_status()
+        task_id = response.json()["task_id"]
+
+        etag = None
+        while True:
+            await asyncio.sleep(poll_interval)
+            poll_start = time.perf_counter()
+            # Conditional poll: an unchanged task costs an empty 304
+            response = await client.get(f"/api/optimize/{task_id}", headers={"If-None-Match": etag} if etag else None)
+            record["poll_s"] += time.perf_counter() - poll_start
+            record["polls"] += 1
+            if response.status_code == 304:
+                record["not_modified"] += 1
+                continue
+            response.raise_for_status()
+            etag = response.headers.get("ETag")
+            task = response.json()
+            if task["status"] in TERMINAL_STATUSES:
+                record["status"] = task["status"]
+                record["latency_s"] = time.perf_counter() - start
+                timings = (task.get("result") or {}).get("timings")
+                if timings:
+                    record["server_ms"] = timings["total_ms"]
+                return record
+            if time.perf_counter() - start > task_timeout:
+                record["status"] = "TIMEOUT"
+                return record
+    except (httpx.HTTPError, KeyError, ValueError) as e:
+        record["status"] = "ERROR"
+        record["error"] = str(e) or type(e).__name__
+        return record
+
+async def virtual_user(client, payloads, records, stop_at, args):
+    for payload in payloads:
+        if stop_at is not None and time.perf_counter() >= stop_at:
+            return
+        records.append(await run_task(client, payload, args.poll_interval, args.task_timeout))
+        if args.think_time:
+            await asyncio.sleep(args.think_time)
+
+async def drive(base_url, payloads_per_user, args):
+    limits = httpx.Limits(max_connections=args.users, max_keepalive_connections=args.users)
+    records = []
+    stop_at = time.perf_counter() + args.duration if args.duration else None
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=args.http_timeout) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(virtual_user(client, payloads, records, stop_at, args)
+                               for payloads in payloads_per_user))
+        wall_s = time.perf_counter() - start
+    return records, wall_s
+
+# -----------------------------------------------------------------------------
+# In-process server
+# -----------------------------------------------------------------------------
+
+@contextlib.contextmanager
+def in_process_server():
+    """Runs the app under uvicorn in a background thread on a free local port and yields its URL."""
+    import uvicorn
+    from app.main import app
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("In-process server failed to start.")
+        time.sleep(0.05)
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        thread.join(timeout=30)
+
+# -----------------------------------------------------------------------------
+# Report
+# -----------------------------------------------------------------------------
+
+def _percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": round(float(p50), 3), "p95": round(float(p95), 3), "p99": round(float(p99), 3),
+            "max": round(float(max(values)), 3)}
+
+def summarize(records, wall_s, args):
+    done = [r for r in records if r["status"] in TERMINAL_STATUSES]
+    latencies = [r["latency_s"] for r in done]
+    polls = [r["polls"] for r in done]
+    poll_request_s = [r["poll_s"] / r["polls"] for r in done if r["polls"]]
+    return {
+        "users": args.users,
+        "tasks": len(records),
+        "by_status": {status: sum(1 for r in records if r["status"] == status)
+                      for status in sorted({r["status"] for r in records})},
+        "wall_s": round(wall_s, 2),
+        "throughput_per_s": round(len(done) / wall_s, 3) if wall_s else None,
+        "latency_s": _percentiles(latencies),
+        "submit_s": _percentiles([r["submit_s"] for r in records if r["submit_s"] is not None]),
+        "server_s": _percentiles([r["server_ms"] / 1000 for r in done if r["server_ms"] is not None]),
+        "polls_per_task": round(float(np.mean(polls)), 2) if polls else None,
+        "not_modified_share": round(sum(r["not_modified"] for r in done) / sum(polls), 4) if sum(polls) else None,
+        "poll_request_s": _percentiles(poll_request_s),
+        "poll_share_of_latency": round(sum(r["poll_s"] for r in done) / sum(latencies), 4) if latencies else None,
+        "errors": sorted({r["error"] for r in records if r.get("error")})[:10],
+    }
+
+def print_report(summary):
+    print(f"\n{summary['tasks']} tasks from {summary['users']} users in {summary['wall_s']}s: {summary['by_status']}")
+    print(f"Throughput: {summary['throughput_per_s']} results/s")
+    print(f"{'':24}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for key, label in (("latency_s", "submit-to-result (s)"), ("server_s", "server pipeline (s)"),
+                       ("submit_s", "submit request (s)"), ("poll_request_s", "poll request (s)")):
+        row = summary[key]
+        print(f"{label:24}" + "".join(f"{row[p]:>9}" if row[p] is not None else f"{'-':>9}"
+                                      for p in ("p50", "p95", "p99", "max")))
+    print(f"Polls per task: {summary['polls_per_task']} ({summary['not_modified_share']} answered 304), "
+          f"time inside poll requests: {summary['poll_share_of_latency']} of the latency")
+    for error in summary["errors"]:
+        print(f"  error: {error}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=None, help="Server to load (default: start one in-process)")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--requests-per-user", type=int, default=1)
+    parser.add_argument("--duration", type=float, default=None,
+                        help="Stop submitting after this many seconds (users cycle through their requests)")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds between polls (frontend: 1s)")
+    parser.add_argument("--think-time", type=float, default=0.0)
+    parser.add_argument("--task-timeout", type=float, default=600.0)
+    parser.add_argument("--http-timeout", type=float, default=60.0)
+    parser.add_argument("--max-candidates", type=int, default=300)
+    parser.add_argument("--total-reads", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--server-log", action="store_true", help="Keep the in-process server's output")
+    parser.add_argument("--json", default=None, help="Also write the summary to this file")
+    args = parser.parse_args()
+
+    load_lectures()
+    requests_per_user = args.requests_per_user
+    if args.duration:
+        # Enough requests to keep every user busy for the whole duration
+        requests_per_user = max(requests_per_user, int(args.duration / args.poll_interval) + 1)
+    mix = build_request_mix(get_catalog(), args.users * requests_per_user, args.seed,
+                            args.max_candidates, args.total_reads)
+    payloads_per_user = [mix[u::args.users] for u in range(args.users)]
+
+    if args.url:
+        records, wall_s = asyncio.run(drive(args.url, payloads_per_user, args))
+    else:
+        server_output = contextlib.nullcontext() if args.server_log else contextlib.redirect_stdout(io.StringIO())
+        with in_process_server() as url, server_output:
+            records, wall_s = asyncio.run(drive(url, payloads_per_user, args))
+
+    summary = summarize(records, wall_s, args)
+    print_report(summary)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Exercises the quantum annealing path offline against the local stand-in QPU (samplers.MockQPUSampler):
+embedding time, qubit usage and chain lengths per problem size, plus the
+timeout and failure fallbacks. No D-Wave token or network access needed.
+
+Usage (from back/):  python -m benchmarks.qpu_path [--sizes 20 40 60] [--timeout 60] [--latency 0.2]
+"""
+import argparse
+import multiprocessing
+import random
+import threading
+import time
+
+from app.core.loader import load_lectures, get_catalog
+from app.services.bqm_builder import build_timetable_bqm, collect_pair_structure
+from app.services.quantum_optimizer import select_candidate_pool, sample_bqm
+from app.services.samplers import sample_embedded
+
+def embed_case(bqm, preferences, timeout):
+    start = time.perf_counter()
+    try:
+        sampleset, _, _ = sample_embedded("mock_qpu", preferences, bqm, timeout, use_cache=False, num_reads=10)
+    except multiprocessing.TimeoutError:
+        return {"status": "timeout", "seconds": time.perf_counter() - start}
+    except Exception as e:
+        return {"status": f"error: {str(e)[:40]}", "seconds": time.perf_counter() - start}
+    chains = [len(chain) for chain in sampleset.info["embedding_context"]["embedding"].values()]
+    return {"status": "ok", "seconds": time.perf_counter() - start,
+            "qubits": sum(chains), "max_chain": max(chains, default=0)}
+
+def fallback_case(bqm, preferences):
+    """Runs sample_bqm end to end and reports its wall time and leftover threads / processes."""
+    start = time.perf_counter()
+    sample_bqm(bqm, preferences, log_prefix="bench")
+    return (time.perf_counter() - start, threading.active_count(), len(multiprocessing.active_children()))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[20, 40, 60])
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    load_lectures()
+    catalog = get_catalog()
+    selected_ids = [lec["id"] for lec in catalog.lectures[1000:1002]]
+    base = {"mandatory_ids": selected_ids, "target_credits": 21.0, "mock_qpu_latency": args.latency}
+
+    header = f"{'N':>5} {'vars':>6} {'interactions':>13} {'status':>10} {'time':>8} {'qubits':>7} {'max chain':>10}"
+    print(header)
+    print("-" * len(header))
+    for size in args.sizes:
+        random.seed(args.seed)
+        lectures = select_candidate_pool(catalog, selected_ids, size)
+        pair_structure = collect_pair_structure(lectures, catalog.building_distance)
+        bqm = build_timetable_bqm(lectures, base, pair_structure=pair_structure)
+        row = embed_case(bqm, base, args.timeout)
+        print(f"{len(lectures):>5} {bqm.num_variables:>6} {bqm.num_interactions:>13} "
+              f"{row['status']:>10} {row['seconds']:>7.2f}s {row.get('qubits', '-'):>7} {row.get('max_chain', '-'):>10}")
+
+    # Fallback paths: QPU latency beyond the timeout, and a failing solver
+    random.seed(args.seed)
+    lectures = select_candidate_pool(catalog, selected_ids, args.sizes[0])
+    bqm = build_timetable_bqm(lectures, base)
+    quantum = dict(base, use_quantum_annealing=True, qpu_sampler="mock_qpu", total_reads=20, batch_size=20)
+    for name, overrides in [("timeout", {"mock_qpu_latency": 30, "qpu_timeout": 3}),
+                            ("failure", {"mock_qpu_failure_rate": 1.0})]:
+        seconds, threads, children = fallback_case(bqm, dict(quantum, **overrides))
+        print(f"fallback on {name}: {seconds:.2f}s total, {threads} thread(s) and {children} worker process(es) left")
+
+if __name__ == "__main__":
+    main()